@@ -0,0 +1,178 @@
+"""
+Testdata voor de benchmarks: berichten uit testdata/, stores van een
+opgegeven grootte en een geinitialiseerde daemon module (dvs-daemon.py)
+met een vaste, virtuele klok. Alles wordt opgebouwd vanaf een vast
+tijdstip, zodat iedere run dezelfde data en dezelfde paden doorloopt.
+"""
+
+import os
+import datetime
+import glob
+import imp
+import itertools
+import threading
+import time
+import cPickle as pickle
+import pytz
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+import infoplus_dvs
+import dvs_gc
+import dvs_klok
+import dvs_metrics
+import dvs_replay
+
+# Vast tijdstip voor stores en klok (de dag van de testdata):
+TIJD_NU = datetime.datetime(2013, 11, 9, 12, 0, tzinfo=pytz.utc)
+
+# Sjabloon voor gegenereerde berichten, zoals voor de dag-archieven:
+dag_archief = imp.load_source('dag_archief', os.path.join(ROOT, 'tools', 'dvs-dag-archief.py'))
+
+
+def laad_berichten(bron):
+    """
+    Laad alle berichten (XML) uit testdata/<bron> (formatted of treinlog),
+    in volgorde van TimeStamp
+    """
+
+    pad = os.path.join(ROOT, 'testdata', bron)
+
+    if bron == 'formatted':
+        berichten = []
+        for bestand in sorted(glob.glob(os.path.join(pad, '*.xml'))):
+            with open(bestand) as xml:
+                berichten.append(xml.read())
+        return berichten
+
+    return list(dvs_replay.lees_archief(pad))
+
+
+def laad_treinen():
+    """
+    Parse alle treinen uit testdata/formatted; geeft de treinen gepickled,
+    als voorbeelden voor maak_trein
+    """
+
+    return [pickle.dumps(infoplus_dvs.parse_trein(bericht), -1) for bericht in laad_berichten('formatted')]
+
+
+def vertrektijd(nummer):
+    """
+    Geef de geplande vertrektijd voor treinnummer: verspreid over de dag,
+    en minimaal 70 minuten na TIJD_NU (zodat een nieuwe trein in de stores
+    niet als te laat ontvangen telt en de GC deze niet opruimt)
+    """
+
+    return TIJD_NU + datetime.timedelta(minutes=70, seconds=nummer * 7 % 86400)
+
+
+def maak_trein(voorbeelden, nummer, station_code):
+    """
+    Maak een kopie van een voorbeeldtrein (zie laad_treinen) voor
+    treinnummer en station
+    """
+
+    trein = pickle.loads(voorbeelden[nummer % len(voorbeelden)])
+    trein.treinnr = str(100000 + nummer)
+    trein.rit_id = trein.treinnr
+    trein.rit_station = infoplus_dvs.Station(station_code, station_code)
+    trein.vertrek = vertrektijd(nummer)
+    trein.vertrek_actueel = trein.vertrek + datetime.timedelta(seconds=trein.vertraging)
+    trein.rit_timestamp = TIJD_NU
+    trein.status = '0'
+
+    return trein
+
+
+def station_code(vertrek, stations, stops):
+    """
+    Geef het station voor vertrek (volgnummer), met stops stations per trein
+    """
+
+    return 'S%03d' % (((vertrek // stops) * 7 + vertrek) % stations)
+
+
+def maak_stores(voorbeelden, aantal, stations, stops):
+    """
+    Maak station store en trein store met in totaal aantal vertrekken,
+    verdeeld over stations, met stops stations per trein
+    """
+
+    station_store = {}
+    trein_store = {}
+
+    for vertrek in range(aantal):
+        code = station_code(vertrek, stations, stops)
+        trein = maak_trein(voorbeelden, vertrek // stops, code)
+
+        station_store.setdefault(code, {})[trein.treinnr] = trein
+        trein_store.setdefault(trein.treinnr, {})[code] = trein
+
+    return station_store, trein_store
+
+
+def maak_berichten(aantal, stations, stops, status='0', seconden=0):
+    """
+    Maak een DVS bericht (XML) voor ieder van aantal vertrekken, zoals in
+    maak_stores; met seconden wordt de TimeStamp later (voor updates)
+    """
+
+    sjabloon = dag_archief.maak_sjabloon()
+    berichten = []
+
+    for vertrek in range(aantal):
+        nummer = vertrek // stops
+        tijd = TIJD_NU + datetime.timedelta(seconds=seconden, milliseconds=vertrek)
+        vertrek_iso = dag_archief.iso(vertrektijd(nummer))
+
+        berichten.append(sjabloon % {
+            'tijd': tijd.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (tijd.microsecond // 1000),
+            'nr': str(100000 + nummer), 'datum': TIJD_NU.strftime('%Y-%m-%d'),
+            'station': station_code(vertrek, stations, stops), 'status': status,
+            'vertrek': vertrek_iso, 'actueel': vertrek_iso,
+            'vertraging': 'PT0S'})
+
+    return berichten
+
+
+def laad_daemon(station_store=None, trein_store=None):
+    """
+    Laad dvs-daemon.py als module en initialiseer de globals zoals main()
+    dat doet (zonder sockets, WAL of change feed), met de gegeven stores
+    en een virtuele klok op TIJD_NU
+    """
+
+    daemon = imp.load_source('dvs_daemon', os.path.join(ROOT, 'dvs-daemon.py'))
+
+    daemon.station_store = station_store if station_store is not None else {}
+    daemon.trein_store = trein_store if trein_store is not None else {}
+
+    daemon.locks = dict((naam, threading.Lock()) for naam in ('trein', 'station', 'export', 'snapshot', 'feed'))
+    daemon.exports = {}
+
+    daemon.basis_versie = int(time.time() * 1000000)
+    daemon.versie_teller = itertools.count(daemon.basis_versie + 1)
+    daemon.station_versies = {}
+
+    daemon.counters = dict((naam, 0) for naam in ('msg', 'dubbel', 'ouder', 'laat', 'gc_station',
+        'gc_trein', 'injecties', 'feed', 'feed_verloren'))
+
+    daemon.metrieken = {
+        'parse_ms': dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS),
+        'verwerk_ms': dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS),
+        'gc_ms': dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS),
+        'berichten_per_seconde': None,
+        'starttijd': time.time()
+    }
+
+    daemon.system_status = {'status': 'UP', 'down_since': None, 'recovering_since': None}
+    daemon.message_queue = None
+    daemon.feed_queue = None
+    daemon.wal = None
+    daemon.snapshot_status = None
+    daemon.klok = dvs_klok.VirtueleKlok(dvs_klok.timestamp(TIJD_NU))
+
+    daemon.gc_beleid = dvs_gc.GcBeleid({})
+
+    return daemon
@@ -0,0 +1,277 @@
+"""
+Benchmarks voor de drukste paden van de daemon en de HTTP interface. Iedere
+benchmark is een functie die de opties van dvs-bench.py krijgt en een dict
+met resultaten (zie resultaat) geeft; BENCHMARKS koppelt de namen aan de
+functies.
+
+Iedere meting wordt eerst eenmaal uitgevoerd om op te warmen, en daarna
+opties.herhalingen keer; de waarde van een resultaat is de mediaan.
+"""
+
+import os
+import gc
+import shutil
+import tempfile
+import threading
+import time
+import zmq
+
+import infoplus_dvs
+import dvs_http_parsers
+
+import bench_data
+
+
+def resultaat(eenheid, hoger_beter, metingen, **extra):
+    """
+    Geef een resultaat: de mediaan van metingen (een per herhaling) in
+    eenheid, en of een hogere waarde beter is
+    """
+
+    gesorteerd = sorted(metingen)
+    resultaat = {
+        'waarde': gesorteerd[len(gesorteerd) // 2],
+        'eenheid': eenheid,
+        'hoger_beter': hoger_beter,
+        'metingen': metingen
+    }
+    resultaat.update(extra)
+
+    return resultaat
+
+
+def herhaal(opties, meting):
+    """
+    Voer meting eenmaal uit om op te warmen en daarna opties.herhalingen
+    keer, met een volledige collectie vooraf; geeft de meetwaarden
+    """
+
+    meting()
+
+    metingen = []
+    for _ in range(opties.herhalingen):
+        gc.collect()
+        metingen.append(meting())
+
+    return metingen
+
+
+def per_seconde(aantal, functie):
+    """
+    Voer functie uit en geef het aantal verwerkte items per seconde
+    """
+
+    start = time.time()
+    functie()
+    return aantal / (time.time() - start)
+
+
+def percentiel(gesorteerd, percentage):
+    return gesorteerd[min(len(gesorteerd) - 1, int(len(gesorteerd) * percentage / 100.0))]
+
+
+def meet_parse(opties):
+    """
+    infoplus_dvs.parse_trein over de berichten in testdata/formatted en
+    testdata/treinlog (opties.berichten berichten per meting)
+    """
+
+    resultaten = {}
+
+    for bron in ('formatted', 'treinlog'):
+        berichten = bench_data.laad_berichten(bron)
+        reeks = [berichten[nummer % len(berichten)] for nummer in range(opties.berichten)]
+
+        def parse():
+            for bericht in reeks:
+                infoplus_dvs.parse_trein(bericht)
+
+        resultaten['parse.%s' % bron] = resultaat('berichten/s', True,
+            herhaal(opties, lambda: per_seconde(len(reeks), parse)))
+
+    return resultaten
+
+
+def meet_apply(opties):
+    """
+    WorkerThread.verwerk voor opties.berichten nieuwe vertrekken (insert) en
+    daarna een update voor ieder vertrek, in lege stores. Naast het totaal
+    (parsen en verwerken) wordt het verwerken in de stores apart gemeten,
+    via de verwerk_ms meetwaarde van de worker.
+    """
+
+    daemon = bench_data.laad_daemon()
+    worker = daemon.WorkerThread(False)
+
+    berichten = {
+        'insert': bench_data.maak_berichten(opties.berichten, opties.stations, opties.stops),
+        'update': bench_data.maak_berichten(opties.berichten, opties.stations, opties.stops, seconden=60)
+    }
+
+    metingen = dict((naam, []) for naam in ('worker', 'insert', 'update'))
+
+    def meting():
+        daemon.station_store.clear()
+        daemon.trein_store.clear()
+        totaal = 0
+
+        for soort in ('insert', 'update'):
+            verwerk_ms = daemon.metrieken['verwerk_ms'].samenvatting()['totaal']
+
+            start = time.time()
+            for bericht in berichten[soort]:
+                worker.verwerk(bericht)
+            totaal += time.time() - start
+
+            verwerk_ms = daemon.metrieken['verwerk_ms'].samenvatting()['totaal'] - verwerk_ms
+            metingen[soort].append(len(berichten[soort]) / (verwerk_ms / 1000.0))
+
+        metingen['worker'].append(2 * opties.berichten / totaal)
+
+    herhaal(opties, meting)
+
+    # Zonder de opwarmronde:
+    return {
+        'worker.verwerk': resultaat('berichten/s', True, metingen['worker'][1:]),
+        'apply.insert': resultaat('berichten/s', True, metingen['insert'][1:]),
+        'apply.update': resultaat('berichten/s', True, metingen['update'][1:])
+    }
+
+
+def meet_client(opties):
+    """
+    Latency van client opdrachten via de ROUTER socket van de ClientThread
+    (REQ client, round trip) bij stores van opties.grootte vertrekken;
+    per meting opties.opdrachten keer iedere opdracht
+    """
+
+    voorbeelden = bench_data.laad_treinen()
+    station_store, trein_store = bench_data.maak_stores(voorbeelden, opties.grootte,
+        opties.stations, opties.stops)
+    daemon = bench_data.laad_daemon(station_store, trein_store)
+
+    directory = tempfile.mkdtemp(prefix='dvs-bench-')
+    bind = 'ipc://%s' % os.path.join(directory, 'client')
+
+    client_thread = daemon.ClientThread(bind, daemon.ClientStatistieken({}), {})
+    client_thread.daemon = True
+    client_thread.start()
+
+    opdrachten = [
+        ('status', 'status'),
+        ('versie', 'versie/S001'),
+        ('station', 'station/S001'),
+        ('venster', 'venster/S001///20'),
+        ('trein', 'trein/%s' % sorted(trein_store)[len(trein_store) // 2]),
+        ('stations', 'stations/%s' % ','.join(sorted(station_store)[:10]))
+    ]
+
+    context = zmq.Context()
+    client = context.socket(zmq.REQ)
+    client.connect(bind)
+
+    latencies = dict((naam, []) for naam, _ in opdrachten)
+
+    def meting(naam, opdracht):
+        duur = []
+        for _ in range(opties.opdrachten):
+            start = time.time()
+            client.send(opdracht)
+            client.recv()
+            duur.append((time.time() - start) * 1000)
+
+        duur.sort()
+        latencies[naam].extend(duur)
+        return percentiel(duur, 50)
+
+    try:
+        resultaten = {}
+        for naam, opdracht in opdrachten:
+            metingen = herhaal(opties, lambda: meting(naam, opdracht))
+            alle = sorted(latencies[naam][opties.opdrachten:])
+            resultaten['client.%s' % naam] = resultaat('ms', False, metingen,
+                p99=percentiel(alle, 99))
+    finally:
+        client.close()
+        context.term()
+        shutil.rmtree(directory)
+
+    return resultaten
+
+
+def meet_render(opties):
+    """
+    trein_to_dict voor losse treinen en vertrektijden_to_list voor een
+    bord (station) van opties.bord treinen, met en zonder materieel
+    """
+
+    voorbeelden = bench_data.laad_treinen()
+    station = {}
+    for nummer in range(opties.bord):
+        trein = bench_data.maak_trein(voorbeelden, nummer, 'S000')
+        station[trein.treinnr] = trein
+
+    treinen = station.values()
+    rondes = max(1, opties.berichten // opties.bord)
+
+    def treinen_naar_dict():
+        for _ in range(rondes):
+            for trein in treinen:
+                dvs_http_parsers.trein_to_dict(trein, 'nl', bench_data.TIJD_NU)
+
+    def bord(materieel):
+        for _ in range(rondes):
+            dvs_http_parsers.vertrektijden_to_list(station, 'nl', bench_data.TIJD_NU, materieel=materieel)
+
+    return {
+        'render.trein_to_dict': resultaat('treinen/s', True,
+            herhaal(opties, lambda: per_seconde(rondes * len(treinen), treinen_naar_dict))),
+        'render.bord': resultaat('borden/s', True,
+            herhaal(opties, lambda: per_seconde(rondes, lambda: bord(False)))),
+        'render.bord_materieel': resultaat('borden/s', True,
+            herhaal(opties, lambda: per_seconde(rondes, lambda: bord(True))))
+    }
+
+
+def meet_gc(opties):
+    """
+    Duur van een GC ronde van de daemon (GarbageThread.garbage_collect,
+    inclusief de collectie volgens het GC beleid) voor iedere storegrootte
+    in opties.gc_groottes. Geen van de treinen is vertrokken, zodat iedere
+    ronde alle treinen bekijkt en de stores gelijk blijven.
+    """
+
+    voorbeelden = bench_data.laad_treinen()
+    resultaten = {}
+
+    for grootte in opties.gc_groottes:
+        station_store, trein_store = bench_data.maak_stores(voorbeelden, grootte,
+            opties.stations, opties.stops)
+        daemon = bench_data.laad_daemon(station_store, trein_store)
+        daemon.gc_beleid.na_laden()
+
+        resultaten['gc.ronde.%s' % grootte] = resultaat('ms', False,
+            herhaal(opties, _gc_ronde(daemon.GarbageThread(threading.Event(), {}, False))))
+
+        # Geheugen vrijgeven voor de volgende grootte:
+        del station_store, trein_store, daemon
+
+    return resultaten
+
+
+def _gc_ronde(gc_thread):
+    def ronde():
+        start = time.time()
+        gc_thread.garbage_collect()
+        return (time.time() - start) * 1000
+
+    return ronde
+
+
+BENCHMARKS = [
+    ('parse', meet_parse),
+    ('apply', meet_apply),
+    ('client', meet_client),
+    ('render', meet_render),
+    ('gc', meet_gc)
+]
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+
+"""
+Benchmarksuite voor de drukste paden van de DVS daemon en HTTP interface:
+- parse: infoplus_dvs.parse_trein over testdata/formatted en testdata/treinlog
+- apply: WorkerThread.verwerk (parsen en verwerken in de stores)
+- client: latency van client opdrachten via de ClientThread
+- render: trein_to_dict en vertrektijden_to_list (borden)
+- gc: duur van een GC ronde bij verschillende storegroottes
+
+Iedere benchmark draait in een eigen proces, met data vanaf een vast
+tijdstip en een virtuele klok (zie bench_data). Met --json worden de
+resultaten opgeslagen; een eerder opgeslagen bestand kan met --baseline
+vergeleken worden. Een achteruitgang groter dan --marge procent geeft
+exitcode 1.
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import json
+import logging
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bench_paden
+
+
+def git_versie():
+    """
+    Geef de huidige git commit, of None
+    """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def meet(naam, args):
+    """
+    Voer benchmark naam uit in een los proces; geeft de resultaten
+    """
+
+    omgeving = dict(os.environ, PYTHONHASHSEED='0')
+    uitvoer = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--intern', naam] +
+        ['--%s=%s' % (optie.replace('_', '-'), waarde) for optie, waarde in sorted(instellingen(args).items())],
+        env=omgeving)
+
+    return json.loads(uitvoer)
+
+
+def instellingen(args):
+    """
+    Geef de opties welke de meting bepalen
+    """
+
+    return {
+        'herhalingen': args.herhalingen,
+        'berichten': args.berichten,
+        'grootte': args.grootte,
+        'gc_groottes': ','.join(str(grootte) for grootte in args.gc_groottes),
+        'stations': args.stations,
+        'stops': args.stops,
+        'opdrachten': args.opdrachten,
+        'bord': args.bord
+    }
+
+
+def vergelijk(resultaten, baseline, marge):
+    """
+    Vergelijk resultaten met baseline; geeft per resultaat het verschil in
+    procenten (positief is beter) en de namen van resultaten die meer dan
+    marge procent achteruit gegaan zijn
+    """
+
+    verschillen = {}
+    achteruit = []
+
+    for naam, resultaat in resultaten.items():
+        oud = baseline.get(naam)
+        if oud is None or oud['waarde'] == 0:
+            continue
+
+        verschil = (resultaat['waarde'] - oud['waarde']) * 100.0 / oud['waarde']
+        if not resultaat['hoger_beter']:
+            verschil = -verschil
+
+        verschillen[naam] = verschil
+        if verschil < -marge:
+            achteruit.append(naam)
+
+    return verschillen, sorted(achteruit)
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmarksuite voor de DVS daemon en HTTP interface')
+
+    namen = [naam for naam, _ in bench_paden.BENCHMARKS]
+
+    parser.add_argument('-b', '--benchmarks', action='store', default=','.join(namen),
+        help='benchmarks, gescheiden door komma\'s (standaard: %s)' % ','.join(namen))
+    parser.add_argument('-n', '--herhalingen', action='store', type=int, default=5, help='herhalingen per meting (standaard 5)')
+    parser.add_argument('--berichten', action='store', type=int, default=2000, help='berichten of treinen per meting voor parse, apply en render (standaard 2000)')
+    parser.add_argument('-g', '--grootte', action='store', type=int, default=10000, help='vertrekken in de stores voor client (standaard 10000)')
+    parser.add_argument('--gc-groottes', dest='gc_groottes', action='store', default='10000,60000',
+        help='vertrekken in de stores voor gc, gescheiden door komma\'s (standaard 10000,60000)')
+    parser.add_argument('--stations', action='store', type=int, default=400, help='aantal stations (standaard 400)')
+    parser.add_argument('--stops', action='store', type=int, default=10, help='aantal stations per trein (standaard 10)')
+    parser.add_argument('--opdrachten', action='store', type=int, default=200, help='client opdrachten per meting (standaard 200)')
+    parser.add_argument('--bord', action='store', type=int, default=40, help='treinen per bord voor render (standaard 40)')
+    parser.add_argument('--json', action='store', metavar='BESTAND', help='sla de resultaten op in BESTAND (JSON)')
+    parser.add_argument('--baseline', action='store', metavar='BESTAND', help='vergelijk met eerder opgeslagen resultaten')
+    parser.add_argument('--marge', action='store', type=float, default=10, help='toegestane achteruitgang t.o.v. de baseline in procenten (standaard 10)')
+    parser.add_argument('--intern', action='store', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+    args.gc_groottes = [int(grootte) for grootte in args.gc_groottes.split(',')]
+
+    if args.intern is not None:
+        # Meting in een los proces; alleen fouten loggen (naar stderr):
+        logging.basicConfig(level=logging.ERROR)
+        sys.stdout.write(json.dumps(dict(bench_paden.BENCHMARKS)[args.intern](args)))
+        sys.stdout.flush()
+
+        # Direct stoppen: de threads van de daemon (zoals de ClientThread)
+        # hebben geen stopmogelijkheid
+        os._exit(0)
+
+    gekozen = args.benchmarks.split(',')
+    for naam in gekozen:
+        if naam not in namen:
+            parser.error('Onbekende benchmark: %s' % naam)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as bestand:
+            baseline = json.load(bestand)
+
+        if baseline['instellingen'] != instellingen(args):
+            print "Let op: baseline gemeten met andere instellingen: %s" % baseline['instellingen']
+        if baseline['systeem'].get('python') != platform.python_version():
+            print "Let op: baseline gemeten met Python %s" % baseline['systeem'].get('python')
+
+    resultaten = {}
+    for naam in gekozen:
+        resultaten.update(meet(naam, args))
+
+    verschillen, achteruit = {}, []
+    if baseline is not None:
+        verschillen, achteruit = vergelijk(resultaten, baseline['resultaten'], args.marge)
+
+    for naam in sorted(resultaten):
+        resultaat = resultaten[naam]
+        regel = "%-24s %12.2f %-12s (%.2f - %.2f)" % (naam, resultaat['waarde'], resultaat['eenheid'],
+            min(resultaat['metingen']), max(resultaat['metingen']))
+
+        if naam in verschillen:
+            regel += "  baseline %12.2f  %+6.1f%%%s" % (baseline['resultaten'][naam]['waarde'],
+                verschillen[naam], '  ACHTERUIT' if naam in achteruit else '')
+
+        print regel
+
+    if args.json is not None:
+        with open(args.json, 'w') as bestand:
+            json.dump({
+                'tijd': datetime.datetime.now().isoformat(),
+                'git': git_versie(),
+                'systeem': {
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'processor': platform.processor(),
+                    'cpus': os.sysconf('SC_NPROCESSORS_ONLN')
+                },
+                'instellingen': instellingen(args),
+                'resultaten': resultaten
+            }, bestand, indent=2, sort_keys=True)
+
+    if len(achteruit) > 0:
+        print
+        print "Achteruitgang van meer dan %s%%: %s" % (args.marge, ', '.join(achteruit))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
 import sys
 import zmq
 from gzip import GzipFile
@@ -27,14 +28,30 @@ from datetime import datetime, timedelta
 import cPickle as pickle
 import argparse
 import gc
+import itertools
 import logging
 import logging.config
 import threading
+import time
 from collections import deque
-from Queue import Queue
+from Queue import Queue, Full
 
 import infoplus_dvs
 import dvs_util
+import dvs_gc
+import dvs_klok
+import dvs_metrics
+import dvs_replay
+import dvs_snapshot
+import dvs_wal
+
+
+# Snapshot van de stores bij afsluiten (zie laad_stores):
+STORES_SNAPSHOT = 'datadump/stores.snapshot'
+
+# Klok voor GC, downtimedetectie en de controle op te late berichten;
+# een virtuele klok bij een versnelde replay (zie speel_af):
+klok = dvs_klok.SysteemKlok()
 
 
 def main():
@@ -42,14 +59,13 @@ def main():
     Main loop
     """
 
-    global station_store, trein_store, counters, locks, configs, system_status, message_queue
+    global station_store, trein_store, counters, locks, configs, system_status, message_queue, feed_queue, exports, \
+        feed_volgnummers, station_versies, versie_teller, basis_versie, wal, klok, metrieken, gc_beleid, snapshot_status
 
     # Maak output in utf-8 mogelijk in Python 2.x:
     reload(sys)
     sys.setdefaultencoding("utf-8")
 
-    gc.set_debug(gc.DEBUG_UNCOLLECTABLE | gc.DEBUG_INSTANCES | gc.DEBUG_OBJECTS)
-
     # Default config (nog naar losse configfile):
     dvs_server = "tcp://127.0.0.1:8100"
     dvs_client_bind = "tcp://0.0.0.0:8120"
@@ -63,9 +79,22 @@ def main():
         action='store_true', help='Laad station_store')
     parser.add_argument('-lt', '--laad-treinen', dest='laadTreinen',
         action='store_true', help='Laad trein_store')
+    parser.add_argument('-r', '--replay', dest='replay', metavar='ARCHIEF',
+        action='store', help='Speel opgenomen berichten af (bestand met een bericht per regel, of directory met XML bestanden)')
+    parser.add_argument('--replay-tot', dest='replayTot', metavar='TIJD',
+        action='store', help='Stop replay bij berichten na dit tijdstip (ISO 8601)')
+    parser.add_argument('--replay-stop', dest='replayStop',
+        action='store_true', help='Sla de stores op en stop na replay')
+    parser.add_argument('--virtuele-klok', dest='virtueleKlok',
+        action='store_true', help='Versnelde replay met GC en downtimedetectie op de tijd van de berichten (stopt na replay)')
+    parser.add_argument('--replay-meting', dest='replayMeting', metavar='BESTAND',
+        action='store', help='Schrijf geheugengebruik en storegrootte tijdens een versnelde replay naar BESTAND (CSV)')
 
     args = parser.parse_args()
 
+    if args.virtueleKlok and args.replay is None:
+        parser.error('--virtuele-klok alleen in combinatie met --replay')
+
     # Laad configuratie:
     config = dvs_util.load_config(args.configFile)
 
@@ -81,10 +110,21 @@ def main():
         dvs_server = config['bindings']['dvs_server']
         dvs_client_bind = config['bindings']['client_server']
         injector_bind = config['bindings']['injector_server']
+        feed_bind = config['bindings'].get('feed_server')
     except:
         logger.exception("Configuratiefout, server wordt afgesloten")
         sys.exit(1)
 
+    # Beleid voor de garbage collector van Python (zonder debugvlaggen,
+    # tenzij het debug profiel ingesteld is):
+    try:
+        gc_beleid = dvs_gc.GcBeleid(config.get('python_gc', {}))
+    except ValueError:
+        logger.exception("Configuratiefout, server wordt afgesloten")
+        sys.exit(1)
+
+    gc_beleid.pas_toe()
+
     # Initialiseer datastores:
     station_store = { }
     trein_store = { }
@@ -93,6 +133,19 @@ def main():
     locks = { }
     locks['trein'] = threading.Lock()
     locks['station'] = threading.Lock()
+    locks['export'] = threading.Lock()
+    locks['snapshot'] = threading.Lock()
+    locks['feed'] = threading.Lock()
+
+    # Lopende exports (zie ClientThread.start_export):
+    exports = {}
+
+    # Versie per station, opgehoogd bij iedere wijziging (zie meld_mutatie).
+    # Versies beginnen bij de starttijd in microseconden, zodat een versie
+    # na een herstart nooit overeenkomt met een versie van voor de herstart:
+    basis_versie = int(time.time() * 1000000)
+    versie_teller = itertools.count(basis_versie + 1)
+    station_versies = {}
 
     # Initialiseer counters voor aantal verwerkte berichten,
     # aantal dubbele berichten, aantal verouderde berichten,
@@ -105,7 +158,16 @@ def main():
     counters['gc_station'] = 0
     counters['gc_trein'] = 0
     counters['injecties'] = 0
-    counters['msg_time'] = {}
+    counters['feed'] = 0
+    counters['feed_verloren'] = 0
+
+    # Histogrammen en overige meetwaarden voor de metrics opdracht:
+    metrieken = {}
+    metrieken['parse_ms'] = dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS)
+    metrieken['verwerk_ms'] = dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS)
+    metrieken['gc_ms'] = dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS)
+    metrieken['berichten_per_seconde'] = None
+    metrieken['starttijd'] = time.time()
 
     # Initialiseer system_status:
     system_status = {}
@@ -113,31 +175,96 @@ def main():
     system_status['down_since'] = None
     system_status['recovering_since'] = None
 
-    # Laad oude datastores in (indien gespecifeerd):
-    if args.laadStations == True:
-        station_store = laad_stations()
+    # Write-ahead log (optioneel). Herstel de stores uit het laatste snapshot
+    # en het log; zonder snapshot en log gelden de opties voor inladen:
+    wal = None
+    hersteld = None
+    snapshot_status = None
+    if 'wal' in config:
+        wal_config = config['wal']
+        wal = dvs_wal.WriteAheadLog(wal_config.get('directory', 'datadump/wal'))
+        hersteld = wal.herstel()
+
+        # Periodieke snapshots: instellingen en gegevens van het laatste
+        # snapshot (voor de status opdracht):
+        snapshot_status = {
+            'methode': 'fork' if wal_config.get('snapshot_fork', hasattr(os, 'fork')) else 'thread',
+            'interval': float(wal_config.get('snapshot_interval', 15)),
+            'bewaar': int(wal_config.get('snapshot_bewaar', 1)),
+            'aantal': 0, 'fouten': 0,
+            'tijd': None, 'duur': None, 'grootte': None, 'segment': None
+        }
+
+    if hersteld is not None:
+        station_store, trein_store = hersteld
+    else:
+        # Laad oude datastores in (indien gespecifeerd):
+        if args.laadStations == True or args.laadTreinen == True:
+            stations, treinen = laad_stores(args.laadStations, args.laadTreinen)
+
+            if args.laadStations == True:
+                station_store = stations
+
+            if args.laadTreinen == True:
+                trein_store = treinen
 
-    if args.laadTreinen == True:
-        trein_store = laad_treinen()
+    keep_departures = False
+    if 'debug' in config:
+        if config['debug']['keep_departures'] == True:
+            keep_departures = True
+            logger.warn("Debug optie 'keep_departures' actief: ritten worden niet gewist")
+
+    worker_thread = WorkerThread(keep_departures)
+
+    replay_tot = None
+    if args.replayTot is not None:
+        replay_tot = dvs_replay.parse_tijd(args.replayTot)
+
+    # Speel opgenomen berichten af (zonder change feed). Een versnelde replay
+    # volgt pas als de GC thread loopt, op een virtuele klok vanaf het eerste bericht:
+    feed_queue = None
+    if args.replay is not None and args.virtueleKlok:
+        replay_start = dvs_replay.eerste_tijd(args.replay)
+        if replay_start is None:
+            logger.error("Geen berichten met TimeStamp in %s", args.replay)
+            sys.exit(1)
+
+        klok = dvs_klok.VirtueleKlok(dvs_klok.timestamp(replay_start))
+
+    elif args.replay is not None:
+        speel_af(worker_thread, args.replay, replay_tot)
+
+        if args.replayStop == True:
+            sla_stores_op()
+            return
+
+    # Ingeladen stores zijn langlevend, zie dvs_gc:
+    gc_beleid.na_laden()
 
     # Socket to talk to server
     context = zmq.Context()
 
     message_queue = Queue()
 
-    keep_departures = False
-    if 'debug' in config:
-        if config['debug']['keep_departures'] == True:
-            keep_departures = True
-            logger.warn("Debug optie 'keep_departures' actief: ritten worden niet gewist")
+    # Change feed (optioneel), niet tijdens een versnelde replay (welke na
+    # afloop stopt), zodat een replay meting geen feed overhead bevat:
+    if feed_bind is not None and args.virtueleKlok:
+        logger.info("Change feed niet gestart tijdens versnelde replay")
+    elif feed_bind is not None:
+        feed_config = config.get('feed', {})
+        feed_queue = Queue(int(feed_config.get('queue_size', 10000)))
+        feed_volgnummers = itertools.count(1)
+
+        feed_thread = FeedThread(feed_bind, int(feed_config.get('hwm', 10000)))
+        feed_thread.daemon = True
+        feed_thread.start()
 
     # Start een nieuwe thread om messages te verwerken
-    worker_thread = WorkerThread(keep_departures)
     worker_thread.daemon = True
     worker_thread.start()
 
     # Start een nieuwe thread om client requests uit te lezen
-    client_thread = ClientThread(dvs_client_bind)
+    client_thread = ClientThread(dvs_client_bind, ClientStatistieken(config), config)
     client_thread.daemon = True
     client_thread.start()
 
@@ -169,6 +296,24 @@ def main():
     gc_thread.daemon = True
     gc_thread.start()
 
+    # Start threads voor fsyncs van het WAL en periodieke snapshots:
+    if wal is not None:
+        wal_thread = WalThread(gc_stopped, float(wal_config.get('fsync_interval', 1)))
+        wal_thread.daemon = True
+        wal_thread.start()
+
+        snapshot_thread = SnapshotThread(gc_stopped, snapshot_status['interval'],
+            snapshot_status['methode'] == 'fork')
+        snapshot_thread.daemon = True
+        snapshot_thread.start()
+
+    if args.replay is not None and args.virtueleKlok:
+        speel_af(worker_thread, args.replay, replay_tot, args.replayMeting)
+
+        gc_stopped.set()
+        sla_stores_op()
+        return
+
     logger.info("Gereed voor ontvangen DVS berichten (van server %s), envelope: %s", dvs_server, envelope)
 
     try:
@@ -185,11 +330,7 @@ def main():
 
         gc_stopped.set()
 
-        logger.info("Station store opslaan...")
-        pickle.dump(station_store, open('datadump/station.store', 'wb'), -1)
-
-        logger.info("Trein store opslaan...")
-        pickle.dump(trein_store, open('datadump/trein.store', 'wb'), -1)
+        sla_stores_op()
 
         logger.info(
             "Statistieken: %s berichten verwerkt sinds %s", counters['msg'], starttime)
@@ -198,6 +339,41 @@ def main():
         logger.error("Fout in main loop", exc_info=True)
 
 
+def sla_stores_op():
+    """
+    Sla de stores op bij afsluiten: met write-ahead log als laatste snapshot
+    van het log (ingelezen door wal.herstel), anders in STORES_SNAPSHOT
+    """
+
+    logger = logging.getLogger(__name__)
+
+    if wal is not None:
+        logger.info("Snapshot maken...")
+        maak_snapshot()
+        wal.sluit()
+    else:
+        logger.info("Station store en trein store opslaan...")
+        dvs_snapshot.schrijf(STORES_SNAPSHOT, station_store, trein_store)
+
+def laad_stores(stations=True, treinen=True):
+    """
+    Laad station store en trein store uit het snapshot van de vorige
+    afsluiting. Is er geen snapshot, dan worden de gevraagde stores uit de
+    pickle dumps van een oudere versie geladen. Geeft (station_store,
+    trein_store); niet gevraagde stores zijn leeg.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    if os.path.exists(STORES_SNAPSHOT):
+        logger.info('Inladen station_store en trein_store...')
+        start = time.time()
+        station_store, trein_store, _ = dvs_snapshot.laad(STORES_SNAPSHOT)
+        logger.info('Stores ingeladen in %.2fs', time.time() - start)
+        return station_store, trein_store
+
+    return (laad_stations() if stations else {}), (laad_treinen() if treinen else {})
+
 def laad_stations():
     """
     Laad stations uit pickle dump
@@ -226,6 +402,297 @@ def laad_treinen():
 
     return store
 
+def speel_af(worker_thread, archief, tot=None, meting=None, meet_interval=900):
+    """
+    Speel de berichten uit een archief (zie dvs_replay) af, zonder ZeroMQ en
+    zo snel als het parsen toelaat, rechtstreeks in worker_thread (welke
+    niet via de message queue verwerkt). Is tot gegeven, dan stopt de replay
+    bij het eerste bericht met een TimeStamp na tot. Geeft het aantal
+    afgespeelde berichten.
+
+    Met een virtuele klok wordt de klok op de TimeStamp van ieder bericht
+    gezet, en worden iedere meet_interval (virtuele) seconden geheugengebruik
+    en storegrootte gelogd en naar meting geschreven (CSV, indien gegeven).
+    """
+
+    logger = logging.getLogger(__name__)
+    logger.info("Replay van %s gestart", archief)
+
+    virtueel = isinstance(klok, dvs_klok.VirtueleKlok)
+
+    # Tijdens de replay de garbage collector uit (zie dvs_snapshot.laad),
+    # behalve bij een versnelde replay, welke juist het geheugengebruik meet:
+    gc_actief = gc.isenabled()
+    if not virtueel:
+        gc.disable()
+
+    meting_bestand = None
+    if virtueel and meting is not None:
+        meting_bestand = open(meting, 'w')
+        meting_bestand.write('tijd,berichten,stations,vertrekken,treinen,rss_mb,status\n')
+
+    start = time.time()
+    berichten = 0
+    volgende_meting = klok.tijd() if virtueel else None
+
+    try:
+        for bericht in dvs_replay.lees_archief(archief):
+            if tot is not None or virtueel:
+                tijd = dvs_replay.bericht_tijd(bericht)
+                if tot is not None and tijd is not None and tijd > tot:
+                    logger.info("Replay gestopt bij bericht van %s", tijd)
+                    break
+
+                if virtueel and tijd is not None:
+                    klok.zet(dvs_klok.timestamp(tijd))
+
+                    if klok.tijd() >= volgende_meting:
+                        meet_replay(berichten, meting_bestand)
+                        volgende_meting = klok.tijd() + meet_interval
+
+            worker_thread.verwerk(bericht)
+            berichten += 1
+
+        if virtueel:
+            meet_replay(berichten, meting_bestand)
+    finally:
+        if gc_actief:
+            gc.enable()
+        if meting_bestand is not None:
+            meting_bestand.close()
+
+    duur = time.time() - start
+    logger.info("Replay: %s berichten verwerkt in %.2fs (%.0f berichten/s), station_store=%s, trein_store=%s",
+        berichten, duur, berichten / max(duur, 0.001), len(station_store), len(trein_store))
+
+    return berichten
+
+def meet_replay(berichten, meting_bestand=None):
+    """
+    Log geheugengebruik en storegrootte tijdens een versnelde replay, en
+    schrijf deze als regel naar meting_bestand (indien gegeven)
+    """
+
+    with locks['station']:
+        vertrekken = sum(len(treinen) for treinen in station_store.values())
+
+    meting = (klok.nu(pytz.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), berichten, len(station_store),
+        vertrekken, len(trein_store), dvs_util.geheugen_rss() / 1048576.0, system_status['status'])
+
+    logging.getLogger(__name__).info(
+        "Replay %s: %s berichten, station_store=%s (%s vertrekken), trein_store=%s, RSS %.1f MB, status=%s",
+        *meting)
+
+    if meting_bestand is not None:
+        meting_bestand.write('%s,%s,%s,%s,%s,%.1f,%s\n' % meting)
+        meting_bestand.flush()
+
+def metrics_tekst(statistieken):
+    """
+    Geef alle meetwaarden van de daemon in het tekstformaat van Prometheus
+    (zie dvs_metrics.Prometheus), inclusief de latency per client opdracht
+    uit statistieken (ClientStatistieken)
+    """
+
+    metrics = dvs_metrics.Prometheus()
+
+    metrics.counter('dvs_berichten_total', 'Verwerkte DVS berichten', counters['msg'])
+    metrics.counter('dvs_berichten_dubbel_total', 'Dubbele berichten (niet verwerkt)', counters['dubbel'])
+    metrics.counter('dvs_berichten_ouder_total', 'Verouderde berichten (niet verwerkt)', counters['ouder'])
+    metrics.counter('dvs_berichten_laat_total', 'Te laat ontvangen berichten', counters['laat'])
+    metrics.gauge('dvs_berichten_per_seconde', 'Verwerkte berichten per seconde in de laatste GC ronde',
+        metrieken['berichten_per_seconde'])
+    metrics.histogram('dvs_parse_duur_ms', 'Duur van het parsen van een bericht', metrieken['parse_ms'])
+    metrics.histogram('dvs_verwerk_duur_ms', 'Duur van het verwerken van een bericht in de stores',
+        metrieken['verwerk_ms'])
+
+    metrics.counter('dvs_gc_vertrokken_total', 'Treinen als vertrokken gemarkeerd zonder wisbericht',
+        [({'store': 'station'}, counters['gc_station']), ({'store': 'trein'}, counters['gc_trein'])])
+    metrics.histogram('dvs_gc_duur_ms', 'Duur van een GC ronde', metrieken['gc_ms'])
+    metrics.histogram('dvs_python_gc_pauze_ms', 'Pauze van collecties door de daemon per generatie',
+        [({'generatie': generatie}, histogram) for generatie, histogram in enumerate(gc_beleid.pauzes)])
+
+    metrics.counter('dvs_injecties_total', 'Ontvangen injecties', counters['injecties'])
+    metrics.counter('dvs_feed_events_total', 'Gepubliceerde events op de change feed', counters['feed'])
+    metrics.counter('dvs_feed_verloren_total', 'Vervallen events op de change feed', counters['feed_verloren'])
+
+    metrics.gauge('dvs_rij_lengte', 'Aantal wachtende berichten, events en client opdrachten',
+        [({'rij': 'berichten'}, message_queue.qsize()),
+        ({'rij': 'feed'}, feed_queue.qsize() if feed_queue is not None else 0)] +
+        [({'rij': 'client_%s' % rij}, queue.qsize()) for rij, queue in sorted(statistieken.rijen.items())])
+
+    metrics.gauge('dvs_stations', 'Aantal stations in de station store', len(station_store))
+    metrics.gauge('dvs_vertrekken', 'Aantal vertrekken in de station store',
+        sum(len(treinen) for treinen in station_store.values()))
+    metrics.gauge('dvs_treinen', 'Aantal treinen in de trein store', len(trein_store))
+    metrics.gauge('dvs_status', 'Systeemstatus (1 voor de huidige status)',
+        [({'status': status}, int(system_status['status'] == status))
+        for status in ('UP', 'RECOVERING', 'DOWN', 'UNKNOWN')])
+
+    histogrammen = sorted(statistieken.histogrammen.items())
+    metrics.histogram('dvs_client_latency_ms', 'Latency van client opdrachten (ontvangst tot verzenden)',
+        [({'opdracht': opdracht}, histogram['latency_ms']) for opdracht, histogram in histogrammen])
+    metrics.histogram('dvs_client_antwoord_bytes', 'Grootte van antwoorden op client opdrachten',
+        [({'opdracht': opdracht}, histogram['grootte_bytes']) for opdracht, histogram in histogrammen])
+    metrics.counter('dvs_client_traag_total', 'Trage client opdrachten', statistieken.traag)
+
+    metrics.gauge('dvs_geheugen_rss_bytes', 'Geheugengebruik (resident set size)', dvs_util.geheugen_rss())
+    metrics.gauge('dvs_starttijd_seconden', 'Starttijd van de daemon (unix timestamp)', metrieken['starttijd'])
+
+    if snapshot_status is not None:
+        metrics.counter('dvs_snapshots_total', 'Gemaakte snapshots', snapshot_status['aantal'])
+        metrics.counter('dvs_snapshot_fouten_total', 'Mislukte snapshots', snapshot_status['fouten'])
+        if snapshot_status['tijd'] is not None:
+            metrics.gauge('dvs_snapshot_duur_seconden', 'Duur van het laatste snapshot', snapshot_status['duur'])
+            metrics.gauge('dvs_snapshot_grootte_bytes', 'Grootte van het laatste snapshot', snapshot_status['grootte'])
+            metrics.gauge('dvs_snapshot_tijd_seconden', 'Tijd van het laatste snapshot (unix timestamp)',
+                snapshot_status['tijd'])
+
+    return metrics.tekst()
+
+def log_mutatie(record):
+    """
+    Voeg een toegepaste mutatie (zie dvs_wal.pas_toe) toe aan het
+    write-ahead log, indien actief
+    """
+
+    if wal is not None:
+        wal.schrijf(record)
+
+def maak_snapshot(fork=False):
+    """
+    Maak een snapshot van de stores voor het write-ahead log. Het log wordt
+    eerst geroteerd; daarna wordt een kopie van de stores gemaakt (alleen de
+    dicts, niet de treinen), zodat de store locks niet vastgehouden worden
+    tijdens het schrijven. Met fork schrijft een child proces het snapshot
+    (zie dvs_snapshot.schrijf_fork) en is geen kopie nodig. Duur en grootte
+    worden bijgehouden in snapshot_status.
+    """
+
+    # Nooit twee snapshots tegelijk: een ouder snapshot zou anders een
+    # nieuwer snapshot kunnen vervangen nadat diens segmenten gewist zijn.
+    with locks['snapshot']:
+        segment = wal.roteer()
+
+        if fork:
+            # Het child ziet de stores zoals op het moment van de fork:
+            stations, treinen = station_store, trein_store
+        else:
+            with locks['station']:
+                stations = dict((station_code, dict(treinen)) for station_code, treinen in station_store.items())
+
+            with locks['trein']:
+                treinen = dict((treinnr, dict(stations_trein)) for treinnr, stations_trein in trein_store.items())
+
+        try:
+            duur, grootte = wal.schrijf_snapshot(stations, treinen, segment, fork, snapshot_status['bewaar'])
+        except Exception:
+            snapshot_status['fouten'] += 1
+            raise
+
+        snapshot_status.update({'aantal': snapshot_status['aantal'] + 1, 'tijd': time.time(),
+            'duur': duur, 'grootte': grootte, 'segment': segment})
+
+def meld_mutatie(soort, station_code, rit_id, trein=None):
+    """
+    Meld een wijziging in de station store: hoog de versie van het station
+    op en geef de wijziging door aan de change feed (indien actief).
+    soort is 'insert', 'update', 'vertrokken' of 'verwijderd'.
+    Blokkeert nooit: is de feed queue vol, dan vervalt de melding. Het
+    volgnummer wordt ook dan verbruikt, zodat subscribers het gat zien.
+    """
+
+    # next() op een itertools.count is atomair, ook vanuit meerdere threads:
+    versie = next(versie_teller)
+    station_versies[station_code] = versie
+
+    if feed_queue is None:
+        return
+
+    # Volgnummer en plaats in de queue onder dezelfde lock, zodat de
+    # events in volgorde van volgnummer in de queue staan:
+    with locks['feed']:
+        try:
+            feed_queue.put_nowait((next(feed_volgnummers), versie, soort, station_code, rit_id, trein))
+        except Full:
+            counters['feed_verloren'] += 1
+
+def station_versie(station_code):
+    """
+    Geef de versie van een station. Stations die sinds de start niet
+    gewijzigd zijn hebben de basisversie van deze run.
+    """
+
+    return station_versies.get(station_code, basis_versie)
+
+def venster_treinen(treinen, van, tot, limit, sorteer, tijd_nu):
+    """
+    Selecteer de treinen van een station die actueel vertrekken vanaf van
+    en voor tot (datetimes, of None), zonder vertrokken treinen en zonder
+    opgeheven treinen die niet meer getoond worden (2 minuten na vertrek).
+    Geeft een dict met maximaal limit treinen (of alle treinen indien
+    limit None is), de eerste treinen volgens sortering sorteer.
+    """
+
+    geselecteerd = {}
+
+    for rit_id, trein in treinen.iteritems():
+        if trein.is_vertrokken():
+            continue
+        if trein.is_opgeheven() and trein.vertrek + timedelta(minutes=2) < tijd_nu:
+            continue
+        if van is not None and trein.vertrek_actueel < van:
+            continue
+        if tot is not None and trein.vertrek_actueel >= tot:
+            continue
+
+        geselecteerd[rit_id] = trein
+
+    if limit is not None and len(geselecteerd) > limit:
+        geselecteerd = dict((trein.rit_id, trein) for trein
+            in infoplus_dvs.sorteer_treinen(geselecteerd, sorteer)[:limit])
+
+    return geselecteerd
+
+class GepickeldeTreinen(object):
+    """
+    Treinen van een sleutel uit een store, al gepickled. Wordt in een pickle
+    opgenomen als aanroep van pickle.loads, zodat de ontvanger weer de
+    oorspronkelijke dict van treinen krijgt.
+    """
+
+    def __init__(self, treinen):
+        self.data = pickle.dumps(treinen, -1)
+
+    def __reduce__(self):
+        return (pickle.loads, (self.data,))
+
+def dumps_store(items):
+    """
+    Pickle de items van een store (sleutel met dict van treinen) als een
+    enkele pickle van de volledige store. De treinen worden per sleutel
+    apart gepickled, zodat andere threads (zoals de snelle client rij)
+    tussendoor aan de beurt komen en niet wachten tot de volledige store
+    gepickled is.
+    """
+
+    return pickle.dumps(dict((sleutel, GepickeldeTreinen(dict(treinen)))
+        for sleutel, treinen in items), -1)
+
+def ruim_exports_op():
+    """
+    Wis exports welke langer dan ClientWorkerThread.export_timeout seconden
+    niet opgevraagd zijn, zodat een afgebroken export het snapshot van de
+    store niet vasthoudt. Aanroepen met locks['export'].
+    """
+
+    logger = logging.getLogger(__name__)
+
+    for export_id, export in exports.items():
+        if (datetime.now() - export['tijd']).total_seconds() > ClientWorkerThread.export_timeout:
+            logger.warn('Export %s verlopen (%s)', export_id, export['store'])
+            del(exports[export_id])
+
 class WorkerThread(threading.Thread):
     """
     Worker thread voor het verwerken van DVS berichten.
@@ -247,75 +714,55 @@ class WorkerThread(threading.Thread):
             content = GzipFile('', 'r', 0 ,
                 StringIO(''.join(message))).read()
 
-            # Parse trein xml:
-            try:
-                trein = infoplus_dvs.parse_trein(content)
+            self.verwerk(content)
 
-                rit_station_code = trein.rit_station.code
+    def verwerk(self, content):
+        """
+        Parse een DVS bericht (XML) en verwerk de trein in de stores
+        """
 
-                if trein.status == '5':
-                    # Markeer als vertrokken, zodat er een timestamp op staat
-                    trein.markeer_vertrokken()
+        start = time.time()
 
-                # Maak item in trein_store indien niet aanwezig
-                if trein.treinnr not in trein_store:
-                    with locks['trein']:
-                        trein_store[trein.treinnr] = {}
+        # Parse trein xml:
+        try:
+            trein = infoplus_dvs.parse_trein(content)
+            geparsed = time.time()
 
-                # Maak item in station_store indien niet aanwezig:
-                if rit_station_code not in station_store:
-                    with locks['station']:
-                        station_store[rit_station_code] = {}
-
-                # Update of insert trein aan station store:
-                if trein.treinnr in station_store[rit_station_code]:
-                    # Trein komt reeds voor in station store voor dit station
-                    if trein.rit_timestamp > station_store[rit_station_code][trein.treinnr].rit_timestamp:
-                        # Bericht is nieuwer, update store:
-                        station_store[rit_station_code][trein.treinnr] = trein
-                    elif trein.rit_timestamp == station_store[rit_station_code][trein.treinnr].rit_timestamp:
-                        # Bericht is nieuwer, update store:
-                        self.logger.info('Dubbel bericht ontvangen: %s == %s, niet verwerkt (trein %s/%s)',
-                            trein.rit_timestamp, station_store[rit_station_code][trein.treinnr].rit_timestamp,
-                            trein.treinnr, trein.rit_station.code)
-
-                        # Update counter voor dubbele berichten:
-                        counters['dubbel'] += 1
-
-                    # Update of insert trein aan trein store:
-                    if rit_station_code in trein_store[trein.treinnr]:
-                        # Trein komt reeds voor in trein store voor dit treinnr
-                        if trein.rit_timestamp > trein_store[trein.treinnr][rit_station_code].rit_timestamp:
-                            # Bericht is nieuwer, update store:
-                            trein_store[trein.treinnr][rit_station_code] = trein
-                    else:
-                        # Bepaal 1 seconde threshold:
-                        warn_threshold = station_store[rit_station_code][trein.treinnr].rit_timestamp - timedelta(seconds=5)
+            rit_station_code = trein.rit_station.code
+            in_station = False
+            in_trein = False
 
-                        # Warning log message indien threshold van 1 seconde overschreden is:
-                        if trein.rit_timestamp <= warn_threshold:
-                            log_level = logging.WARNING
-                        else:
-                            log_level = logging.INFO
+            if trein.status == '5':
+                # Markeer als vertrokken, zodat er een timestamp op staat
+                trein.markeer_vertrokken(klok.nu(pytz.utc))
+
+            # Maak item in trein_store indien niet aanwezig
+            if trein.treinnr not in trein_store:
+                with locks['trein']:
+                    trein_store[trein.treinnr] = {}
 
-                        self.logger.log(log_level, 'Ouder bericht ontvangen: %s < %s, niet verwerkt (trein %s/%s)',
-                            trein.rit_timestamp, station_store[rit_station_code][trein.treinnr].rit_timestamp,
-                            trein.treinnr, trein.rit_station.code)
+            # Maak item in station_store indien niet aanwezig:
+            if rit_station_code not in station_store:
+                with locks['station']:
+                    station_store[rit_station_code] = {}
 
-                        # Update counter voor verouderde berichten:
-                        counters['ouder'] += 1
-                else:
-                    # Trein kwam op dit station nog niet voor, voeg toe:
+            # Update of insert trein aan station store:
+            if trein.treinnr in station_store[rit_station_code]:
+                # Trein komt reeds voor in station store voor dit station
+                if trein.rit_timestamp > station_store[rit_station_code][trein.treinnr].rit_timestamp:
+                    # Bericht is nieuwer, update store:
                     station_store[rit_station_code][trein.treinnr] = trein
-
-                    if system_status['status'] == 'UP':
-                        # Check op timestamp bericht:
-                        # Tel als te laat indien vertrek < 70 minuten vanaf nu
-                        verschil_vertrektijd = trein.vertrek - datetime.now(pytz.utc)
-                        if verschil_vertrektijd.total_seconds() < 69 * 60:
-                            counters['laat'] += 1
-                            self.logger.warn('Trein %s/%s: te laat ontvangen: vertrek over %d minuten',
-                                             trein.treinnr, trein.rit_station.code, float(verschil_vertrektijd.total_seconds()) / 60)
+                    in_station = True
+                    meld_mutatie('vertrokken' if trein.is_vertrokken() else 'update',
+                        rit_station_code, trein.treinnr, trein)
+                elif trein.rit_timestamp == station_store[rit_station_code][trein.treinnr].rit_timestamp:
+                    # Bericht is nieuwer, update store:
+                    self.logger.info('Dubbel bericht ontvangen: %s == %s, niet verwerkt (trein %s/%s)',
+                        trein.rit_timestamp, station_store[rit_station_code][trein.treinnr].rit_timestamp,
+                        trein.treinnr, trein.rit_station.code)
+
+                    # Update counter voor dubbele berichten:
+                    counters['dubbel'] += 1
 
                 # Update of insert trein aan trein store:
                 if rit_station_code in trein_store[trein.treinnr]:
@@ -323,115 +770,571 @@ class WorkerThread(threading.Thread):
                     if trein.rit_timestamp > trein_store[trein.treinnr][rit_station_code].rit_timestamp:
                         # Bericht is nieuwer, update store:
                         trein_store[trein.treinnr][rit_station_code] = trein
+                        in_trein = True
                 else:
-                    # Treinnr kwam op dit station nog niet voor, voeg toe:
+                    # Bepaal 1 seconde threshold:
+                    warn_threshold = station_store[rit_station_code][trein.treinnr].rit_timestamp - timedelta(seconds=5)
+
+                    # Warning log message indien threshold van 1 seconde overschreden is:
+                    if trein.rit_timestamp <= warn_threshold:
+                        log_level = logging.WARNING
+                    else:
+                        log_level = logging.INFO
+
+                    self.logger.log(log_level, 'Ouder bericht ontvangen: %s < %s, niet verwerkt (trein %s/%s)',
+                        trein.rit_timestamp, station_store[rit_station_code][trein.treinnr].rit_timestamp,
+                        trein.treinnr, trein.rit_station.code)
+
+                    # Update counter voor verouderde berichten:
+                    counters['ouder'] += 1
+            else:
+                # Trein kwam op dit station nog niet voor, voeg toe:
+                station_store[rit_station_code][trein.treinnr] = trein
+                in_station = True
+                meld_mutatie('vertrokken' if trein.is_vertrokken() else 'insert',
+                    rit_station_code, trein.treinnr, trein)
+
+                if system_status['status'] == 'UP':
+                    # Check op timestamp bericht:
+                    # Tel als te laat indien vertrek < 70 minuten vanaf nu
+                    verschil_vertrektijd = trein.vertrek - klok.nu(pytz.utc)
+                    if verschil_vertrektijd.total_seconds() < 69 * 60:
+                        counters['laat'] += 1
+                        self.logger.warn('Trein %s/%s: te laat ontvangen: vertrek over %d minuten',
+                                         trein.treinnr, trein.rit_station.code, float(verschil_vertrektijd.total_seconds()) / 60)
+
+            # Update of insert trein aan trein store:
+            if rit_station_code in trein_store[trein.treinnr]:
+                # Trein komt reeds voor in trein store voor dit treinnr
+                if trein.rit_timestamp > trein_store[trein.treinnr][rit_station_code].rit_timestamp:
+                    # Bericht is nieuwer, update store:
                     trein_store[trein.treinnr][rit_station_code] = trein
+                    in_trein = True
+            else:
+                # Treinnr kwam op dit station nog niet voor, voeg toe:
+                trein_store[trein.treinnr][rit_station_code] = trein
+                in_trein = True
 
-                counters['msg'] += + 1
+            if in_station or in_trein:
+                log_mutatie(('zet', rit_station_code, trein.treinnr, trein, in_station, in_trein))
 
-            except infoplus_dvs.OngeldigDvsBericht:
-                self.logger.error('Ongeldig DVS bericht')
-                self.logger.debug('Ongeldig DVS bericht: %s', content)
-            except Exception:
-                self.logger.error(
-                    'Fout tijdens DVS bericht verwerken', exc_info=True)
-                self.logger.error('DVS crash bericht: %s', content)
+            counters['msg'] += + 1
 
-            pass
+            metrieken['parse_ms'].meet((geparsed - start) * 1000)
+            metrieken['verwerk_ms'].meet((time.time() - geparsed) * 1000)
+
+        except infoplus_dvs.OngeldigDvsBericht:
+            self.logger.error('Ongeldig DVS bericht')
+            self.logger.debug('Ongeldig DVS bericht: %s', content)
+        except Exception:
+            self.logger.error(
+                'Fout tijdens DVS bericht verwerken', exc_info=True)
+            self.logger.error('DVS crash bericht: %s', content)
 
 
 class ClientThread(threading.Thread):
     """
-    Client thread voor verwerken requests van clients
+    Client thread voor verwerken requests van clients.
+    Opdrachten worden ontvangen op een ROUTER socket (compatibel met REQ
+    clients) en per soort opdracht in een eigen rij (lane) gezet, met eigen
+    worker threads. Zo wachten statuscontroles en vertrekstaten nooit op
+    zware opdrachten zoals het opvragen van de volledige store.
     """
 
     logger = None
     dvs_client_bind = None
+    statistieken = None
+    rijen = None
+
+    # Rij per soort opdracht; niet genoemde opdrachten gaan naar 'normaal':
+    rij_opdrachten = {
+        'status': 'snel', 'count': 'snel', 'stats': 'snel', 'versie': 'snel', 'metrics': 'snel',
+        'store': 'bulk', 'export': 'bulk'
+    }
 
-    def __init__ (self, dvs_client_bind):
+    # Standaard aantal worker threads per rij:
+    rij_workers = {'snel': 1, 'normaal': 2, 'bulk': 1}
+
+    antwoorden_bind = 'inproc://dvs-client-antwoorden'
+
+    def __init__ (self, dvs_client_bind, statistieken, configuration):
         self.dvs_client_bind = dvs_client_bind
+        self.statistieken = statistieken
         self.logger = logging.getLogger(__name__)
+
+        self.rij_workers = dict(self.rij_workers)
+        if 'client' in configuration and 'workers' in configuration['client']:
+            for rij, aantal in configuration['client']['workers'].items():
+                if rij in self.rij_workers:
+                    self.rij_workers[rij] = max(1, int(aantal))
+
+        self.rijen = dict((rij, Queue()) for rij in self.rij_workers)
+        self.statistieken.rijen = self.rijen
+
         threading.Thread.__init__(self, name='ClientThread')
 
     def run(self):
         self.logger.info('Client thread gestart')
         
         context = zmq.Context()
-        client_socket = context.socket(zmq.REP)
+        client_socket = context.socket(zmq.ROUTER)
         client_socket.bind(self.dvs_client_bind)
 
-        self.logger.info('Client thread gereed voor verbindingen (%s)', self.dvs_client_bind)
+        # Antwoorden van de workers komen terug via een inproc socket:
+        antwoorden_socket = context.socket(zmq.PULL)
+        antwoorden_socket.bind(self.antwoorden_bind)
+
+        for rij, aantal in sorted(self.rij_workers.items()):
+            for nummer in range(aantal):
+                worker = ClientWorkerThread(context, self.antwoorden_bind,
+                    rij, nummer, self.rijen[rij], self.statistieken)
+                worker.daemon = True
+                worker.start()
+
+        self.logger.info('Client thread gereed voor verbindingen (%s), workers: %s',
+            self.dvs_client_bind, self.rij_workers)
+
+        poller = zmq.Poller()
+        poller.register(client_socket, zmq.POLLIN)
+        poller.register(antwoorden_socket, zmq.POLLIN)
         
         while True:
-            url = client_socket.recv()
+            sockets = dict(poller.poll())
+
+            if antwoorden_socket in sockets:
+                # Stuur antwoord van een worker door naar de client:
+                try:
+                    client_socket.send_multipart(antwoorden_socket.recv_multipart())
+                except Exception:
+                    self.logger.exception('Fout bij sturen client response')
+
+            if client_socket in sockets:
+                # Envelope (client identity + lege frame) en opdracht:
+                frames = client_socket.recv_multipart()
+                url = frames[-1]
+
+                rij = self.rij_opdrachten.get(url.split('/', 1)[0], 'normaal')
+                self.rijen[rij].put((frames[:-1], url, time.time()))
+
+
+class ClientWorkerThread(threading.Thread):
+    """
+    Worker thread voor het verwerken van client opdrachten uit een rij
+    """
+
+    logger = None
+    rij = None
+    statistieken = None
+
+    max_batch = 100             # maximaal aantal stations/treinen per batch
+
+    export_chunk_grootte = 500  # maximaal aantal treinen per export chunk
+    export_timeout = 300        # exports na 5 minuten zonder opvraging wissen
+    export_volgnummer = 0
+
+    def __init__(self, context, antwoorden_bind, rij_naam, nummer, rij, statistieken):
+        self.context = context
+        self.antwoorden_bind = antwoorden_bind
+        self.rij = rij
+        self.statistieken = statistieken
+        self.logger = logging.getLogger(__name__)
+        threading.Thread.__init__(self, name='Client-%s-%s' % (rij_naam, nummer))
+
+    def run(self):
+        antwoorden_socket = self.context.socket(zmq.PUSH)
+        antwoorden_socket.connect(self.antwoorden_bind)
+
+        while True:
+            envelope, url, ontvangen = self.rij.get()
 
             try:
-                arguments = url.split('/')
-
-                if arguments[0] == 'station' and len(arguments) == 2:
-                    # Haal alle treinen op voor gegeven station
-                    station_code = arguments[1].upper()
-                    if station_code in station_store:
-                        with locks['station']:
-                            client_socket.send_pyobj(
-                                {'status': system_status,
-                                'data': station_store[station_code]},
-                                zmq.NOBLOCK)
-                    else:
-                        client_socket.send_pyobj({})
-
-                elif arguments[0] == 'trein' and len(arguments) == 2:
-                    # Haal alle stations op voor gegeven trein
-                    trein_nr = arguments[1]
-                    if trein_nr in trein_store:
-                        with locks['trein']:
-                            client_socket.send_pyobj(
-                                {'status': system_status,
-                                'data': trein_store[trein_nr]}, zmq.NOBLOCK)
-                    else:
-                        client_socket.send_pyobj({})
-
-                elif arguments[0] == 'store' and len(arguments) == 2:
-                    # Haal de volledige datastore op...
-                    if arguments[1] == 'trein':
-                        # Volledige trein store:
-                        with locks['trein']:
-                            client_socket.send_pyobj(trein_store, zmq.NOBLOCK)
-                    elif arguments[1] == 'station':
-                        # Volledige station store:
-                        with locks['station']:
-                            client_socket.send_pyobj(station_store, zmq.NOBLOCK)
-                    else:
-                        client_socket.send_pyobj(None)
-
-                elif arguments[0] == 'count' and len(arguments) == 2:
-                    # Haal de grootte van de store op:
-                    if arguments[1] == 'trein':
-                        # Grootte van trein store:
-                        client_socket.send_pyobj(len(trein_store))
-                    elif arguments[1] == 'station':
-                        # Grootte van station store:
-                        client_socket.send_pyobj(len(station_store))
-                    elif arguments[1] in counters:
-                        # Standaard counter:
-                        client_socket.send_pyobj(counters[arguments[1]])
-                    else:
-                        # Onbekend type:
-                        client_socket.send_pyobj(None)
+                antwoord = self.verwerk_opdracht(url)
+            except Exception:
+                antwoord = pickle.dumps(None, -1)
+                self.logger.exception('Fout bij verwerken client opdracht')
 
-                elif arguments[0] == 'status':
-                    # Stuur statusinformatie terug:
-                    if len(arguments) == 2 and arguments[1] == 'status':
-                        client_socket.send_pyobj(system_status['status'])
-                    else:
-                        client_socket.send_pyobj(system_status)
+            antwoorden_socket.send_multipart(envelope + [antwoord])
 
-                else:
-                    # Standaard antwoord
-                    client_socket.send_pyobj(None)
+            self.statistieken.registreer(url, time.time() - ontvangen, len(antwoord))
+
+    def verwerk_opdracht(self, url):
+        """
+        Verwerk een opdracht van een client en geef het gepickelde antwoord
+        terug. Antwoorden met delen van de stores worden gepickled terwijl de
+        betreffende store lock vastgehouden wordt; voor store/* en export/*
+        wordt alleen een kopie onder de lock gemaakt, en buiten de lock
+        gepickled (zie dumps_store en start_export).
+        """
+
+        arguments = url.split('/')
+
+        if arguments[0] == 'station' and len(arguments) == 2:
+            # Haal alle treinen op voor gegeven station
+            station_code = arguments[1].upper()
+            if station_code in station_store:
+                with locks['station']:
+                    return pickle.dumps(
+                        {'status': system_status,
+                        'versie': station_versie(station_code),
+                        'data': station_store[station_code]}, -1)
+            else:
+                return pickle.dumps({}, -1)
+
+        elif arguments[0] == 'venster' and len(arguments) in (5, 6):
+            # Haal de treinen op voor een station binnen een tijdvenster,
+            # bijvoorbeeld venster/UT/<van>/<tot>/<limit>/<sorteer>, met van
+            # en tot als unix timestamp; lege velden zijn onbegrensd:
+            station_code = arguments[1].upper()
+            try:
+                van, tot = [datetime.fromtimestamp(int(argument), pytz.utc)
+                    if argument != '' else None for argument in arguments[2:4]]
+                limit = int(arguments[4]) if arguments[4] != '' else None
+            except (ValueError, OverflowError):
+                return pickle.dumps(None, -1)
+
+            sorteer = arguments[5] if len(arguments) == 6 else None
+
+            if station_code in station_store:
+                with locks['station']:
+                    return pickle.dumps(
+                        {'status': system_status,
+                        'versie': station_versie(station_code),
+                        'data': venster_treinen(station_store[station_code],
+                            van, tot, limit, sorteer, klok.nu(pytz.utc))}, -1)
+            else:
+                return pickle.dumps({}, -1)
+
+        elif arguments[0] == 'versie' and len(arguments) == 2:
+            # Haal alleen de versie van een station op (om te controleren
+            # of een gecachede response nog actueel is):
+            station_code = arguments[1].upper()
+            if station_code in station_store:
+                return pickle.dumps(
+                    {'status': system_status,
+                    'versie': station_versie(station_code)}, -1)
+            else:
+                return pickle.dumps(None, -1)
+
+        elif arguments[0] == 'stations' and len(arguments) == 2:
+            # Haal alle treinen op voor meerdere stations tegelijk,
+            # bijvoorbeeld stations/UT,ASD,RTD
+            station_codes = self.batch_argumenten(arguments[1].upper())
+            if station_codes is not None:
+                with locks['station']:
+                    return pickle.dumps(
+                        {'status': system_status,
+                        'data': dict((station_code, station_store[station_code])
+                            for station_code in station_codes
+                            if station_code in station_store)}, -1)
+            else:
+                return pickle.dumps(None, -1)
+
+        elif arguments[0] == 'trein' and len(arguments) == 2:
+            # Haal alle stations op voor gegeven trein
+            trein_nr = arguments[1]
+            if trein_nr in trein_store:
+                with locks['trein']:
+                    return pickle.dumps(
+                        {'status': system_status,
+                        'data': trein_store[trein_nr]}, -1)
+            else:
+                return pickle.dumps({}, -1)
+
+        elif arguments[0] == 'treinen' and len(arguments) == 2:
+            # Haal alle stations op voor meerdere treinen tegelijk,
+            # bijvoorbeeld treinen/1929,11752
+            trein_nrs = self.batch_argumenten(arguments[1])
+            if trein_nrs is not None:
+                with locks['trein']:
+                    return pickle.dumps(
+                        {'status': system_status,
+                        'data': dict((trein_nr, trein_store[trein_nr])
+                            for trein_nr in trein_nrs
+                            if trein_nr in trein_store)}, -1)
+            else:
+                return pickle.dumps(None, -1)
+
+        elif arguments[0] == 'store' and len(arguments) == 2:
+            # Haal de volledige datastore op...
+            if arguments[1] == 'trein':
+                # Volledige trein store:
+                with locks['trein']:
+                    items = trein_store.items()
+                return dumps_store(items)
+            elif arguments[1] == 'station':
+                # Volledige station store:
+                with locks['station']:
+                    items = station_store.items()
+                return dumps_store(items)
+            else:
+                return pickle.dumps(None, -1)
+
+        elif arguments[0] == 'export' and len(arguments) in (2, 3) \
+            and arguments[1] in ('trein', 'station'):
+            # Start een export van de volledige datastore in chunks:
+            if len(arguments) == 3:
+                chunk_grootte = int(arguments[2])
+            else:
+                chunk_grootte = self.export_chunk_grootte
+
+            return pickle.dumps(self.start_export(arguments[1], chunk_grootte), -1)
+
+        elif arguments[0] == 'export' and len(arguments) == 3:
+            # Haal een chunk op van een lopende export:
+            return self.export_chunk(arguments[1], int(arguments[2]))
+
+        elif arguments[0] == 'count' and len(arguments) == 2:
+            # Haal de grootte van de store op:
+            if arguments[1] == 'trein':
+                # Grootte van trein store:
+                return pickle.dumps(len(trein_store), -1)
+            elif arguments[1] == 'station':
+                # Grootte van station store:
+                return pickle.dumps(len(station_store), -1)
+            elif arguments[1] in counters:
+                # Standaard counter:
+                return pickle.dumps(counters[arguments[1]], -1)
+            else:
+                # Onbekend type:
+                return pickle.dumps(None, -1)
+
+        elif arguments[0] == 'status':
+            # Stuur statusinformatie terug:
+            if len(arguments) == 2 and arguments[1] == 'status':
+                return pickle.dumps(system_status['status'], -1)
+            else:
+                return pickle.dumps(dict(system_status, snapshot=snapshot_status), -1)
+
+        elif arguments[0] == 'stats' and len(arguments) == 2 and arguments[1] == 'client':
+            # Latency en responsegroottes per opdracht:
+            return pickle.dumps(self.statistieken.samenvatting(), -1)
+
+        elif arguments[0] == 'stats' and len(arguments) == 2 and arguments[1] == 'gc':
+            # Instellingen en pauzes van de Python garbage collector:
+            return pickle.dumps(gc_beleid.samenvatting(), -1)
+
+        elif arguments[0] == 'metrics' and len(arguments) == 1:
+            # Alle meetwaarden in het tekstformaat van Prometheus:
+            return pickle.dumps(metrics_tekst(self.statistieken), -1)
+
+        else:
+            # Standaard antwoord
+            return pickle.dumps(None, -1)
+
+    def start_export(self, store_naam, chunk_grootte):
+        """
+        Start een export van de trein of station store. Van de store wordt
+        een snapshot gemaakt (alleen de dicts worden gekopieerd, niet de
+        treinen zelf), zodat de store lock niet vastgehouden wordt tijdens
+        het serialiseren. Het snapshot wordt opgedeeld in chunks van maximaal
+        chunk_grootte treinen, welke los opgevraagd worden met export/<id>/<nr>.
+        """
+
+        if store_naam == 'trein':
+            store = trein_store
+        else:
+            store = station_store
+
+        with locks[store_naam]:
+            snapshot = [(sleutel, dict(treinen)) for sleutel, treinen in store.items()]
+
+        # Deel snapshot op in chunks:
+        chunks = []
+        chunk = []
+        aantal_treinen = 0
+        for sleutel, treinen in snapshot:
+            if len(chunk) > 0 and aantal_treinen + len(treinen) > chunk_grootte:
+                chunks.append(chunk)
+                chunk = []
+                aantal_treinen = 0
+
+            chunk.append((sleutel, treinen))
+            aantal_treinen += len(treinen)
+
+        if len(chunk) > 0:
+            chunks.append(chunk)
+
+        if len(chunks) == 0:
+            # Lege store: niets op te vragen, dus geen export bijhouden
+            return {'export': None, 'store': store_naam, 'chunks': 0, 'sleutels': 0,
+                    'status': system_status}
+
+        with locks['export']:
+            ruim_exports_op()
+
+            ClientWorkerThread.export_volgnummer += 1
+            export_id = str(ClientWorkerThread.export_volgnummer)
+            exports[export_id] = {'store': store_naam, 'chunks': chunks, 'tijd': datetime.now()}
+
+        self.logger.info('Export %s gestart (%s): %s sleutels in %s chunks',
+            export_id, store_naam, len(snapshot), len(chunks))
+
+        return {'export': export_id, 'store': store_naam,
+                'chunks': len(chunks), 'sleutels': len(snapshot),
+                'status': system_status}
+
+    def export_chunk(self, export_id, chunk_nr):
+        """
+        Geef een chunk van een lopende export terug, als losse pickle van een
+        list met (sleutel, treinen) tuples. Na de laatste chunk wordt de
+        export gewist. Onbekende of reeds verstuurde chunks geven None terug.
+        """
+
+        with locks['export']:
+            ruim_exports_op()
+
+            if export_id not in exports or chunk_nr < 0 or chunk_nr >= len(exports[export_id]['chunks']):
+                return pickle.dumps(None, -1)
+
+            export = exports[export_id]
+            export['tijd'] = datetime.now()
+            chunk = export['chunks'][chunk_nr]
+
+            # Geef geheugen van verstuurde chunks direct vrij:
+            export['chunks'][chunk_nr] = None
+
+            if chunk_nr == len(export['chunks']) - 1:
+                del(exports[export_id])
+
+        return pickle.dumps(chunk, -1)
+
+    def batch_argumenten(self, argument):
+        """
+        Splits een kommagescheiden lijst (bijvoorbeeld UT,ASD,RTD) uit een
+        batch-opdracht. Geeft None terug bij een lege of te lange lijst.
+        """
+
+        sleutels = [sleutel for sleutel in argument.split(',') if sleutel != '']
+
+        if len(sleutels) == 0 or len(sleutels) > self.max_batch:
+            return None
+
+        return sleutels
+
+
+class ClientStatistieken(object):
+    """
+    Latency (ontvangst tot verzenden) en responsegroottes per client opdracht,
+    plus een log van trage opdrachten boven een instelbare drempel.
+    """
+
+    # Opdrachten met een eigen histogram, overige opdrachten vallen onder 'overig':
+    opdrachten = ['station', 'stations', 'trein', 'treinen', 'store', 'export',
+                  'count', 'status', 'stats', 'versie', 'venster', 'metrics']
+
+    logger = None
+    histogrammen = None
+    rijen = None
+    traag_drempel = 1000        # trage opdracht vanaf 1000 ms
+    traag = 0
+
+    def __init__(self, configuration):
+        self.logger = logging.getLogger(__name__)
+
+        if 'client' in configuration and 'slow_query_ms' in configuration['client']:
+            self.traag_drempel = int(configuration['client']['slow_query_ms'])
+
+        # registreer wordt vanuit alle client workers aangeroepen (de
+        # histogrammen hebben een eigen lock, de teller niet):
+        self._lock = threading.Lock()
+
+        self.histogrammen = {}
+        for opdracht in self.opdrachten + ['overig']:
+            self.histogrammen[opdracht] = {
+                'latency_ms': dvs_metrics.Histogram(dvs_metrics.LATENCY_BUCKETS_MS),
+                'grootte_bytes': dvs_metrics.Histogram(dvs_metrics.GROOTTE_BUCKETS)
+            }
+
+    def registreer(self, url, duur, grootte):
+        """
+        Registreer de duur (in seconden) en responsegrootte (in bytes)
+        van een verwerkte opdracht
+        """
+
+        opdracht = url.split('/', 1)[0]
+        if opdracht not in self.histogrammen:
+            opdracht = 'overig'
+
+        duur_ms = duur * 1000
+        self.histogrammen[opdracht]['latency_ms'].meet(duur_ms)
+        self.histogrammen[opdracht]['grootte_bytes'].meet(grootte)
+
+        if duur_ms >= self.traag_drempel:
+            with self._lock:
+                self.traag += 1
+            self.logger.warn('Trage opdracht %s: %.1f ms, %s bytes', url[:100], duur_ms, grootte)
+
+    def samenvatting(self):
+        """
+        Geef per opdracht een samenvatting van latency en responsegrootte
+        (aantal, gemiddelde, maximum, p50/p95/p99)
+        """
+
+        samenvatting = {'traag': self.traag, 'traag_drempel_ms': self.traag_drempel, 'opdrachten': {}}
+
+        if self.rijen is not None:
+            samenvatting['rijen'] = dict((rij, queue.qsize()) for rij, queue in self.rijen.items())
+
+        for opdracht, histogrammen in self.histogrammen.items():
+            if histogrammen['latency_ms'].aantal > 0:
+                samenvatting['opdrachten'][opdracht] = dict(
+                    (naam, histogram.samenvatting()) for naam, histogram in histogrammen.items())
+
+        return samenvatting
+
+
+class FeedThread(threading.Thread):
+    """
+    Thread die wijzigingen in de station store publiceert op een PUB socket.
+    Ieder event wordt verstuurd als multipart bericht [topic, event], waarbij
+    het topic begint met de stationscode (bijvoorbeeld 'UT/update'), zodat
+    subscribers aan ZeroMQ-zijde op station kunnen filteren.
+    """
+
+    logger = None
+    feed_bind = None
+    hwm = 10000
+
+    def __init__(self, feed_bind, hwm):
+        self.feed_bind = feed_bind
+        self.hwm = hwm
+        self.logger = logging.getLogger(__name__)
+        threading.Thread.__init__(self, name='FeedThread')
+
+    def run(self):
+        context = zmq.Context()
+        feed_socket = context.socket(zmq.PUB)
+
+        # Trage subscribers: boven de HWM laat ZeroMQ events voor die
+        # subscriber vallen, zodat de verwerking van berichten nooit blokkeert.
+        # Met het volgnummer kan een subscriber gemiste events detecteren, ook
+        # events die bij een volle feed queue vervallen (zie meld_mutatie).
+        feed_socket.setsockopt(zmq.SNDHWM, self.hwm)
+        feed_socket.bind(self.feed_bind)
+
+        self.logger.info('Feed thread gereed (%s), HWM %s', self.feed_bind, self.hwm)
+
+        while True:
+            volgnummer, versie, soort, station_code, rit_id, trein = feed_queue.get()
+
+            try:
+                event = {
+                    'volgnummer': volgnummer,
+                    'versie': versie,
+                    'soort': soort,
+                    'station': station_code,
+                    'rit_id': rit_id,
+                    'trein': trein,
+                    'tijd': datetime.now(pytz.utc)
+                }
+
+                # Een PUB socket blokkeert nooit en geeft geen fout boven de
+                # HWM; ZeroMQ laat het event dan stil vallen (niet te tellen):
+                feed_socket.send_multipart(
+                    ['%s/%s' % (station_code, soort), pickle.dumps(event, -1)])
+                counters['feed'] += 1
             except Exception:
-                client_socket.send_pyobj(None)
-                self.logger.exception('Fout bij sturen client response')
+                self.logger.exception('Fout bij publiceren feed event')
 
 
 # Garbage collection thread:
@@ -496,15 +1399,29 @@ class GarbageThread(threading.Thread):
         self.keep_departures = keep_departures
 
     def run(self):
-        self.logger.debug("Initiele garbage collecting")
-        self.garbage_collect()
+        # Een fout mag de thread niet stoppen: bij een virtuele klok wacht
+        # de replay (klok.zet) anders op een thread die nooit meer wacht.
+        try:
+            self.logger.debug("Initiele garbage collecting")
+            self.garbage_collect()
+        except Exception:
+            self.logger.error('Fout in GC thread', exc_info=True)
+
+        vorige_meting = (klok.tijd(), counters['msg'])
 
         # Loop over garbage collecting iedere 1m:
-        while not self.stopped.wait(60):
+        while not klok.wacht(self.stopped, 60):
             try:
                 self.logger.debug("Periodieke garbage collecting")
                 self.garbage_collect()
 
+                # Berichten per seconde sinds de vorige ronde:
+                meting = (klok.tijd(), counters['msg'])
+                if meting[0] > vorige_meting[0]:
+                    metrieken['berichten_per_seconde'] = \
+                        (meting[1] - vorige_meting[1]) / (meting[0] - vorige_meting[0])
+                vorige_meting = meting
+
                 self.logger.info(
                     "Statistieken: station_store=%s, trein_store=%s, status=%s",
                     len(station_store),
@@ -537,7 +1454,7 @@ class GarbageThread(threading.Thread):
                         system_status['status'] = 'DOWN'
                         if system_status['down_since'] == None:
                             # Downtime start nu
-                            system_status['down_since'] = datetime.utcnow()
+                            system_status['down_since'] = klok.utcnu()
 
                             system_status['recovering_since'] = None
 
@@ -552,7 +1469,7 @@ class GarbageThread(threading.Thread):
                             self.logger.warning('Systeem is RECOVERING na downtime (gestart om %s)',
                                 system_status['down_since'])
                             system_status['status'] = 'RECOVERING'
-                            system_status['recovering_since'] = datetime.now()
+                            system_status['recovering_since'] = klok.nu()
 
                         elif system_status['status'] == 'RECOVERING':
                             # Systeem is aan het recoveren na downtime. Indien recovery-
@@ -563,7 +1480,7 @@ class GarbageThread(threading.Thread):
                                 timedelta(minutes = self.recovery_time)
 
                             # Ook recovery tijd voorbij, systeemstatus is OK:
-                            if datetime.now() >= recover_threshold_time:
+                            if klok.nu() >= recover_threshold_time:
                                 system_status['status'] = 'UP'
                                 self.logger.warning('Systeem weer UP na downtime (%s t/m %s) en recovery. Duur downtime %s',
                                     system_status['down_since'], system_status['recovering_since'],
@@ -579,7 +1496,7 @@ class GarbageThread(threading.Thread):
                     system_status['status'] = 'UNKNOWN'
                     system_status['recovering_since'] = None
                     if system_status['down_since'] is None:
-                        system_status['down_since'] = datetime.now()
+                        system_status['down_since'] = klok.nu()
 
             except Exception:
                 self.logger.error('Fout in GC thread', exc_info=True)
@@ -593,10 +1510,13 @@ class GarbageThread(threading.Thread):
 
         global station_store, trein_store, counters
 
+        ronde_start = time.time()
+
         # Bereken threshold:
-        threshold = datetime.now(pytz.utc) - timedelta(minutes=self.gc_threshold)
-        threshold_statisch = datetime.now(pytz.utc) - timedelta(minutes=self.gc_threshold_static)
-        threshold_departed = datetime.now(pytz.utc) - timedelta(minutes=self.gc_threshold_departed)
+        nu = klok.nu(pytz.utc)
+        threshold = nu - timedelta(minutes=self.gc_threshold)
+        threshold_statisch = nu - timedelta(minutes=self.gc_threshold_static)
+        threshold_departed = nu - timedelta(minutes=self.gc_threshold_departed)
 
         # Performance controle; start:
         start = datetime.now()
@@ -609,12 +1529,16 @@ class GarbageThread(threading.Thread):
                     if trein.is_vertrokken():
                         if trein.vertrokken_timestamp is None:
                             # Timestamp ontbreekt, voeg alsnog toe:
-                            trein.markeer_vertrokken()
+                            trein.markeer_vertrokken(nu)
+                            meld_mutatie('vertrokken', station, trein_rit, trein)
+                            log_mutatie(('vertrokken', 'station', station, trein_rit, nu))
                         else:
                             # Controleer of threshold_departed overschreden is
                             try:
                                 if trein.vertrokken_timestamp < threshold_departed and self.keep_departures is False:
                                     del(station_store[station][trein_rit])
+                                    meld_mutatie('verwijderd', station, trein_rit)
+                                    log_mutatie(('wis', 'station', station, trein_rit))
                             except KeyError:
                                 self.logger.debug("GC: %s/%s al verwijderd", trein_rit, station)
                     else:
@@ -623,8 +1547,13 @@ class GarbageThread(threading.Thread):
                         if (trein.statisch == False and trein.vertrek_actueel < threshold) \
                         or (trein.statisch == True and trein.vertrek_actueel + timedelta(seconds=trein.vertraging) < threshold_statisch):
                             try:
+                                # Trein kan inmiddels vervangen zijn; gebruik
+                                # de gemarkeerde trein uit de store:
                                 with locks['station']:
-                                    station_store[station][trein_rit].markeer_vertrokken()
+                                    gemarkeerd = station_store[station][trein_rit]
+                                    gemarkeerd.markeer_vertrokken(nu)
+                                meld_mutatie('vertrokken', station, trein_rit, gemarkeerd)
+                                log_mutatie(('vertrokken', 'station', station, trein_rit, gemarkeerd.vertrokken_timestamp))
 
                                 verwerkte_items += 1
 
@@ -662,13 +1591,16 @@ class GarbageThread(threading.Thread):
                     if trein.is_vertrokken():
                         if trein.vertrokken_timestamp is None:
                             # Timestamp ontbreekt, voeg alsnog toe:
-                            trein.markeer_vertrokken()
+                            trein.markeer_vertrokken(nu)
+                            meld_mutatie('vertrokken', station, trein_rit, trein)
+                            log_mutatie(('vertrokken', 'trein', trein_rit, station, nu))
                             self.logger.warning("GC: trein %s/%s vertrokken maar timestamp leeg", trein_rit, station)
                         else:
                             # Controleer of threshold_departed overschreden is
                             try:
                                 if trein.vertrokken_timestamp < threshold_departed and self.keep_departures is False:
                                     del(trein_store[trein_rit][station])
+                                    log_mutatie(('wis', 'trein', trein_rit, station))
                                     self.logger.debug("GC: TS, trein %s/%s verwijderd", trein_rit, station)
                             except KeyError:
                                 self.logger.debug("GC: %s/%s al verwijderd", trein_rit, station)
@@ -680,7 +1612,9 @@ class GarbageThread(threading.Thread):
                             # Geen trein verwerken die al als vertrokken is gemarkeerd:
                             try:
                                 with locks['trein']:
-                                    trein_store[trein_rit][station].markeer_vertrokken()
+                                    gemarkeerd = trein_store[trein_rit][station]
+                                    gemarkeerd.markeer_vertrokken(nu)
+                                log_mutatie(('vertrokken', 'trein', trein_rit, station, gemarkeerd.vertrokken_timestamp))
 
                                 verwerkte_items += 1
 
@@ -712,13 +1646,75 @@ class GarbageThread(threading.Thread):
             duur = datetime.now() - start
             self.logger.debug("GC [TS] * %s items verwerkt in %s (%s per verwerking)", verwerkte_items, duur, (duur / verwerkte_items))
 
-        # Trigger Python GC na deze opruimronde:
-        gc.collect()
+        # Verlopen exports (ook als er geen opdrachten meer komen):
+        with locks['export']:
+            ruim_exports_op()
+
+        # Python GC na deze opruimronde (volgens gc_beleid):
+        gc_beleid.na_ronde()
+
+        metrieken['gc_ms'].meet((time.time() - ronde_start) * 1000)
 
 
         return
 
 
+# Write-ahead log threads:
+class WalThread(threading.Thread):
+    """
+    Thread die het write-ahead log periodiek naar disk schrijft (fsync),
+    zodat mutaties gebundeld gesynct worden
+    """
+
+    stopped = None
+    logger = None
+    interval = 1                # seconden tussen fsyncs
+
+    def __init__(self, event, interval):
+        threading.Thread.__init__(self, name='WalThread')
+        self.logger = logging.getLogger(__name__)
+        self.stopped = event
+        self.interval = interval
+
+    def run(self):
+        self.logger.info("WAL thread gestart, fsync iedere %ss", self.interval)
+
+        while not self.stopped.wait(self.interval):
+            try:
+                wal.sync()
+            except Exception:
+                self.logger.error('Fout bij fsync WAL', exc_info=True)
+
+
+class SnapshotThread(threading.Thread):
+    """
+    Thread die periodiek een snapshot van de stores maakt, waarna
+    de oude segmenten van het write-ahead log gewist worden
+    """
+
+    stopped = None
+    logger = None
+    interval = 15               # minuten tussen snapshots
+    fork = True                 # snapshot schrijven vanuit een child proces
+
+    def __init__(self, event, interval, fork):
+        threading.Thread.__init__(self, name='SnapshotThread')
+        self.logger = logging.getLogger(__name__)
+        self.stopped = event
+        self.interval = interval
+        self.fork = fork
+
+    def run(self):
+        self.logger.info("Snapshot thread gestart, snapshot iedere %sm (%s)", self.interval,
+            'fork' if self.fork else 'thread')
+
+        while not self.stopped.wait(self.interval * 60):
+            try:
+                maak_snapshot(self.fork)
+            except Exception:
+                self.logger.error('Fout bij maken snapshot', exc_info=True)
+
+
 # Injector thread:
 class InjectorThread(threading.Thread):
     """
@@ -765,8 +1761,15 @@ class InjectorThread(threading.Thread):
                         station_store[trein.rit_station.code] = {}
 
                 # Voeg geinjecteerde trein toe aan station en trein stores:
+                if rit_id in station_store[trein.rit_station.code]:
+                    mutatie = 'update'
+                else:
+                    mutatie = 'insert'
+
                 station_store[trein.rit_station.code][rit_id] = trein
                 trein_store[rit_id][trein.rit_station.code] = trein
+                meld_mutatie(mutatie, trein.rit_station.code, rit_id, trein)
+                log_mutatie(('zet', trein.rit_station.code, rit_id, trein, True, True))
 
                 # Stuur response naar injector
                 client_socket.send_json({'result': True})
@@ -28,6 +28,7 @@ def main():
     parser.add_argument('-s', '--server', action='store', default='127.0.0.1', help='DVS server (standaard 127.0.0.1)')
     parser.add_argument('-p', '--port', action='store', default='8120', help='DVS poort (standaard 8120)')
     parser.add_argument('-t', '--timeout', action='store', default='4', help='timeout in seconden (standaard 4s)')
+    parser.add_argument('-o', '--output', action='store', help='bestand voor export (bij opdracht export/station of export/trein)')
     parser.add_argument('OPDRACHT', nargs='?',
         action='store', help='opdracht naar DVS server (standaard: "status")', default='status')
 
@@ -57,12 +58,24 @@ def main():
     poller = zmq.Poller()
     poller.register(client, zmq.POLLIN)
     
+    if opdracht.startswith('export/'):
+        export(client, poller, server_timeout, args.output, args.quiet)
+
+        if args.quiet == False:
+            print "Opdracht uitgevoerd binnen %ss" % (time.clock() - time_start)
+
+        sys.exit(0)
+
     if poller.poll(server_timeout * 1000):
         data = client.recv_pyobj()
         time_elapsed = (time.clock() - time_start)
 
-        pretty = pprint.PrettyPrinter(indent=4)
-        pretty.pprint(data)
+        if opdracht == 'metrics' and isinstance(data, basestring):
+            # Tekstformaat van Prometheus:
+            print data
+        else:
+            pretty = pprint.PrettyPrinter(indent=4)
+            pretty.pprint(data)
 
         if args.quiet == False:
             print "Opdracht uitgevoerd binnen %ss" % time_elapsed
@@ -72,5 +85,45 @@ def main():
         print "ERROR: Timeout, server reageerde niet binnen %ss" % server_timeout
         sys.exit(1)
 
+def export(client, poller, server_timeout, output, quiet):
+    """
+    Lees een export (export/station of export/trein) chunk voor chunk uit en
+    schrijf iedere chunk direct naar het outputbestand. Het bestand bevat
+    achter elkaar een pickle per chunk (een list met (sleutel, treinen)
+    tuples), in te lezen door herhaald pickle.load aan te roepen.
+    """
+
+    if output is None:
+        print "ERROR: geef een outputbestand op met --output"
+        sys.exit(1)
+
+    if not poller.poll(server_timeout * 1000):
+        print "ERROR: Timeout, server reageerde niet binnen %ss" % server_timeout
+        sys.exit(1)
+
+    export_info = client.recv_pyobj()
+
+    if export_info is None:
+        print "ERROR: export niet gestart"
+        sys.exit(1)
+
+    if quiet == False:
+        print "Export %s: %s sleutels in %s chunks" % \
+            (export_info['store'], export_info['sleutels'], export_info['chunks'])
+
+    with open(output, 'wb') as output_file:
+        for chunk_nr in range(export_info['chunks']):
+            client.send('export/%s/%s' % (export_info['export'], chunk_nr))
+
+            if not poller.poll(server_timeout * 1000):
+                print "ERROR: Timeout, server reageerde niet binnen %ss" % server_timeout
+                sys.exit(1)
+
+            # Chunk is al gepickled door de server, schrijf ongewijzigd weg:
+            output_file.write(client.recv())
+
+    if quiet == False:
+        print "Export geschreven naar %s" % output
+
 if __name__ == "__main__":
     main()
@@ -5,6 +5,14 @@ Testtool om een lokale HTTP server te starten die verbinding maakt
 met dvs-daemon. Niet geschikt voor productie! Gebruik daar WSGI voor.
 """
 
+import sys
+
+# Met --gevent moet de standaardlibrary gepatcht worden voordat
+# bottle en de HTTP interface geladen worden:
+if '--gevent' in sys.argv:
+    from gevent import monkey
+    monkey.patch_all()
+
 import bottle
 import argparse
 import logging
@@ -24,6 +32,15 @@ def main():
         default='config/http.yaml', action='store',
         help='HTTP configuratiebestand')
 
+    parser.add_argument('--host', dest='host', default='localhost', action='store',
+        help='host om op te luisteren (standaard localhost)')
+
+    parser.add_argument('--port', dest='port', default=8080, type=int, action='store',
+        help='poort om op te luisteren (standaard 8080)')
+
+    parser.add_argument('--gevent', dest='gevent', action='store_true',
+        help='asynchrone server (gevent), voor veel gelijktijdige requests')
+
     # Parse config:
     args = parser.parse_args()
     config = dvs_util.load_config(args.configFile)
@@ -37,8 +54,12 @@ def main():
     logger = logging.getLogger(__name__)
     logger.info("DVS server: %s", config['dvs']['daemon'])
 
-    bottle.debug(True)
-    bottle.run(host='localhost', port=8080, reloader=True)
+    if args.gevent:
+        logger.info("Asynchrone server (gevent)")
+        bottle.run(host=args.host, port=args.port, server='gevent', quiet=True)
+    else:
+        bottle.debug(True)
+        bottle.run(host=args.host, port=args.port, reloader=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,192 @@
+"""
+Module met een kleine in-memory cache en het samenvoegen van
+gelijktijdige aanvragen, voor de HTTP interface.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class Cache(object):
+    """
+    Begrensde cache (least recently used) met optioneel een TTL per item.
+    Wordt het maximaal aantal items overschreden, dan vervalt het item
+    dat het langst niet gebruikt is. Thread-safe.
+    """
+
+    max_items = 1000
+    hits = 0
+    misses = 0
+
+    def __init__(self, max_items=1000):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sleutel):
+        """
+        Geef de waarde voor sleutel, of None indien niet aanwezig
+        of verlopen
+        """
+
+        with self._lock:
+            item = self._items.pop(sleutel, None)
+
+            if item is None or (item[1] is not None and item[1] <= time.time()):
+                self.misses += 1
+                return None
+
+            # Opnieuw toevoegen, zodat dit item als laatste gebruikt geldt:
+            self._items[sleutel] = item
+            self.hits += 1
+            return item[0]
+
+    def bevat(self, sleutel):
+        """
+        Geef aan of sleutel aanwezig is en niet verlopen (telt niet
+        mee als hit of miss)
+        """
+
+        with self._lock:
+            item = self._items.get(sleutel)
+            return item is not None and (item[1] is None or item[1] > time.time())
+
+    def zet(self, sleutel, waarde, ttl=None):
+        """
+        Sla waarde op onder sleutel, met een TTL in seconden
+        (None voor geen TTL)
+        """
+
+        if ttl is None:
+            verloopt = None
+        else:
+            verloopt = time.time() + ttl
+
+        with self._lock:
+            self._items.pop(sleutel, None)
+            self._items[sleutel] = (waarde, verloopt)
+
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def wis(self, sleutel):
+        """
+        Verwijder sleutel uit de cache (indien aanwezig)
+        """
+
+        with self._lock:
+            self._items.pop(sleutel, None)
+
+    def stats(self):
+        """
+        Geef een dict met het aantal items, hits en misses
+        """
+
+        return {'items': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+class SingleFlight(object):
+    """
+    Voert een functie voor dezelfde sleutel nooit gelijktijdig meerdere
+    keren uit: wie een sleutel opvraagt die al in behandeling is, wacht op
+    het resultaat van de lopende aanroep (of diens exception). Thread-safe.
+    """
+
+    uitgevoerd = 0
+    gedeeld = 0
+
+    def __init__(self):
+        self._lopend = {}
+        self._lock = threading.Lock()
+
+    def doe(self, sleutel, functie, timeout=None):
+        """
+        Geef het resultaat van functie(), gedeeld met gelijktijdige
+        aanroepen voor dezelfde sleutel. Met timeout wordt maximaal zoveel
+        seconden gewacht op een lopende aanroep, daarna volgt een
+        SingleFlightTimeout (de lopende aanroep zelf loopt door).
+        """
+
+        with self._lock:
+            aanroep = self._lopend.get(sleutel)
+
+            if aanroep is None:
+                aanroep = _Aanroep()
+                self._lopend[sleutel] = aanroep
+                eigenaar = True
+                self.uitgevoerd += 1
+            else:
+                eigenaar = False
+                self.gedeeld += 1
+
+        if eigenaar:
+            self._voer_uit(sleutel, aanroep, functie)
+        elif not aanroep.klaar.wait(timeout):
+            raise SingleFlightTimeout('Geen resultaat binnen %ss' % timeout)
+
+        if aanroep.fout is not None:
+            raise aanroep.fout
+
+        return aanroep.resultaat
+
+    def start(self, sleutel, functie):
+        """
+        Start functie() in een aparte thread, tenzij er al een aanroep voor
+        sleutel loopt. Een latere doe() voor dezelfde sleutel wacht op het
+        resultaat van deze aanroep.
+        """
+
+        with self._lock:
+            if sleutel in self._lopend:
+                return
+
+            aanroep = _Aanroep()
+            self._lopend[sleutel] = aanroep
+            self.uitgevoerd += 1
+
+        thread = threading.Thread(target=self._voer_uit, args=(sleutel, aanroep, functie))
+        thread.daemon = True
+        thread.start()
+
+    def _voer_uit(self, sleutel, aanroep, functie):
+        """
+        Voer een aanroep uit en geef het resultaat door aan alle wachtenden
+        """
+
+        try:
+            aanroep.resultaat = functie()
+        except Exception as error:
+            aanroep.fout = error
+        finally:
+            with self._lock:
+                del self._lopend[sleutel]
+            aanroep.klaar.set()
+
+    def stats(self):
+        """
+        Geef een dict met het aantal uitgevoerde en gedeelde aanroepen
+        """
+
+        return {'uitgevoerd': self.uitgevoerd, 'gedeeld': self.gedeeld,
+                'lopend': len(self._lopend)}
+
+
+class _Aanroep(object):
+    """
+    Lopende aanroep binnen een SingleFlight
+    """
+
+    resultaat = None
+    fout = None
+
+    def __init__(self):
+        self.klaar = threading.Event()
+
+
+class SingleFlightTimeout(Exception):
+    """
+    Exception wanneer een lopende aanroep niet binnen de timeout klaar is
+    """
+
+    pass
@@ -0,0 +1,126 @@
+"""
+Module om opdrachten naar de DVS daemon te sturen over een pool van
+herbruikbare ZeroMQ verbindingen (een pool per proces).
+Draait de HTTP interface onder gevent (gunicorn -k gevent of
+dvs-http.py --gevent), dan wordt zmq.green gebruikt zodat wachten op
+de daemon andere requests niet blokkeert.
+"""
+
+import os
+import threading
+import zmq
+
+
+class DvsClient(object):
+    """
+    Client voor de DVS daemon. Verbindingen (REQ sockets) worden pas
+    gemaakt wanneer ze nodig zijn en na gebruik teruggezet in de pool.
+    Een socket waarvan het antwoord niet binnen de timeout binnenkomt
+    wordt gesloten en niet hergebruikt, omdat een REQ socket pas weer een
+    opdracht kan versturen nadat het vorige antwoord ontvangen is.
+    """
+
+    adres = None
+    timeout = 4
+    pool_grootte = 16
+
+    def __init__(self, adres, timeout=4, pool_grootte=16):
+        self.adres = adres
+        self.timeout = timeout
+        self.pool_grootte = pool_grootte
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._context = None
+        self._pool = []
+
+    def opdracht(self, command, timeout=None):
+        """
+        Stuur een opdracht naar de DVS daemon en geef het (unpickled)
+        antwoord terug. Geeft een DvsException bij een timeout
+        (standaard de timeout van de client, in seconden).
+        """
+
+        if timeout is None:
+            timeout = self.timeout
+
+        client = self._neem_socket()
+
+        try:
+            client.send(command)
+
+            if not client.poll(max(timeout, 0) * 1000):
+                raise DvsException('DVS Server Timeout')
+
+            data = client.recv_pyobj()
+        except BaseException:
+            # Na een fout (ook een onderbreking, zoals een gevent Timeout,
+            # tijdens het wachten) kan de REQ socket halverwege een opdracht
+            # staan; nooit terugzetten in de pool:
+            client.close()
+            raise
+
+        self._zet_socket_terug(client)
+
+        return data
+
+    def _neem_socket(self):
+        """
+        Geef een socket uit de pool, of maak een nieuwe socket
+        """
+
+        with self._lock:
+            # Na een fork (bijvoorbeeld gunicorn workers) is de context van
+            # het parent proces niet bruikbaar, begin dan met een nieuwe pool:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._context = zmq_module().Context()
+                self._pool = []
+
+            if len(self._pool) > 0:
+                return self._pool.pop()
+
+            client = self._context.socket(zmq.REQ)
+
+        client.setsockopt(zmq.LINGER, 0)
+        client.connect(self.adres)
+
+        return client
+
+    def _zet_socket_terug(self, client):
+        """
+        Zet een socket terug in de pool, of sluit deze als de pool vol is
+        """
+
+        with self._lock:
+            if self._pid == os.getpid() and len(self._pool) < self.pool_grootte:
+                self._pool.append(client)
+                return
+
+        client.close()
+
+
+def zmq_module():
+    """
+    Geef zmq.green indien gevent de standaardlibrary gepatcht heeft
+    (cooperatieve sockets), anders zmq
+    """
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        return zmq
+
+    if monkey.is_module_patched('socket'):
+        from zmq import green
+        return green
+
+    return zmq
+
+
+class DvsException(Exception):
+    """
+    Exception class voor DVS fouten
+    """
+
+    pass
@@ -0,0 +1,134 @@
+"""
+Module voor het beleid rond de garbage collector van Python in de DVS
+daemon: debugvlaggen, drempels, wanneer een volledige collectie gedaan
+wordt, en het meten van de pauzes per generatie.
+
+Python 2.7 kent geen gc.callbacks en geen gc.freeze; pauzes worden daarom
+gemeten voor de collecties die de daemon zelf uitvoert. Bevriezen na het
+inladen van de stores is een volledige collectie, zodat alle ingeladen
+objecten in de oudste generatie staan en als langlevend meetellen: Python
+doet een automatische volledige collectie pas als het aantal nieuwe
+langlevende objecten 25% van het aantal bestaande langlevende objecten is.
+"""
+
+import gc
+import logging
+import time
+
+import dvs_metrics
+
+
+# Bucketgrenzen voor GC pauzes in milliseconden (0.01ms t/m 10s):
+PAUZE_BUCKETS_MS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50,
+                    100, 250, 500, 1000, 2500, 5000, 10000]
+
+PROFIELEN = {
+    'productie': 0,
+    'debug': gc.DEBUG_UNCOLLECTABLE | gc.DEBUG_INSTANCES | gc.DEBUG_OBJECTS
+}
+
+
+class GcBeleid(object):
+    """
+    Beleid voor de garbage collector, in te stellen met de python_gc sectie
+    in de configuratie:
+    - profiel: productie (standaard, geen debugvlaggen) of debug
+    - drempels: drempels voor automatische collecties (gc.set_threshold)
+    - volledig_interval: aantal GC rondes (minuten) tussen volledige
+      collecties (0: nooit, alleen automatisch); na de overige rondes wordt
+      generatie 1 gecollect
+    - bevriezen: volledige collectie na het inladen van de stores
+    """
+
+    logger = None
+    profiel = 'productie'
+    drempels = None
+    volledig_interval = 60      # GC rondes
+    bevriezen = True
+
+    pauzes = None               # histogram per generatie
+    rondes = 0                  # GC rondes sinds de laatste volledige collectie
+
+    def __init__(self, configuratie):
+        self.logger = logging.getLogger(__name__)
+
+        self.profiel = configuratie.get('profiel', self.profiel)
+        if self.profiel not in PROFIELEN:
+            raise ValueError('Onbekend GC profiel: %s' % self.profiel)
+
+        if 'drempels' in configuratie:
+            self.drempels = [int(drempel) for drempel in configuratie['drempels']]
+        self.volledig_interval = int(configuratie.get('volledig_interval', self.volledig_interval))
+        self.bevriezen = bool(configuratie.get('bevriezen', self.bevriezen))
+
+        self.pauzes = [dvs_metrics.Histogram(PAUZE_BUCKETS_MS) for _ in range(3)]
+
+    def pas_toe(self):
+        """
+        Stel debugvlaggen en drempels van de garbage collector in
+        """
+
+        gc.set_debug(PROFIELEN[self.profiel])
+
+        if self.drempels is not None:
+            gc.set_threshold(*self.drempels)
+
+        self.logger.info("Python GC: profiel %s, drempels %s, volledige collectie iedere %s GC rondes",
+            self.profiel, gc.get_threshold(), self.volledig_interval)
+
+    def collect(self, generatie=2):
+        """
+        Collect generatie (en jongere generaties) en registreer de pauze.
+        Geeft het aantal gevonden onbereikbare objecten.
+        """
+
+        start = time.time()
+        gevonden = gc.collect(generatie)
+        self.pauzes[generatie].meet((time.time() - start) * 1000)
+
+        return gevonden
+
+    def na_laden(self):
+        """
+        Aanroepen nadat de stores ingeladen zijn (snapshot, log of replay)
+        """
+
+        if not self.bevriezen:
+            return
+
+        start = time.time()
+        self.collect(2)
+        self.rondes = 0
+
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        self.logger.info("Python GC: ingeladen objecten bevroren in %.2fs", time.time() - start)
+
+    def na_ronde(self):
+        """
+        Aanroepen na iedere GC ronde van de daemon: een volledige collectie
+        na iedere volledig_interval rondes, anders generatie 1
+        """
+
+        self.rondes += 1
+
+        if self.volledig_interval > 0 and self.rondes >= self.volledig_interval:
+            self.rondes = 0
+            return self.collect(2)
+
+        return self.collect(1)
+
+    def samenvatting(self):
+        """
+        Geef instellingen, huidige tellingen en de pauzes per generatie
+        """
+
+        return {
+            'profiel': self.profiel,
+            'drempels': gc.get_threshold(),
+            'telling': gc.get_count(),
+            'volledig_interval': self.volledig_interval,
+            'pauzes_ms': dict((generatie, histogram.samenvatting())
+                for generatie, histogram in enumerate(self.pauzes))
+        }
@@ -4,18 +4,74 @@ Deze module maakt het mogelijk om informatie per station of per trein
 op te vragen. Iedere request geeft een JSON response terug.
 """
 
-import zmq
+import calendar
 import datetime
+import hashlib
+import isodate
 import pytz
 import bottle
 import logging
+import re
+import threading
+import time
+from Queue import Empty
 from bottle import response
 
+import dvs_cache
+import dvs_client
 import dvs_http_parsers
+import dvs_json
+import dvs_metrics
+import dvs_msgpack
+import dvs_stream
+import infoplus_dvs
+from dvs_client import DvsException
 
 SERVER_TIMEOUT = 4
 config = {}
 
+_dvs_client = None
+_dvs_client_lock = threading.Lock()
+
+_bord_cache = None
+_fragment_cache = None
+_station_feed = None
+
+_bord_singleflight = dvs_cache.SingleFlight()
+
+class OngeldigeOpdracht(Exception):
+    """
+    De DVS daemon weigerde een opdracht met ongeldige argumenten (antwoord None)
+    """
+
+    pass
+
+# Gebruik dvs_json (ujson indien beschikbaar) voor alle JSON responses:
+bottle.default_app().uninstall(bottle.JSONPlugin)
+bottle.default_app().install(bottle.JSONPlugin(json_dumps=dvs_json.dumps))
+
+def _msgpack_plugin(callback):
+    """
+    Bottle plugin: geef dict responses als MessagePack terug indien de
+    client hierom vraagt (Accept header), anders als JSON (JSONPlugin)
+    """
+
+    def wrapper(*args, **kwargs):
+        antwoord = callback(*args, **kwargs)
+
+        if isinstance(antwoord, dict) and dvs_msgpack.BESCHIKBAAR:
+            response.set_header('Vary', 'Accept')
+            if _formaat() == 'msgpack':
+                response.content_type = dvs_msgpack.CONTENT_TYPE
+                return dvs_msgpack.dumps(antwoord)
+
+        return antwoord
+
+    return wrapper
+
+# Na de JSONPlugin geinstalleerd, zodat deze plugin als eerste de dict ziet:
+bottle.default_app().install(_msgpack_plugin)
+
 @bottle.route('/v1/station/<station>')
 @bottle.route('/v1/station/<station>/<taal>')
 @bottle.route('/v2/station/<station>')
@@ -27,52 +83,187 @@ def station_details(station, taal='nl'):
     try:
         tijd_nu = datetime.datetime.now(pytz.utc)
 
-        # Stuur opdracht:
-        data = _send_dvs_command('station/%s' % station)
+        try:
+            venster = _venster(tijd_nu)
+            velden = _velden()
+        except ValueError:
+            response.status = 400
+            return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': 'INVALID'}
 
-        if 'data' in data:
-            # Nieuw formaat met statusdata:
-            treinen = data['data']
-            dvs_status = data['status']['status']
-        else:
-            # Oude formaat:
-            treinen = data
-            dvs_status = None
+        formaat = _formaat()
 
-        # Lees trein array uit:
-        if treinen != None:
-            # Bepaal sortering adhv GET-parameter sorteer=
-            if bottle.request.query.get('sorteer') == 'actueel':
-                # Sorteer op geplande vertrektijd
-                treinen_sorted = sorted(treinen,
-                    key=lambda trein: treinen[trein].vertrek_actueel)
-            elif bottle.request.query.get('sorteer') == 'vertraging':
-                # Sorteer op vertraging (hoog naar laag)
-                treinen_sorted = sorted(treinen,
-                    key=lambda trein: treinen[trein].vertraging)[::-1]
-            else:
-                # (Standaard) Sorteer op gepland vertrek
-                treinen_sorted = sorted(treinen,
-                    key=lambda trein: treinen[trein].vertrek)
+        try:
+            bord = _station_bord(station, taal, tijd_nu,
+                bottle.request.query.get('sorteer'), _verbose(), venster=venster, velden=velden,
+                formaat=formaat)
+        except OngeldigeOpdracht:
+            response.status = 400
+            return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': 'INVALID'}
+
+        return _bord_response(bord, formaat)
+    except Exception as e:
+        try:
+            logger = logging.getLogger(__name__)
+            logger.exception("ERROR")
+        finally:
+            response.status = 500
+            return { 'result': 'ERR', 'system_status': 'UNKOWN', 'status': str(e) }
+
+@bottle.route('/v2/station/<station>/stream')
+def station_stream(station):
+    """
+    Stream (server-sent events) met de vertrektijden voor een station.
+    Stuurt eerst alle vertrektijden (event 'bord'), daarna alleen
+    gewijzigde of nieuwe treinen (event 'trein') en vertrokken of
+    verwijderde treinen (event 'vertrokken'), op basis van de change
+    feed van de DVS daemon.
+    """
 
-            if bottle.request.query.get('verbose') == 'true':
-                verbose = True
+    taal = 'nl'
+    if bottle.request.query.get('taal') != '':
+        taal = bottle.request.query.get('taal')
+
+    feed = _get_station_feed()
+    if feed is None:
+        response.status = 503
+        return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': 'NOFEED'}
+
+    station = station.upper()
+    sorteer = bottle.request.query.get('sorteer')
+    verbose = _verbose()
+
+    # Abonneer voor het opvragen van het volledige station,
+    # zodat tussentijdse wijzigingen niet gemist worden:
+    abonnement = feed.abonneer(station)
+
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    response.set_header('X-Accel-Buffering', 'no')
+
+    return _station_events(feed, abonnement, station, taal, sorteer, verbose)
+
+def _station_events(feed, abonnement, station, taal, sorteer, verbose):
+    """
+    Generator voor de events van een station stream. Het volledige
+    station wordt opnieuw verstuurd indien events gemist zijn, zodra
+    een opgeheven trein uit de vertrektijden verdwijnt, en indien bij de
+    periodieke controle (stream.controle seconden) de versie van het
+    station bij de DVS daemon afwijkt van de laatst verstuurde versie.
+    """
+
+    keepalive = config.get('stream', {}).get('keepalive', 15)
+    controle = config.get('stream', {}).get('controle', 60)
+
+    try:
+        tijd_nu = datetime.datetime.now(pytz.utc)
+        bord = _station_bord(station, taal, tijd_nu, sorteer, verbose, actueel=True)
+        geldig_tot = bord['geldig_tot']
+        versie = bord['versie']
+        volgende_controle = time.time() + controle
+        yield _sse('bord', bord['body'])
+
+        while True:
+            timeout = min(keepalive, max(0, volgende_controle - time.time()))
+            if geldig_tot is not None:
+                timeout = min(timeout, max(0,
+                    (geldig_tot - datetime.datetime.now(pytz.utc)).total_seconds()))
+
+            try:
+                event = abonnement.get(timeout=timeout)
+            except Empty:
+                event = None
+
+            tijd_nu = datetime.datetime.now(pytz.utc)
+
+            if event is not None and versie is not None and event.get('versie', 0) > versie[0]:
+                versie = (event['versie'], versie[1])
+
+            opnieuw = (event is not None and event['soort'] == 'opnieuw') or \
+                (geldig_tot is not None and tijd_nu >= geldig_tot)
+
+            # Vangnet voor wijzigingen die nooit als event aankomen: vergelijk
+            # (zonder wachtende events) de versie bij de daemon:
+            if not opnieuw and time.time() >= volgende_controle:
+                volgende_controle = time.time() + controle
+                if abonnement.empty():
+                    opnieuw = _bord_versie(_send_dvs_command('versie/%s' % station)) != versie
+
+            if opnieuw:
+                bord = _station_bord(station, taal, tijd_nu, sorteer, verbose, actueel=True)
+                geldig_tot = bord['geldig_tot']
+                versie = bord['versie']
+                volgende_controle = time.time() + controle
+                yield _sse('bord', bord['body'])
+                continue
+
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+
+            trein = event['trein']
+            fragment = None
+
+            if trein is not None and event['soort'] in ('insert', 'update') and not trein.is_vertrokken():
+                fragment = _trein_fragment(trein, taal, tijd_nu, verbose)
+
+            if fragment is None:
+                treinnr = trein.treinnr if trein is not None else event['rit_id']
+                yield _sse('vertrokken', dvs_json.dumps({'treinNr': treinnr}), event['volgnummer'])
             else:
-                verbose = False
+                verdwijnt = _geldig_tot({trein.rit_id: trein}, tijd_nu)
+                if verdwijnt is not None and (geldig_tot is None or verdwijnt < geldig_tot):
+                    geldig_tot = verdwijnt
 
-            vertrektijden = []
+                yield _sse('trein', fragment, event['volgnummer'])
+    except Exception as e:
+        logger = logging.getLogger(__name__)
+        logger.exception("Fout in stream voor station %s", station)
+        yield _sse('fout', dvs_json.dumps({'status': str(e)}))
+    finally:
+        feed.zeg_op(station, abonnement)
 
-            for trein_nr in treinen_sorted:
-                trein = treinen[trein_nr]
+def _sse(event, data, event_id=None):
+    """
+    Formatteer een server-sent event
+    """
 
-                trein_dict = dvs_http_parsers.trein_to_dict(trein, taal, tijd_nu, materieel=verbose)
+    if event_id is None:
+        return 'event: %s\ndata: %s\n\n' % (event, data)
 
-                if trein_dict != None and not trein.is_vertrokken():
-                    vertrektijden.append(trein_dict)
+    return 'event: %s\nid: %s\ndata: %s\n\n' % (event, event_id, data)
 
-            return {'result': 'OK', 'system_status': dvs_status, 'vertrektijden': vertrektijden}
-        else:
-            return {'result': 'OK', 'system_status': dvs_status, 'vertrektijden': []}
+@bottle.route('/v2/stations')
+def stations_details():
+    """
+    Vertrektijden voor meerdere stations in een enkele opdracht
+    aan de DVS daemon, bijvoorbeeld /v2/stations?codes=UT,ASD,RTD
+    """
+
+    taal = 'nl'
+    if bottle.request.query.get('taal') != '':
+        taal = bottle.request.query.get('taal')
+
+    try:
+        tijd_nu = datetime.datetime.now(pytz.utc)
+
+        station_codes = [code.upper() for code in bottle.request.query.get('codes', '').split(',') if code != '']
+
+        if len(station_codes) == 0:
+            response.status = 400
+            return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': 'NOCODES'}
+
+        # Stuur opdracht:
+        data = _send_dvs_command('stations/%s' % ','.join(station_codes))
+
+        if data is None:
+            response.status = 400
+            return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': 'INVALID'}
+
+        stations = {}
+        for station_code in station_codes:
+            stations[station_code] = _vertrektijden(data['data'].get(station_code), taal, tijd_nu)
+
+        return {'result': 'OK', 'system_status': data['status']['status'], 'stations': stations}
     except Exception as e:
         try:
             logger = logging.getLogger(__name__)
@@ -81,6 +272,314 @@ def station_details(station, taal='nl'):
             response.status = 500
             return { 'result': 'ERR', 'system_status': 'UNKOWN', 'status': str(e) }
 
+def _station_bord(station, taal, tijd_nu, sorteer, verbose, actueel=False, venster=None, velden=None, formaat='json'):
+    """
+    Geef de gerenderde response (met ETag) voor een station, in JSON of
+    (met formaat='msgpack') MessagePack.
+    Met venster (zie _venster) worden alleen de treinen binnen het
+    tijdvenster (en tot het maximale aantal) bij de DVS daemon opgevraagd,
+    met velden (zie _velden) worden alleen deze velden vertaald.
+    Responses worden gecached per station, taal, sortering, verbose,
+    venster, velden en formaat.
+    Binnen de TTL wordt een gecachede response direct gebruikt; daarna
+    (of altijd, met actueel=True) wordt alleen de versie van het station
+    bij de DVS daemon opgevraagd, en opnieuw gerenderd indien het station
+    sindsdien gewijzigd is.
+    Een response is nooit langer geldig dan tot het moment dat een
+    opgeheven trein uit de vertrektijden verdwijnt.
+    Gelijktijdige requests voor dezelfde response wachten op een enkele
+    controle (of opbouw) en krijgen hetzelfde resultaat. Met actueel=True
+    wordt niet gewacht op een reeds lopende controle, omdat die van voor
+    het moment van aanroepen kan zijn.
+    """
+
+    cache = _get_bord_cache()
+    ttl = config.get('cache', {}).get('ttl', 5)
+
+    sleutel = (station.upper(), taal, sorteer, verbose, venster, velden, formaat)
+
+    bord = cache.get(sleutel)
+
+    if bord is not None and (bord['geldig_tot'] is None or tijd_nu < bord['geldig_tot']):
+        if time.time() < bord['gecontroleerd'] + ttl and not actueel:
+            return bord
+    else:
+        bord = None
+
+    if actueel:
+        return _ververs_bord(sleutel, bord, station, taal, tijd_nu, sorteer, verbose, venster, velden, formaat)
+
+    return _bord_singleflight.doe(sleutel, lambda: _ververs_bord(
+        sleutel, bord, station, taal, tijd_nu, sorteer, verbose, venster, velden, formaat))
+
+def _ververs_bord(sleutel, bord, station, taal, tijd_nu, sorteer, verbose, venster, velden, formaat):
+    """
+    Controleer een gecachede response (bord, of None) bij de DVS daemon
+    en bouw de response opnieuw op indien het station gewijzigd is
+    (zie _station_bord)
+    """
+
+    if bord is not None:
+        if _bord_versie(_send_dvs_command('versie/%s' % station)) == bord['versie']:
+            bord['gecontroleerd'] = time.time()
+            return bord
+
+    # Stuur opdracht:
+    if venster is None:
+        data = _send_dvs_command('station/%s' % station)
+    else:
+        van, tot, limit = venster
+        data = _send_dvs_command('venster/%s/%s/%s/%s/%s' % (station,
+            van if van is not None else '', tot if tot is not None else '',
+            limit if limit is not None else '',
+            sorteer if sorteer in ('actueel', 'vertraging') else ''))
+
+    if data is None:
+        raise OngeldigeOpdracht('Ongeldige opdracht voor station %s' % station)
+
+    if 'data' in data:
+        # Nieuw formaat met statusdata:
+        treinen = data['data']
+        dvs_status = data['status']['status']
+    else:
+        # Oude formaat:
+        treinen = data
+        dvs_status = None
+
+    fragmenten = _vertrektijden_fragmenten(treinen, taal, tijd_nu, sorteer, verbose, velden, formaat)
+
+    if formaat == 'msgpack':
+        body = dvs_msgpack.bord(dvs_status, fragmenten)
+    else:
+        body = '{"result": "OK", "system_status": %s, "vertrektijden": [%s]}' % (
+            dvs_json.dumps(dvs_status), ', '.join(fragmenten))
+
+    bord = {
+        'body': body,
+        'etag': '"%s"' % hashlib.md5(body).hexdigest(),
+        'versie': _bord_versie(data),
+        'geldig_tot': _geldig_tot(treinen, tijd_nu),
+        'gecontroleerd': time.time()
+    }
+
+    _get_bord_cache().zet(sleutel, bord)
+
+    return bord
+
+def _venster(tijd_nu):
+    """
+    Lees het tijdvenster uit de GET-parameters van= en tot= (ISO 8601, of
+    HH:MM in Nederlandse tijd) en het maximale aantal treinen uit limit=.
+    Geeft een tuple (van, tot, limit) met van en tot als unix timestamp,
+    of None indien geen van deze parameters opgegeven is.
+    Geeft een ValueError bij een ongeldige waarde.
+    """
+
+    van = _parse_tijd(bottle.request.query.get('van'), tijd_nu)
+    tot = _parse_tijd(bottle.request.query.get('tot'), tijd_nu)
+
+    limit = bottle.request.query.get('limit')
+    if limit is not None and limit != '':
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError('Ongeldige limit: %s' % limit)
+    else:
+        limit = None
+
+    if van is None and tot is None and limit is None:
+        return None
+
+    return (van, tot, limit)
+
+def _parse_tijd(waarde, tijd_nu):
+    """
+    Vertaal een tijd (ISO 8601, of HH:MM in Nederlandse tijd) naar een
+    unix timestamp. Bij HH:MM wordt de dag gekozen waarop deze tijd het
+    dichtst bij tijd_nu ligt, zodat een venster over middernacht werkt.
+    """
+
+    if waarde is None or waarde == '':
+        return None
+
+    tijdzone = pytz.timezone('Europe/Amsterdam')
+
+    if re.match(r'^\d{1,2}:\d{2}$', waarde):
+        uur, minuut = [int(deel) for deel in waarde.split(':')]
+        datum = tijd_nu.astimezone(tijdzone).date()
+        tijd = tijdzone.localize(datetime.datetime.combine(datum, datetime.time(uur, minuut)))
+
+        if tijd - tijd_nu > datetime.timedelta(hours=12):
+            datum = datum - datetime.timedelta(days=1)
+        elif tijd_nu - tijd > datetime.timedelta(hours=12):
+            datum = datum + datetime.timedelta(days=1)
+
+        tijd = tijdzone.localize(datetime.datetime.combine(datum, datetime.time(uur, minuut)))
+    else:
+        tijd = isodate.parse_datetime(waarde)
+        if tijd.tzinfo is None:
+            tijd = tijdzone.localize(tijd)
+
+    return calendar.timegm(tijd.utctimetuple())
+
+def _velden():
+    """
+    Lees de gevraagde velden uit GET-parameter velden= (kommagescheiden).
+    Geeft een gesorteerde tuple, of None voor alle velden.
+    """
+
+    velden = [veld for veld in bottle.request.query.get('velden', '').split(',') if veld != '']
+
+    if len(velden) == 0:
+        return None
+
+    return tuple(sorted(set(velden)))
+
+def _bord_versie(data):
+    """
+    Geef de versie van een station uit een station/ of versie/ antwoord
+    van de DVS daemon. De systeemstatus hoort bij de versie, omdat deze
+    ook in de response staat.
+    """
+
+    if data is None or 'versie' not in data:
+        return None
+
+    return (data['versie'], data['status']['status'])
+
+def _geldig_tot(treinen, tijd_nu):
+    """
+    Bepaal tot wanneer de vertrektijden van een station geldig zijn zonder
+    wijzigingen in de DVS daemon: opgeheven treinen verdwijnen 2 minuten
+    na vertrek (zie dvs_http_parsers.trein_to_dict). Geeft None indien er
+    geen opgeheven treinen zijn.
+    """
+
+    if treinen is None:
+        return None
+
+    geldig_tot = None
+
+    for trein in treinen.values():
+        if trein.is_opgeheven() and not trein.is_vertrokken():
+            verdwijnt = trein.vertrek + dvs_http_parsers.OPGEHEVEN_TONEN
+            if verdwijnt >= tijd_nu and (geldig_tot is None or verdwijnt < geldig_tot):
+                geldig_tot = verdwijnt
+
+    return geldig_tot
+
+def _bord_response(bord, formaat):
+    """
+    Geef een reeds gerenderde stationsresponse terug met ETag header,
+    of een lege 304 response indien de client deze versie al heeft
+    """
+
+    response.set_header('ETag', bord['etag'])
+
+    if dvs_msgpack.BESCHIKBAAR:
+        response.set_header('Vary', 'Accept')
+
+    if_none_match = bottle.request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        if bord['etag'] in tags or 'W/%s' % bord['etag'] in tags or '*' in tags:
+            response.status = 304
+            return ''
+
+    if formaat == 'msgpack':
+        response.content_type = dvs_msgpack.CONTENT_TYPE
+    else:
+        response.content_type = 'application/json'
+
+    return bord['body']
+
+def _formaat():
+    """
+    Bepaal het responseformaat uit de Accept header: 'msgpack' indien de
+    client MessagePack accepteert (en niet liever JSON ontvangt) en de
+    msgpack module beschikbaar is, anders 'json'
+    """
+
+    accept = bottle.request.headers.get('Accept')
+
+    if not dvs_msgpack.BESCHIKBAAR or accept is None or 'msgpack' not in accept:
+        return 'json'
+
+    voorkeur = {}
+    for media_type in accept.split(','):
+        delen = [deel.strip() for deel in media_type.split(';')]
+        kwaliteit = 1.0
+        for parameter in delen[1:]:
+            if parameter.startswith('q='):
+                try:
+                    kwaliteit = float(parameter[2:])
+                except ValueError:
+                    kwaliteit = 0.0
+        voorkeur[delen[0].lower()] = kwaliteit
+
+    msgpack_kwaliteit = max(voorkeur.get(content_type, 0.0) for content_type in dvs_msgpack.CONTENT_TYPES)
+
+    if msgpack_kwaliteit > 0 and msgpack_kwaliteit >= voorkeur.get('application/json', 0.0):
+        return 'msgpack'
+
+    return 'json'
+
+def _vertrektijden(treinen, taal, tijd_nu):
+    """
+    Vertaal de treinen van een station naar een gesorteerde lijst
+    met vertrektijden (sortering en verbose volgens de GET-parameters)
+    """
+
+    return dvs_http_parsers.vertrektijden_to_list(treinen, taal, tijd_nu,
+        bottle.request.query.get('sorteer'), materieel=_verbose())
+
+def _vertrektijden_fragmenten(treinen, taal, tijd_nu, sorteer, verbose, velden=None, formaat='json'):
+    """
+    Als _vertrektijden (met opgegeven sortering, verbose en velden),
+    maar geeft per trein een JSON (of MessagePack) fragment. Fragmenten
+    worden gecached per station, trein, taal, verbose, velden en formaat, en hergebruikt
+    zolang de trein in DVS niet gewijzigd is (zelfde rit_timestamp).
+    Opgeheven treinen worden altijd opnieuw vertaald, omdat deze na
+    vertrek uit de vertrektijden verdwijnen.
+    """
+
+    return [_trein_fragment(trein, taal, tijd_nu, verbose, velden, formaat)
+        for trein in dvs_http_parsers.bord_treinen(treinen, tijd_nu, sorteer)]
+
+def _trein_fragment(trein, taal, tijd_nu, verbose, velden=None, formaat='json'):
+    """
+    Geef het (gecachede) JSON of MessagePack fragment voor een trein,
+    of None voor een opgeheven trein die niet meer getoond wordt
+    """
+
+    if formaat == 'msgpack':
+        dumps = dvs_msgpack.dumps
+    else:
+        dumps = dvs_json.dumps
+
+    if trein.is_opgeheven():
+        trein_dict = dvs_http_parsers.trein_to_dict(trein, taal, tijd_nu, materieel=verbose, velden=velden)
+        if trein_dict == None:
+            return None
+        return dumps(trein_dict)
+
+    cache = _get_fragment_cache()
+    sleutel = (trein.rit_station.code, trein.treinnr, taal, verbose, velden, formaat)
+    fragment = cache.get(sleutel)
+
+    if fragment is None or fragment[0] != trein.rit_timestamp:
+        trein_dict = dvs_http_parsers.trein_to_dict(trein, taal, tijd_nu, materieel=verbose, velden=velden)
+        fragment = (trein.rit_timestamp, dumps(trein_dict))
+        cache.zet(sleutel, fragment)
+
+    return fragment[1]
+
+def _verbose():
+    """
+    Geef aan of verbose vertrektijden gevraagd zijn (GET-parameter verbose=true)
+    """
+
+    return bottle.request.query.get('verbose') == 'true'
+
 @bottle.route('/v2/trein/<trein>')
 @bottle.route('/v2/trein/<trein>/<datum>')
 @bottle.route('/v2/trein/<trein>/<datum>/<station>')
@@ -111,8 +610,14 @@ def get_trein_details(trein, datum='vandaag', station=None, taal='nl'):
         tijd_nu = datetime.datetime.now(pytz.utc)
         serviceinfo = None
 
+        # Een deadline voor de gehele request (daemon en serviceinfo samen):
+        deadline = time.time() + SERVER_TIMEOUT
+
+        # Haal serviceinfo op terwijl de daemon bevraagd wordt:
+        dvs_http_parsers.prefetch_serviceinfo(trein, datum, config['serviceinfo'], SERVER_TIMEOUT)
+
         # Stuur opdracht: haal alle informatie op voor dit treinnummer
-        data = _send_dvs_command('trein/%s' % trein)
+        data = _send_dvs_command('trein/%s' % trein, _resterend(deadline))
 
         if 'data' in data:
             vertrekken = data['data']
@@ -121,11 +626,16 @@ def get_trein_details(trein, datum='vandaag', station=None, taal='nl'):
             vertrekken = data
             dvs_status = None
 
-        # Indien geen station opgegeven:
-        # Zoek rit in serviceinfo, gebruik eerste station als ritstation.
+        # Indien geen station opgegeven: gebruik het eerste station van de rit
+        # volgens serviceinfo (opgehaald terwijl de daemon bevraagd werd).
+        # Het station met het eerste vertrek in DVS is niet altijd het
+        # beginstation: vertrokken ritten worden na 120 minuten gewist, zodat
+        # bij een lange rit een station halverwege het eerste vertrek heeft.
+        # Staat het beginstation nog in DVS, dan wordt die rit gebruikt.
         vertrekstation = station
         if vertrekstation is None:
-            serviceinfo = dvs_http_parsers.retrieve_serviceinfo(trein, datum, config['serviceinfo'])
+            serviceinfo = dvs_http_parsers.retrieve_serviceinfo(trein, datum,
+                config['serviceinfo'], _resterend(deadline))
             if serviceinfo is not None and 'stops' in serviceinfo[0]:
                 vertrekstation = serviceinfo[0]['stops'][0]['station']
             insert_vertrekstation = True
@@ -143,14 +653,16 @@ def get_trein_details(trein, datum='vandaag', station=None, taal='nl'):
                                                             taal, tijd_nu, materieel=True, stopstations=True,
                                                             serviceinfo_config=config['serviceinfo'],
                                                             insert_vertrekstation=insert_vertrekstation,
-                                                            geen_station_opmerkingen=(station is None))
+                                                            geen_station_opmerkingen=(station is None),
+                                                            serviceinfo_timeout=_resterend(deadline))
 
                 return {'result': 'OK', 'system_status': dvs_status, 'trein': trein_dict, 'source': 'dvs'}
 
         # Probeer trein te zoeken in serviceinfo:
         if serviceinfo is None:
             # Niet opnieuw opvragen indien nog beschikbaar
-            serviceinfo = dvs_http_parsers.retrieve_serviceinfo(trein, datum, config['serviceinfo'])
+            serviceinfo = dvs_http_parsers.retrieve_serviceinfo(trein, datum,
+                config['serviceinfo'], _resterend(deadline))
 
         trein_dict = dvs_http_parsers.serviceinfo_to_dict(serviceinfo, vertrekstation, negeer_stops_tm=(station is not None))
 
@@ -167,6 +679,13 @@ def get_trein_details(trein, datum='vandaag', station=None, taal='nl'):
             response.status = 500
             return { 'result': 'ERR', 'system_status': 'UNKOWN', 'status': str(e) }
 
+def _resterend(deadline):
+    """
+    Geef het aantal seconden tot de deadline (minimaal 0)
+    """
+
+    return max(deadline - time.time(), 0)
+
 def get_current_servicedate():
     if datetime.datetime.now().hour < 4:
         # Geef datum van gisteren terug (voor 4.00 's nachts):
@@ -198,41 +717,96 @@ def status():
             response.status = 500
             return {'result': 'ERR', 'system_status': 'UNKOWN', 'status': str(e)}
 
+@bottle.route('/v2/stats')
+def stats():
+    """
+    Statistieken van de caches van dit proces (hits/misses)
+    """
+
+    data = {
+        'json_encoder': dvs_json.ENCODER,
+        'station_cache': _get_bord_cache().stats(),
+        'station_requests': _bord_singleflight.stats(),
+        'fragment_cache': _get_fragment_cache().stats(),
+        'serviceinfo': dvs_http_parsers.serviceinfo_stats()}
+
+    if _get_station_feed() is not None:
+        data['streams'] = _get_station_feed().stats()
 
-def _send_dvs_command(command):
+    return {'result': 'OK', 'data': data}
+
+@bottle.route('/metrics')
+def metrics():
     """
-    Bereid de ZeroMQ connectie naar de DVS daemon voor
+    Meetwaarden van de DVS daemon in het tekstformaat van Prometheus
     """
 
-    # Maak verbinding
-    context = zmq.Context()
-    client = context.socket(zmq.REQ)
-    client.connect(config['dvs']['daemon'])
-    client.setsockopt(zmq.LINGER, 0)
+    try:
+        tekst = _send_dvs_command('metrics')
+    except Exception as e:
+        logging.getLogger(__name__).error("Fout bij opvragen metrics: %s", e)
+        response.status = 503
+        return 'DVS daemon niet bereikbaar\n'
 
-    # Stuur opdracht:
-    client.send(command)
+    response.content_type = dvs_metrics.Prometheus.CONTENT_TYPE
+    return tekst
 
-    # Ontvang response:
-    poller = zmq.Poller()
-    poller.register(client, zmq.POLLIN)
+def _get_bord_cache():
+    """
+    Geef de cache voor gerenderde stationsresponses van dit proces
+    """
 
-    if poller.poll(SERVER_TIMEOUT * 1000):
-        data = client.recv_pyobj()
-        client.close()
-        context.term()
+    global _bord_cache
 
-        return data
-    else:
-        client.close()
-        context.term()
+    if _bord_cache is None:
+        with _dvs_client_lock:
+            if _bord_cache is None:
+                _bord_cache = dvs_cache.Cache(config.get('cache', {}).get('max_items', 1000))
 
-        raise DvsException('DVS Server Timeout')
+    return _bord_cache
 
+def _get_fragment_cache():
+    """
+    Geef de cache voor JSON fragmenten per trein van dit proces
+    """
 
-class DvsException(Exception):
+    global _fragment_cache
+
+    if _fragment_cache is None:
+        with _dvs_client_lock:
+            if _fragment_cache is None:
+                _fragment_cache = dvs_cache.Cache(config.get('cache', {}).get('max_fragmenten', 50000))
+
+    return _fragment_cache
+
+def _get_station_feed():
     """
-    Exception class voor DVS fouten
+    Geef de abonnementen op de change feed van de DVS daemon voor dit
+    proces, of None indien geen feed geconfigureerd is
     """
 
-    pass
+    global _station_feed
+
+    if _station_feed is None and config['dvs'].get('feed') is not None:
+        with _dvs_client_lock:
+            if _station_feed is None:
+                _station_feed = dvs_stream.StationFeed(config['dvs']['feed'],
+                    config.get('stream', {}).get('queue_size', 1000))
+
+    return _station_feed
+
+def _send_dvs_command(command, timeout=None):
+    """
+    Stuur een opdracht naar de DVS daemon, over een verbinding
+    uit de verbindingspool van dit proces
+    """
+
+    global _dvs_client
+
+    if _dvs_client is None:
+        with _dvs_client_lock:
+            if _dvs_client is None:
+                _dvs_client = dvs_client.DvsClient(config['dvs']['daemon'], SERVER_TIMEOUT,
+                                                   config['dvs'].get('pool_size', 16))
+
+    return _dvs_client.opdracht(command, timeout)
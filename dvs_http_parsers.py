@@ -4,28 +4,61 @@ van de DVS HTTP interface.
 """
 
 from datetime import timedelta
-import urllib2
 import socket
 import json
 import logging
+import threading
+import pytz
+
+import dvs_cache
+import dvs_http_pool
+import infoplus_dvs
 
 _logger = logging.getLogger(__name__)
 
+_tijdzone = pytz.timezone('Europe/Amsterdam')
+
+# Omschrijving van treindelen (op vertrekpositie) per taal:
+_treindelen_strings = {
+    'nl': {1: 'voorste', 2: 'middelste', 3: 'achterste'},
+    'en': {1: 'front', 2: 'middle', 3: 'rear'}
+}
+
+# Opgeheven treinen blijven tot zoveel minuten na vertrek in de vertrektijden:
+OPGEHEVEN_TONEN = timedelta(minutes=2)
 
-def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, serviceinfo_config=None, insert_vertrekstation=False, geen_station_opmerkingen=False):
+_serviceinfo_cache = None
+_serviceinfo_cache_lock = threading.Lock()
+_serviceinfo_singleflight = dvs_cache.SingleFlight()
+_serviceinfo_pool = dvs_http_pool.HttpPool()
+
+
+def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, serviceinfo_config=None, insert_vertrekstation=False, geen_station_opmerkingen=False, serviceinfo_timeout=None, velden=None):
     """
     Vertaal een InfoPlus_DVS Trein object naar een dict,
     geschikt voor een JSON output.
     Met de parameter materieel wordt de materieelcompositie teruggegeven,
-    met de parameter stopstations alle stops per treinvleugel.
+    met de parameter stopstations alle stops per treinvleugel
+    (verrijkt met serviceinfo, indien binnen serviceinfo_timeout beschikbaar).
+    Met de parameter velden (lijst met sleutels) worden alleen deze velden
+    teruggegeven; opmerkingen, tips, via en vleugels worden dan alleen
+    vertaald indien gevraagd.
     """
 
+    opgeheven = trein.is_opgeheven()
+
+    # Controleer of vertrektijd van een opgeheven trein meer dan 2 min
+    # geleden is. Sla deze trein dan over; we laten opgeheven treinen tot
+    # 2 min na vertrek in de feed zitten:
+    if opgeheven and trein.vertrek + OPGEHEVEN_TONEN < tijd_nu:
+        return None
+
     trein_dict = {}
 
     # Basis treininformatie
     trein_dict['treinNr'] = trein.treinnr
     trein_dict['id'] = trein.rit_id
-    trein_dict['vertrek'] = trein.lokaal_vertrek().isoformat()
+    trein_dict['vertrek'] = trein.vertrek.astimezone(_tijdzone).isoformat()
 
     # Parse eindbestemming. Indien eindbestemming uit twee delen bestaat
     # (vleugeltrein), check dan of beide eindbestemmingen verschillen:
@@ -52,6 +85,92 @@ def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, ser
     else:
         trein_dict['sprWijziging'] = False
 
+    if velden is None or 'opmerkingen' in velden or 'tips' in velden:
+        _opmerkingen_tips(trein_dict, trein, taal, geen_station_opmerkingen)
+
+    trein_dict['opgeheven'] = False
+    trein_dict['status'] = trein.status
+    trein_dict['vervoerder'] = trein.vervoerder
+
+    # Trein opgeheven: wis spoor, vertraging etc.
+    if opgeheven:
+        trein_dict['opgeheven'] = True
+        trein_dict['spoor'] = None
+        trein_dict['vertraging'] = 0
+
+        # Toon geplande eindbestemming bij opgeheven trein:
+        trein_dict['bestemming'] = '/'.join(bestemming.lange_naam
+            for bestemming in trein.eindbestemming)
+
+    else:
+        # Trein is niet opgeheven
+
+        # Stuur bij een gewijzigde eindbestemming
+        # ook de oorspronkelijke eindbestemming mee:
+        if trein_dict['bestemming'] != \
+            '/'.join(bestemming.lange_naam \
+        for bestemming in trein.eindbestemming):
+            trein_dict['bestemmingOrigineel'] = '/'. \
+                join(bestemming.lange_naam \
+                for bestemming in trein.eindbestemming)
+
+    # Verkorte (via)-route
+    if velden is None or 'via' in velden:
+        if trein_dict['opgeheven'] == True:
+            verkorte_route = trein.verkorte_route
+        else:
+            verkorte_route = trein.verkorte_route_actueel
+
+        if verkorte_route == None or len(verkorte_route) == 0:
+            trein_dict['via'] = None
+        else:
+            trein_dict['via'] = ', '.join(
+                via.middel_naam for via in verkorte_route)
+
+    if velden is None or 'vleugels' in velden:
+        _vleugels(trein_dict, trein, materieel, stopstations, serviceinfo_config,
+            insert_vertrekstation, serviceinfo_timeout)
+
+    if velden is not None:
+        trein_dict = dict((veld, trein_dict[veld]) for veld in velden if veld in trein_dict)
+
+    return trein_dict
+
+
+def vertrektijden_to_list(treinen, taal, tijd_nu, sorteer=None, materieel=False, velden=None):
+    """
+    Vertaal alle treinen (dict) van een station in een keer naar een
+    gesorteerde lijst met vertrektijden (dicts zoals trein_to_dict).
+    Vertrokken treinen en opgeheven treinen die niet meer getoond worden
+    vallen af voordat er gesorteerd en vertaald wordt.
+    """
+
+    return [trein_to_dict(trein, taal, tijd_nu, materieel=materieel, velden=velden)
+        for trein in bord_treinen(treinen, tijd_nu, sorteer)]
+
+
+def bord_treinen(treinen, tijd_nu, sorteer=None):
+    """
+    Geef de (gesorteerde) treinen van een station die in de vertrektijden
+    getoond worden: geen vertrokken treinen, en opgeheven treinen
+    alleen tot 2 minuten na vertrek (zie trein_to_dict)
+    """
+
+    if treinen is None:
+        return []
+
+    grens = tijd_nu - OPGEHEVEN_TONEN
+
+    return infoplus_dvs.sorteer_treinen([trein for trein in treinen.values()
+        if not trein.is_vertrokken() and (trein.vertrek >= grens or not trein.is_opgeheven())],
+        sorteer)
+
+
+def _opmerkingen_tips(trein_dict, trein, taal, geen_station_opmerkingen):
+    """
+    Voeg de opmerkingen en reistips van een trein toe aan trein_dict
+    """
+
     trein_dict['opmerkingen'] = trein.wijzigingen_str(taal, True, trein, geen_station_opmerkingen)
 
     if geen_station_opmerkingen is False:
@@ -89,10 +208,7 @@ def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, ser
                 trein_dict['opmerkingen'].append("Treinstel %s tot %s" % (matnummers, bestemming))
 
     # Verwerk afwijkende treindelen zonder matnummer naar opmerking:
-    if taal == 'en':
-        treindelen_strings = {1: 'front', 2: 'middle', 3: 'rear'}
-    else:
-        treindelen_strings = {1: 'voorste', 2: 'middelste', 3: 'achterste'}
+    treindelen_strings = _treindelen_strings['en' if taal == 'en' else 'nl']
 
     if len(afwijkende_eindbestemming) > 0:
         for bestemming in afwijkende_eindbestemming:
@@ -119,50 +235,13 @@ def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, ser
     if trein.treinnaam != None:
         trein_dict['tips'].append(trein.treinnaam_str(taal))
 
-    trein_dict['opgeheven'] = False
-    trein_dict['status'] = trein.status
-    trein_dict['vervoerder'] = trein.vervoerder
 
-    # Trein opgeheven: wis spoor, vertraging etc.
-    if trein.is_opgeheven():
-        trein_dict['opgeheven'] = True
-        trein_dict['spoor'] = None
-        trein_dict['vertraging'] = 0
-
-        # Toon geplande eindbestemming bij opgeheven trein:
-        trein_dict['bestemming'] = '/'.join(bestemming.lange_naam
-            for bestemming in trein.eindbestemming)
-
-        # Controleer of vertrektijd meer dan 2 min geleden is:
-        if trein.vertrek + timedelta(minutes=2) < tijd_nu:
-            # Sla deze trein over. We laten opgeheven treinen tot 2 min
-            # na vertrek in de feed zitten; vertrektijd van deze trein
-            # is meer dan 2 minuten na vertrektijd
-            return None
-
-    else:
-        # Trein is niet opgeheven
-
-        # Stuur bij een gewijzigde eindbestemming
-        # ook de oorspronkelijke eindbestemming mee:
-        if trein_dict['bestemming'] != \
-            '/'.join(bestemming.lange_naam \
-        for bestemming in trein.eindbestemming):
-            trein_dict['bestemmingOrigineel'] = '/'. \
-                join(bestemming.lange_naam \
-                for bestemming in trein.eindbestemming)
-
-    # Verkorte (via)-route
-    if trein_dict['opgeheven'] == True:
-        verkorte_route = trein.verkorte_route
-    else:
-        verkorte_route = trein.verkorte_route_actueel
-
-    if verkorte_route == None or len(verkorte_route) == 0:
-        trein_dict['via'] = None
-    else:
-        trein_dict['via'] = ', '.join(
-            via.middel_naam for via in verkorte_route)
+def _vleugels(trein_dict, trein, materieel, stopstations, serviceinfo_config,
+        insert_vertrekstation, serviceinfo_timeout):
+    """
+    Voeg de treinvleugels (met materieel en stopstations, indien gevraagd)
+    toe aan trein_dict
+    """
 
     insert_vertrekstation_dict = None
     if insert_vertrekstation is True:
@@ -192,12 +271,11 @@ def trein_to_dict(trein, taal, tijd_nu, materieel=False, stopstations=False, ser
         if stopstations == True:
             vleugel_dict['stopstations'] = stopstations_to_list(
                 vleugel.stopstations_actueel, trein.rit_id,
-                trein.rit_datum, serviceinfo_config, insert_vertrekstation_dict)
+                trein.rit_datum, serviceinfo_config, insert_vertrekstation_dict,
+                serviceinfo_timeout)
 
         trein_dict['vleugels'].append(vleugel_dict)
 
-    return trein_dict
-
 
 def serviceinfo_to_dict(serviceinfo, station, negeer_stops_tm=False):
     """
@@ -212,16 +290,12 @@ def serviceinfo_to_dict(serviceinfo, station, negeer_stops_tm=False):
         return None
 
     # Check stops
-    stop = None
+    stop = services_index(serviceinfo).laatste_stop(station)
 
     bestemmingen = []
     for service in serviceinfo:
         bestemmingen.append(service['stops'][-1]['station_name'])
 
-        for check_stop in service['stops']:
-            if check_stop['station'].lower() == station.lower():
-                stop = check_stop
-
     # Haal identieke bestemmingen weg
     if len(bestemmingen) > 1 and bestemmingen[0] == bestemmingen[1]:
         del bestemmingen[1]
@@ -265,6 +339,7 @@ def serviceinfo_to_dict(serviceinfo, station, negeer_stops_tm=False):
         trein_dict['sprWijziging'] = True
 
     # Verwerk vleugels:
+    station_upper = station.upper()
     for service in serviceinfo:
         negeer_stops_tm_vleugel = negeer_stops_tm
         bestemming = service['stops'][-1]['station_name']
@@ -282,7 +357,7 @@ def serviceinfo_to_dict(serviceinfo, station, negeer_stops_tm=False):
             if negeer_stops_tm_vleugel == False:
                 vleugel['stopstations'].append(stop_dict)
             else:
-                if stop_dict['code'].upper() == station.upper():
+                if stop_dict['code'].upper() == station_upper:
                     negeer_stops_tm_vleugel = False
 
         trein_dict['vleugels'].append(vleugel)
@@ -294,7 +369,7 @@ def serviceinfo_to_dict(serviceinfo, station, negeer_stops_tm=False):
     return trein_dict
 
 
-def stopstations_to_list(stations, treinnr, ritdatum, serviceinfo_config, insert_vertrekstation_dict=None):
+def stopstations_to_list(stations, treinnr, ritdatum, serviceinfo_config, insert_vertrekstation_dict=None, serviceinfo_timeout=None):
     """
     Vertaal de stopstations van een trein naar een list van
     stopstations, geschikt om als JSON result terug te geven.
@@ -305,32 +380,25 @@ def stopstations_to_list(stations, treinnr, ritdatum, serviceinfo_config, insert
     if insert_vertrekstation_dict is not None:
         stations_list.append(insert_vertrekstation_dict )
 
-    serviceinfo = retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config)
+    serviceinfo = retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config, serviceinfo_timeout)
 
     destination_code = stations[-1].code.lower()
 
+    if serviceinfo != None:
+        index = services_index(serviceinfo)
+
     for station in stations:
         station_dict = {'code': station.code, 'naam': station.lange_naam}
         
         extra_stop_data = None
         if serviceinfo != None:
-            # Zoek halte op in serviceinfo.
-            for service in serviceinfo:
-                # Zoek alleen in vleugel met zelfde eindbestemming:
-                if service['stops'][-1]['station'] == destination_code:
-                    for stop in service['stops']:
-                        if stop['station'].lower() == station.code.lower():
-                            extra_stop_data = stop
-                            break
-
-            # Fallback: indien nog geen stop gevonden is, probeer
-            # het nogmaals zonder check op eindbestemming vleugel
+            # Zoek halte op in serviceinfo, alleen in vleugel met zelfde
+            # eindbestemming. Fallback: indien geen stop gevonden is,
+            # zoek zonder check op eindbestemming vleugel.
+            extra_stop_data = index.stop(station.code, destination_code)
+
             if extra_stop_data is None:
-                for service in serviceinfo:
-                    for stop in service['stops']:
-                        if stop['station'].lower() == station.code.lower():
-                            extra_stop_data = stop
-                            break
+                extra_stop_data = index.stop(station.code)
 
             if extra_stop_data != None:
                 # Verwerk spoorinformatie:
@@ -342,6 +410,94 @@ def stopstations_to_list(stations, treinnr, ritdatum, serviceinfo_config, insert
     return stations_list
 
 
+class Services(list):
+    """
+    List met services (vleugels) zoals teruggegeven door de rdt-serviceinfo
+    API, met een index op stationscode die bij het eerste gebruik eenmalig
+    opgebouwd wordt. Omdat responses gecached worden, wordt de index per
+    response slechts een keer opgebouwd.
+    """
+
+    _index = None
+
+    def index(self):
+        """
+        Geef de (eventueel nog op te bouwen) index voor deze services
+        """
+
+        if self._index is None:
+            self._index = ServicesIndex(self)
+
+        return self._index
+
+
+class ServicesIndex(object):
+    """
+    Index op de stops van serviceinfo services. Zoeken gebeurt op stationscode
+    (niet hoofdlettergevoelig), optioneel alleen in vleugels met een bepaalde
+    eindbestemming. Bij meerdere vleugels met dezelfde stop telt (zoals bij
+    het doorlopen van alle vleugels) de laatste vleugel.
+    """
+
+    def __init__(self, services):
+        # Eerste stop per station in de laatste vleugel met dat station,
+        # ook per eindbestemming van de vleugel:
+        self.eerste_stops = {}
+        self.eerste_stops_bestemming = {}
+
+        # Laatste stop per station in de laatste vleugel met dat station:
+        self.laatste_stops = {}
+
+        for service in services:
+            if len(service['stops']) == 0:
+                continue
+
+            bestemming = service['stops'][-1]['station']
+            eerste_in_vleugel = {}
+
+            for stop in service['stops']:
+                code = stop['station'].lower()
+
+                if code not in eerste_in_vleugel:
+                    eerste_in_vleugel[code] = stop
+
+                self.laatste_stops[code] = stop
+
+            for code, stop in eerste_in_vleugel.items():
+                self.eerste_stops[code] = stop
+                self.eerste_stops_bestemming[(bestemming, code)] = stop
+
+    def stop(self, station_code, bestemming=None):
+        """
+        Geef de (eerste) stop voor een station, optioneel alleen in een
+        vleugel met de gegeven eindbestemming (stationscode zoals in
+        serviceinfo). Geeft None indien niet gevonden.
+        """
+
+        if bestemming is None:
+            return self.eerste_stops.get(station_code.lower())
+        else:
+            return self.eerste_stops_bestemming.get((bestemming, station_code.lower()))
+
+    def laatste_stop(self, station_code):
+        """
+        Geef de laatste stop voor een station, of None indien niet gevonden
+        """
+
+        return self.laatste_stops.get(station_code.lower())
+
+
+def services_index(serviceinfo):
+    """
+    Geef de index voor een list met serviceinfo services
+    """
+
+    if isinstance(serviceinfo, Services):
+        return serviceinfo.index()
+
+    return ServicesIndex(serviceinfo)
+
+
 def parse_stop_data(stop_data, station_dict):
     if stop_data is None:
         return station_dict
@@ -379,38 +535,148 @@ def parse_stop_data(stop_data, station_dict):
     return station_dict
 
 
-def retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config):
+def retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config, timeout=None):
     """
     Haal extra serviceinformatie op om de informatie over stops te verrijken
     met bijvoorbeeld aankomsttijd etc.
 
     Bij fouten, uitgeschakelde serviceinfo configuratie, etc. geeft deze method None.
     In alle andere gevallen wordt de services dict van de rdt-serviceinfo API teruggegeven.
+
+    Resultaten worden per (treinnr, ritdatum) gecached, ook wanneer een rit niet
+    gevonden is. Gelijktijdige aanvragen voor dezelfde rit delen een enkele
+    HTTP request naar serviceinfo. Met timeout wordt maximaal zoveel seconden
+    gewacht (standaard serviceinfo.timeout uit de configuratie, of 4s).
     """
 
     if serviceinfo_config == None or serviceinfo_config['enabled'] == False:
         return None
+
+    cache = _get_serviceinfo_cache(serviceinfo_config)
+    sleutel = (str(treinnr), ritdatum)
+
+    # In de cache staat een tuple, zodat ook None (niet gevonden) gecached kan worden:
+    resultaat = cache.get(sleutel)
+    if resultaat is not None:
+        return resultaat[0]
+
+    http_timeout = _serviceinfo_timeout(serviceinfo_config, timeout)
+
+    try:
+        return _serviceinfo_singleflight.doe(sleutel, lambda: _haal_serviceinfo_cache(
+            treinnr, ritdatum, serviceinfo_config, http_timeout), http_timeout)
+    except dvs_cache.SingleFlightTimeout:
+        _logger.warn("Serviceinfo timeout: geen antwoord binnen %ss", http_timeout)
+        return None
+
+
+def prefetch_serviceinfo(treinnr, ritdatum, serviceinfo_config, timeout=None):
+    """
+    Start het ophalen van serviceinformatie in een aparte thread, zodat dit
+    gelijktijdig kan gebeuren met een opdracht aan de DVS daemon. Een latere
+    aanroep van retrieve_serviceinfo voor dezelfde rit wacht op deze request
+    (of gebruikt het gecachede resultaat).
+    """
+
+    if serviceinfo_config == None or serviceinfo_config['enabled'] == False:
+        return
+
+    sleutel = (str(treinnr), ritdatum)
+
+    if _get_serviceinfo_cache(serviceinfo_config).bevat(sleutel):
+        return
+
+    http_timeout = _serviceinfo_timeout(serviceinfo_config, timeout)
+
+    _serviceinfo_singleflight.start(sleutel, lambda: _haal_serviceinfo_cache(
+        treinnr, ritdatum, serviceinfo_config, http_timeout))
+
+
+def _serviceinfo_timeout(serviceinfo_config, timeout):
+    """
+    Geef de timeout voor een request naar serviceinfo: serviceinfo.timeout
+    uit de configuratie (standaard 4s), of korter indien gevraagd
+    """
+
+    if timeout is None:
+        return serviceinfo_config.get('timeout', 4)
+
+    return min(serviceinfo_config.get('timeout', 4), timeout)
+
+
+def _haal_serviceinfo_cache(treinnr, ritdatum, serviceinfo_config, timeout):
+    """
+    Haal een rit op bij de rdt-serviceinfo API en sla het resultaat op in de cache
+    """
+
+    services, ttl = _haal_serviceinfo(treinnr, ritdatum, serviceinfo_config, timeout)
+
+    if ttl is not None:
+        _get_serviceinfo_cache(serviceinfo_config).zet((str(treinnr), ritdatum), (services, ), ttl)
+
+    return services
+
+
+def _haal_serviceinfo(treinnr, ritdatum, serviceinfo_config, timeout):
+    """
+    Haal een rit op bij de rdt-serviceinfo API (over een keep-alive verbinding).
+    Geeft een tuple met de services (of None) en het aantal seconden dat dit
+    resultaat gecached mag worden (None bij fouten, die niet gecached worden).
+    """
+
+    try:
+        trein_url = "%sservice/%s/%s" % (serviceinfo_config['url'], ritdatum, treinnr)
+        status, body = _serviceinfo_pool.get(trein_url, timeout)
+
+        if status == 404:
+            _logger.debug("Service niet gevonden: %s", trein_url)
+            return (None, serviceinfo_config.get('cache_ttl_niet_gevonden', 60))
+        elif status != 200:
+            _logger.error("HTTP fout: %s. Geen serviceinfo beschikbaar", status)
+            return (None, None)
+
+        data = json.loads(body)
+
+        if 'services' in data:
+            return (Services(data['services']), serviceinfo_config.get('cache_ttl', 60))
+        else:
+            return (None, serviceinfo_config.get('cache_ttl_niet_gevonden', 60))
+    except ValueError as error:
+        _logger.error("Ongeldige JSON voor serviceinfo: %s", error)
+    except socket.timeout as error:
+        _logger.warn("Serviceinfo timeout: %s", error)
+    except socket.error as error:
+        _logger.warn("Netwerkfout: %s", error)
+    except Exception as error:
+        _logger.error("Generieke fout: %s. Geen serviceinfo beschikbaar", error)
+
+    return (None, None)
+
+
+def _get_serviceinfo_cache(serviceinfo_config):
+    """
+    Geef de serviceinfo cache van dit proces
+    """
+
+    global _serviceinfo_cache
+
+    if _serviceinfo_cache is None:
+        with _serviceinfo_cache_lock:
+            if _serviceinfo_cache is None:
+                _serviceinfo_cache = dvs_cache.Cache(serviceinfo_config.get('cache_max_items', 5000))
+
+    return _serviceinfo_cache
+
+
+def serviceinfo_stats():
+    """
+    Geef hits/misses van de serviceinfo cache en het aantal
+    (gedeelde) HTTP requests naar serviceinfo
+    """
+
+    if _serviceinfo_cache is None:
+        cache_stats = {'items': 0, 'hits': 0, 'misses': 0}
     else:
-        try:
-            trein_url = "%sservice/%s/%s" % (serviceinfo_config['url'], ritdatum, treinnr)
-            response = urllib2.urlopen(trein_url, timeout=4)
-            data = json.load(response)
+        cache_stats = _serviceinfo_cache.stats()
 
-            if 'services' in data:
-                return data['services']
-            else:
-                return None
-        except ValueError as error:
-            _logger.error("Ongeldige JSON voor serviceinfo (datalengte: %s)")
-        except urllib2.URLError as error:
-            if isinstance(error.reason, socket.timeout):
-                _logger.warn("Serviceinfo timeout: %s", error)
-            elif error.errno == 101:
-                _logger.warn("Netwerkfout: %s", error)
-            elif error.code == 404:
-                _logger.debug("Service niet gevonden: %s", error)
-            else:
-                _logger.error("HTTP fout: %s. Geen serviceinfo beschikbaar", error)
-        except Exception as error:
-            _logger.error("Generieke fout: %s. Geen serviceinfo beschikbaar", error)
-            return None
+    return {'cache': cache_stats, 'requests': _serviceinfo_singleflight.stats()}
@@ -0,0 +1,128 @@
+"""
+Module met een pool van keep-alive HTTP verbindingen, voor requests
+van de HTTP interface naar externe API's (zoals rdt-serviceinfo).
+"""
+
+import httplib
+import os
+import socket
+import threading
+import urlparse
+
+
+class HttpPool(object):
+    """
+    Pool van herbruikbare HTTP verbindingen per host (een pool per proces).
+    Een verbinding wordt na een request teruggezet in de pool, tenzij de
+    server aangeeft de verbinding te sluiten. Faalt een request over een
+    hergebruikte verbinding (bijvoorbeeld omdat de server de verbinding
+    inmiddels gesloten heeft), dan wordt het request eenmaal opnieuw
+    geprobeerd over een nieuwe verbinding.
+    """
+
+    pool_grootte = 8
+
+    def __init__(self, pool_grootte=8):
+        self.pool_grootte = pool_grootte
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pools = {}
+
+    def get(self, url, timeout):
+        """
+        Voer een GET request uit. Geeft een tuple met de HTTP statuscode
+        en de body. Geeft socket.timeout of socket.error bij fouten.
+        """
+
+        delen = urlparse.urlsplit(url)
+        host = (delen.scheme, delen.hostname, delen.port)
+
+        pad = delen.path or '/'
+        if delen.query:
+            pad = '%s?%s' % (pad, delen.query)
+
+        verbinding, hergebruikt = self._neem_verbinding(host, timeout)
+
+        try:
+            status, body, sluiten = self._request(verbinding, pad)
+        except (httplib.HTTPException, socket.error):
+            verbinding.close()
+
+            if not hergebruikt:
+                raise
+
+            # Verbinding uit de pool is niet meer bruikbaar, probeer opnieuw:
+            verbinding = self._nieuwe_verbinding(host, timeout)
+            try:
+                status, body, sluiten = self._request(verbinding, pad)
+            except (httplib.HTTPException, socket.error):
+                verbinding.close()
+                raise
+
+        if sluiten:
+            verbinding.close()
+        else:
+            self._zet_verbinding_terug(host, verbinding)
+
+        return status, body
+
+    def _request(self, verbinding, pad):
+        """
+        Voer een request uit over een verbinding
+        """
+
+        verbinding.request('GET', pad, headers={'Connection': 'keep-alive'})
+        response = verbinding.getresponse()
+        body = response.read()
+
+        return response.status, body, response.will_close
+
+    def _neem_verbinding(self, host, timeout):
+        """
+        Geef een verbinding uit de pool (en of deze hergebruikt is),
+        of maak een nieuwe verbinding
+        """
+
+        with self._lock:
+            # Na een fork zijn de verbindingen van het parent proces
+            # niet bruikbaar, begin dan met een nieuwe pool:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pools = {}
+
+            pool = self._pools.get(host)
+            if pool:
+                verbinding = pool.pop()
+                verbinding.timeout = timeout
+                if verbinding.sock is not None:
+                    verbinding.sock.settimeout(timeout)
+                return verbinding, True
+
+        return self._nieuwe_verbinding(host, timeout), False
+
+    def _nieuwe_verbinding(self, host, timeout):
+        """
+        Maak een nieuwe verbinding naar host
+        """
+
+        scheme, hostname, port = host
+
+        if scheme == 'https':
+            return httplib.HTTPSConnection(hostname, port, timeout=timeout)
+        else:
+            return httplib.HTTPConnection(hostname, port, timeout=timeout)
+
+    def _zet_verbinding_terug(self, host, verbinding):
+        """
+        Zet een verbinding terug in de pool, of sluit deze als de pool vol is
+        """
+
+        with self._lock:
+            if self._pid == os.getpid():
+                pool = self._pools.setdefault(host, [])
+                if len(pool) < self.pool_grootte:
+                    pool.append(verbinding)
+                    return
+
+        verbinding.close()
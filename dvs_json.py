@@ -0,0 +1,33 @@
+"""
+Module voor het encoderen van JSON voor de HTTP interface.
+Gebruikt ujson indien geinstalleerd (sneller), anders de standaard
+json module.
+"""
+
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+if ujson is not None:
+    ENCODER = 'ujson'
+
+    def dumps(data):
+        """
+        Encodeer data naar een JSON string
+        """
+
+        return ujson.dumps(data, ensure_ascii=True, escape_forward_slashes=False,
+                           double_precision=15)
+else:
+    ENCODER = 'json'
+
+    def dumps(data):
+        """
+        Encodeer data naar een JSON string
+        """
+
+        return json.dumps(data)
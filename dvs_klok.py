@@ -0,0 +1,132 @@
+"""
+Klokken voor de DVS daemon. Normaal volgt de daemon de systeemklok; bij een
+versnelde replay (dvs-daemon.py --replay --virtuele-klok) volgt de daemon
+een virtuele klok, welke gezet wordt op de TimeStamp van ieder afgespeeld
+bericht. Periodieke taken (zoals de GC thread) wachten via de klok, zodat
+een opgenomen dag in minuten afgespeeld kan worden.
+"""
+
+import time
+import threading
+from datetime import datetime
+
+import pytz
+
+
+class SysteemKlok(object):
+    """
+    Klok volgens de systeemtijd
+    """
+
+    def tijd(self):
+        """
+        Geef de huidige tijd als unix timestamp
+        """
+
+        return time.time()
+
+    def nu(self, tz=None):
+        """
+        Geef de huidige tijd als datetime, zoals datetime.now(tz)
+        """
+
+        return datetime.fromtimestamp(self.tijd(), tz)
+
+    def utcnu(self):
+        """
+        Geef de huidige tijd als naive datetime in UTC, zoals datetime.utcnow()
+        """
+
+        return datetime.utcfromtimestamp(self.tijd())
+
+    def wacht(self, event, seconden):
+        """
+        Wacht seconden of tot event gezet wordt, zoals event.wait(seconden).
+        Geeft True indien event gezet is.
+        """
+
+        return event.wait(seconden)
+
+
+class VirtueleKlok(SysteemKlok):
+    """
+    Virtuele klok, welke alleen vooruit gaat door zet(). Threads die via
+    wacht() wachten worden in volgorde van hun deadline gewekt, en zet()
+    keert pas terug nadat iedere gewekte thread klaar is met zijn werk en
+    opnieuw wacht. Zo loopt een periodieke taak precies op het juiste
+    virtuele tijdstip, hoe snel er ook berichten afgespeeld worden.
+    """
+
+    def __init__(self, start):
+        self._tijd = start
+        self._conditie = threading.Condition()
+        self._wachtend = {}     # thread -> deadline van lopende of laatste wacht()
+
+    def tijd(self):
+        return self._tijd
+
+    def zet(self, tijd):
+        """
+        Zet de klok vooruit naar tijd (unix timestamp); een tijd in het
+        verleden wordt genegeerd
+        """
+
+        with self._conditie:
+            while True:
+                self._vergeet_gestopt()
+                deadlines = [deadline for deadline in self._wachtend.values() if deadline <= tijd]
+                if len(deadlines) == 0:
+                    break
+
+                # Wek de thread(s) met de eerstvolgende deadline, en wacht
+                # tot deze opnieuw wachten (met een latere deadline):
+                volgende = min(deadlines)
+                self._tijd = max(self._tijd, volgende)
+                self._conditie.notify_all()
+
+                # Met timeout, zodat een gestopte thread (bijvoorbeeld na een
+                # fout) de replay niet voor altijd laat wachten:
+                while any(deadline <= volgende for deadline in self._wachtend.values()):
+                    self._conditie.wait(0.1)
+                    self._vergeet_gestopt()
+
+            self._tijd = max(self._tijd, tijd)
+
+    def _vergeet_gestopt(self):
+        """
+        Verwijder threads die niet meer lopen uit de wachtende threads
+        (aanroepen met _conditie)
+        """
+
+        for thread in self._wachtend.keys():
+            if not thread.is_alive():
+                del self._wachtend[thread]
+
+    def wacht(self, event, seconden):
+        thread = threading.current_thread()
+
+        with self._conditie:
+            deadline = self._tijd + seconden
+            self._wachtend[thread] = deadline
+            self._conditie.notify_all()
+
+            while self._tijd < deadline and not event.is_set():
+                # Met timeout, om ook een gezet event op te merken:
+                self._conditie.wait(0.1)
+
+            if event.is_set():
+                del self._wachtend[thread]
+                self._conditie.notify_all()
+                return True
+
+        # Deadline blijft staan tot de volgende wacht(), zodat zet() wacht
+        # tot het werk van deze thread klaar is:
+        return False
+
+
+def timestamp(tijd):
+    """
+    Geef een (timezone-aware) datetime als unix timestamp
+    """
+
+    return (tijd - datetime(1970, 1, 1, tzinfo=pytz.utc)).total_seconds()
@@ -0,0 +1,205 @@
+"""
+Module voor het bijhouden van meetwaarden (zoals latency en
+responsegroottes) in histogrammen met vaste buckets, en het weergeven van
+meetwaarden in het tekstformaat van Prometheus.
+"""
+
+import bisect
+import threading
+
+
+# Bucketgrenzen voor latency in milliseconden (0.1ms t/m 10s):
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                      1000, 2500, 5000, 10000]
+
+# Bucketgrenzen voor groottes in bytes (64 bytes t/m 64 MB):
+GROOTTE_BUCKETS = [64 * 4 ** macht for macht in range(11)]
+
+
+class Histogram(object):
+    """
+    Histogram met vaste bucketgrenzen. Iedere meting wordt geteld in de
+    eerste bucket waarvan de bovengrens groter of gelijk is aan de waarde;
+    waarden boven de hoogste grens vallen in een overloopbucket.
+    Percentielen worden geschat door te interpoleren binnen een bucket
+    (begrensd door de kleinste en grootste gemeten waarde).
+    """
+
+    grenzen = None
+    aantallen = None
+    aantal = 0
+    som = 0
+    minimum = None
+    maximum = 0
+
+    def __init__(self, grenzen):
+        self.grenzen = list(grenzen)
+        self.aantallen = [0] * (len(self.grenzen) + 1)
+        self._lock = threading.Lock()
+
+    def meet(self, waarde):
+        """
+        Voeg een meting toe aan het histogram
+        """
+
+        bucket = bisect.bisect_left(self.grenzen, waarde)
+
+        with self._lock:
+            self.aantallen[bucket] += 1
+            self.aantal += 1
+            self.som += waarde
+            if waarde > self.maximum:
+                self.maximum = waarde
+            if self.minimum is None or waarde < self.minimum:
+                self.minimum = waarde
+
+    def cumulatief(self):
+        """
+        Geef (grenzen, cumulatieve aantallen per grens, totaal aantal, som)
+        """
+
+        with self._lock:
+            aantallen = list(self.aantallen)
+            aantal = self.aantal
+            som = self.som
+
+        cumulatief = []
+        totaal = 0
+        for bucket_aantal in aantallen[:-1]:
+            totaal += bucket_aantal
+            cumulatief.append(totaal)
+
+        return self.grenzen, cumulatief, aantal, som
+
+    def percentiel(self, percentage):
+        """
+        Geef een schatting van het gevraagde percentiel (0-100),
+        of None indien er nog geen metingen zijn
+        """
+
+        with self._lock:
+            aantallen = list(self.aantallen)
+            aantal = self.aantal
+            minimum = self.minimum
+            maximum = self.maximum
+
+        if aantal == 0:
+            return None
+
+        doel = aantal * percentage / 100.0
+        cumulatief = 0
+
+        for bucket, bucket_aantal in enumerate(aantallen):
+            if bucket_aantal > 0 and cumulatief + bucket_aantal >= doel:
+                ondergrens = max(self.grenzen[bucket - 1] if bucket > 0 else 0, minimum)
+                if bucket < len(self.grenzen):
+                    bovengrens = min(self.grenzen[bucket], maximum)
+                else:
+                    bovengrens = maximum
+
+                fractie = (doel - cumulatief) / bucket_aantal
+                return ondergrens + (bovengrens - ondergrens) * fractie
+
+            cumulatief += bucket_aantal
+
+        return maximum
+
+    def samenvatting(self):
+        """
+        Geef een dict met aantal, totaal, gemiddelde, minimum, maximum
+        en p50/p95/p99
+        """
+
+        if self.aantal == 0:
+            gemiddeld = None
+        else:
+            gemiddeld = float(self.som) / self.aantal
+
+        return {
+            'aantal': self.aantal,
+            'totaal': self.som,
+            'gemiddeld': gemiddeld,
+            'min': self.minimum,
+            'max': self.maximum,
+            'p50': self.percentiel(50),
+            'p95': self.percentiel(95),
+            'p99': self.percentiel(99)
+        }
+
+
+class Prometheus(object):
+    """
+    Bouwt een weergave van meetwaarden in het tekstformaat van Prometheus
+    (versie 0.0.4). Iedere metric wordt eenmaal toegevoegd, met een enkele
+    waarde of een lijst van (labels, waarde) tuples.
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    regels = None
+
+    def __init__(self):
+        self.regels = []
+
+    def counter(self, naam, beschrijving, waarden):
+        self._metric(naam, 'counter', beschrijving, waarden)
+
+    def gauge(self, naam, beschrijving, waarden):
+        self._metric(naam, 'gauge', beschrijving, waarden)
+
+    def histogram(self, naam, beschrijving, histogrammen):
+        """
+        Voeg een Histogram toe, of een lijst van (labels, Histogram) tuples
+        """
+
+        self._kop(naam, 'histogram', beschrijving)
+
+        for labels, histogram in self._reeksen(histogrammen):
+            grenzen, cumulatief, aantal, som = histogram.cumulatief()
+
+            for grens, bucket_aantal in zip(grenzen, cumulatief):
+                self._regel(naam + '_bucket', dict(labels, le=_getal(grens)), bucket_aantal)
+            self._regel(naam + '_bucket', dict(labels, le='+Inf'), aantal)
+            self._regel(naam + '_sum', labels, som)
+            self._regel(naam + '_count', labels, aantal)
+
+    def tekst(self):
+        return '\n'.join(self.regels) + '\n'
+
+    def _metric(self, naam, soort, beschrijving, waarden):
+        self._kop(naam, soort, beschrijving)
+
+        for labels, waarde in self._reeksen(waarden):
+            self._regel(naam, labels, waarde)
+
+    def _kop(self, naam, soort, beschrijving):
+        self.regels.append('# HELP %s %s' % (naam, beschrijving))
+        self.regels.append('# TYPE %s %s' % (naam, soort))
+
+    def _reeksen(self, waarden):
+        if isinstance(waarden, list):
+            return waarden
+        return [({}, waarden)]
+
+    def _regel(self, naam, labels, waarde):
+        if len(labels) > 0:
+            naam = '%s{%s}' % (naam, ','.join('%s="%s"' % (label, _label_waarde(labels[label]))
+                for label in sorted(labels)))
+
+        self.regels.append('%s %s' % (naam, _getal(waarde)))
+
+
+def _getal(waarde):
+    """
+    Geef een getal weer zoals Prometheus dit verwacht
+    """
+
+    if waarde is None:
+        return 'NaN'
+    if isinstance(waarde, float):
+        return repr(waarde)
+    return str(waarde)
+
+
+def _label_waarde(waarde):
+    return str(waarde).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,42 @@
+"""
+Module voor het encoderen van MessagePack (compact binair formaat) voor
+de HTTP interface. MessagePack is optioneel: zonder de msgpack module
+is BESCHIKBAAR False en antwoordt de HTTP interface altijd met JSON.
+"""
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+CONTENT_TYPE = 'application/msgpack'
+CONTENT_TYPES = ['application/msgpack', 'application/x-msgpack']
+
+BESCHIKBAAR = msgpack is not None
+
+
+def dumps(data):
+    """
+    Encodeer data naar MessagePack. Strings (str en unicode) worden
+    beide als MessagePack string gecodeerd, zoals in JSON.
+    """
+
+    return msgpack.packb(data, use_bin_type=False)
+
+
+def bord(system_status, fragmenten):
+    """
+    Stel een stationsresponse samen uit losse gecodeerde vertrektijden,
+    met dezelfde structuur als de JSON response. Een MessagePack array
+    bestaat uit een header met het aantal items, gevolgd door de items,
+    zodat gecachede fragmenten direct samengevoegd kunnen worden.
+    """
+
+    packer = msgpack.Packer(use_bin_type=False)
+
+    return ''.join([packer.pack_map_header(3),
+        packer.pack('result'), packer.pack('OK'),
+        packer.pack('system_status'), packer.pack(system_status),
+        packer.pack('vertrektijden'), packer.pack_array_header(len(fragmenten))]
+        + fragmenten)
@@ -0,0 +1,100 @@
+"""
+Module voor het inlezen van opgenomen DVS berichten, voor het afspelen
+van een archief in de DVS daemon (dvs-daemon.py --replay).
+
+Een archief is een van:
+- een bestand (optioneel gzip) met een DVS bericht (XML) per regel, zoals
+  testdata/dvsmessages.gz voor tools/dvs-pub-test.py
+- een directory met een XML bestand per bericht (zoals testdata/treinlog),
+  welke in volgorde van TimeStamp afgespeeld worden
+"""
+
+import os
+import re
+import gzip
+import isodate
+import pytz
+
+
+# TimeStamp van het ReisInformatieProductDVS, het eerste TimeStamp attribuut:
+_timestamp = re.compile(r'TimeStamp="([^"]+)"')
+
+
+def bericht_tijd(bericht):
+    """
+    Geef de TimeStamp van een DVS bericht als datetime (UTC), zonder het
+    volledige bericht te parsen. Geeft None indien niet gevonden.
+    """
+
+    match = _timestamp.search(bericht)
+    if match is None:
+        return None
+
+    return isodate.parse_datetime(match.group(1)).astimezone(pytz.utc)
+
+
+def parse_tijd(tekst):
+    """
+    Parse een tijdstip (ISO 8601) voor --replay-tot. Een tijdstip zonder
+    tijdzone is Nederlandse tijd.
+    """
+
+    tijd = isodate.parse_datetime(tekst)
+    if tijd.tzinfo is None:
+        tijd = pytz.timezone('Europe/Amsterdam').localize(tijd)
+
+    return tijd.astimezone(pytz.utc)
+
+
+def eerste_tijd(pad):
+    """
+    Geef de TimeStamp van het eerste bericht in een archief (met TimeStamp),
+    of None bij een leeg archief
+    """
+
+    for bericht in lees_archief(pad):
+        tijd = bericht_tijd(bericht)
+        if tijd is not None:
+            return tijd
+
+    return None
+
+
+def lees_archief(pad):
+    """
+    Geef alle berichten uit een archief (bestand of directory) in volgorde
+    """
+
+    if os.path.isdir(pad):
+        return _lees_directory(pad)
+    else:
+        return _lees_bestand(pad)
+
+
+def _lees_bestand(pad):
+    if pad.endswith('.gz'):
+        bestand = gzip.open(pad, 'rb')
+    else:
+        bestand = open(pad, 'rb')
+
+    with bestand:
+        for regel in bestand:
+            regel = regel.strip()
+            if regel != '':
+                yield regel
+
+
+def _lees_directory(pad):
+    berichten = []
+
+    for root, _, bestanden in os.walk(pad):
+        for naam in bestanden:
+            if naam.endswith('.xml'):
+                with open(os.path.join(root, naam), 'rb') as bestand:
+                    bericht = bestand.read()
+                berichten.append((bericht_tijd(bericht), naam, bericht))
+
+    berichten.sort(key=lambda bericht: (bericht[0] is not None, bericht[0], bericht[1]))
+
+    for _, _, bericht in berichten:
+        yield bericht
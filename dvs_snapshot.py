@@ -0,0 +1,303 @@
+"""
+Module voor het opslaan en inlezen van snapshots van de trein- en station
+store. Iedere rit wordt eenmaal opgeslagen (ook als deze in beide stores
+voorkomt), en stations staan in een gedeelde tabel in plaats van als los
+object bij iedere trein. Ritten worden opgeslagen in losse chunks, welke
+via de index aan het einde van het bestand ook los ingelezen kunnen worden.
+
+Opbouw van een snapshot:
+- MAGIC
+- chunks: iedere chunk een pickle met een lijst ritten
+  (station_code, treinnr, trein, in_station, in_trein), met stations
+  als verwijzing (persistent id) naar de stationstabel
+- index: pickle met de stationstabel, offsets van de chunks en extra data
+- offset van de index (8 bytes) en MAGIC
+
+Met schrijf_fork wordt het snapshot geschreven door een child proces
+(fork), welke de stores via copy-on-write deelt met de daemon. De daemon
+hoeft de stores dan niet te kopieren en houdt geen GIL vast tijdens het
+serialiseren, zodat het verwerken van berichten gewoon doorgaat.
+"""
+
+import os
+import gc
+import struct
+import traceback
+import cPickle as pickle
+from cStringIO import StringIO
+
+import infoplus_dvs
+
+
+MAGIC = 'DVSSNAP1'
+
+_offset = struct.Struct('<Q')
+
+_station_velden = ('code', 'korte_naam', 'middel_naam', 'lange_naam', 'uic', 'station_type')
+
+
+class OngeldigSnapshot(Exception):
+    """
+    Bestand is geen (volledig) snapshot
+    """
+
+    pass
+
+
+class SnapshotMislukt(Exception):
+    """
+    Schrijven van een snapshot in een child proces is mislukt
+    """
+
+    pass
+
+
+def ritten(station_store, trein_store):
+    """
+    Geef alle ritten in de stores als lijst van
+    [station_code, treinnr, trein, in_station, in_trein], waarbij een trein
+    die onder dezelfde sleutels in beide stores voorkomt eenmaal voorkomt
+    """
+
+    per_trein = {}
+    alleen_trein_store = []
+
+    for station_code, treinen in station_store.items():
+        for treinnr, trein in treinen.items():
+            per_trein[id(trein)] = [station_code, treinnr, trein, True, False]
+
+    for treinnr, stations in trein_store.items():
+        for station_code, trein in stations.items():
+            rit = per_trein.get(id(trein))
+            if rit is not None and rit[0] == station_code and rit[1] == treinnr:
+                rit[4] = True
+            else:
+                alleen_trein_store.append([station_code, treinnr, trein, False, True])
+
+    return per_trein.values() + alleen_trein_store
+
+
+def schrijf(pad, station_store, trein_store, extra=None, chunk_grootte=2000, bewaar=1):
+    """
+    Schrijf een snapshot van de stores naar pad. Het snapshot wordt eerst
+    naar een tijdelijk bestand geschreven (met fsync) en daarna hernoemd,
+    zodat een eerder snapshot bij een crash intact blijft. extra wordt
+    ongewijzigd bij het snapshot opgeslagen. Met bewaar > 1 blijven de
+    vorige snapshots bewaard als pad.1 (meest recent) t/m pad.<bewaar-1>.
+    """
+
+    alle_ritten = ritten(station_store, trein_store)
+    station_index = {}
+    stations = []
+
+    def station_id(obj):
+        # Alleen aangeroepen voor instances (niet voor str, int, etc.):
+        if obj.__class__ is infoplus_dvs.Station:
+            sleutel = tuple(getattr(obj, veld) for veld in _station_velden)
+            nummer = station_index.get(sleutel)
+            if nummer is None:
+                nummer = len(stations)
+                station_index[sleutel] = nummer
+                stations.append(sleutel)
+            return nummer
+        return None
+
+    tijdelijk = pad + '.tmp'
+    chunks = []
+
+    with open(tijdelijk, 'wb') as bestand:
+        bestand.write(MAGIC)
+
+        for start in range(0, len(alle_ritten), chunk_grootte):
+            buffer = StringIO()
+            pickler = pickle.Pickler(buffer, 2)
+            pickler.inst_persistent_id = station_id
+            pickler.dump(alle_ritten[start:start + chunk_grootte])
+
+            data = buffer.getvalue()
+            chunks.append((bestand.tell(), len(data)))
+            bestand.write(data)
+
+        index_offset = bestand.tell()
+        pickle.dump({'stations': stations, 'chunks': chunks, 'ritten': len(alle_ritten),
+            'extra': extra}, bestand, -1)
+        bestand.write(_offset.pack(index_offset) + MAGIC)
+
+        bestand.flush()
+        os.fsync(bestand.fileno())
+
+    if bewaar > 1:
+        bewaar_vorige(pad, bewaar)
+
+    os.rename(tijdelijk, pad)
+
+
+def bewaar_vorige(pad, bewaar):
+    """
+    Bewaar het huidige snapshot op pad als pad.1, en schuif de eerder
+    bewaarde snapshots op (pad.1 wordt pad.2, etc.), zodat er inclusief
+    het huidige snapshot maximaal bewaar snapshots zijn. Het huidige
+    snapshot blijft via een hard link op zijn plaats staan, zodat er ook
+    bij een crash altijd een snapshot op pad is.
+    """
+
+    for nummer in range(bewaar - 1, 0, -1):
+        oud = '%s.%s' % (pad, nummer)
+        if not os.path.exists(oud):
+            continue
+
+        if nummer == bewaar - 1:
+            os.remove(oud)
+        else:
+            os.rename(oud, '%s.%s' % (pad, nummer + 1))
+
+    if os.path.exists(pad):
+        os.link(pad, pad + '.1')
+
+
+def schrijf_fork(pad, station_store, trein_store, extra=None, bewaar=1):
+    """
+    Schrijf een snapshot (zie schrijf) vanuit een child proces, en wacht
+    tot dit klaar is. Het child ziet de stores zoals op het moment van de
+    fork; de aanroepende thread wacht zonder de GIL, zodat andere threads
+    de stores intussen kunnen wijzigen. Geeft SnapshotMislukt indien het
+    child het snapshot niet kon schrijven.
+    """
+
+    pid = os.fork()
+
+    if pid == 0:
+        # Child: alleen het snapshot schrijven, geen logging (locks van
+        # andere threads kunnen bezet zijn op het moment van de fork) en
+        # afsluiten met os._exit, zodat gebufferde data van de daemon
+        # (zoals het WAL) niet nogmaals geschreven wordt. Zonder GC, welke
+        # alle objecten zou aanraken en zo de pagina's zou kopieren.
+        status = 1
+        try:
+            gc.disable()
+            schrijf(pad, station_store, trein_store, extra, bewaar=bewaar)
+            status = 0
+        except BaseException:
+            try:
+                os.write(2, traceback.format_exc())
+            except Exception:
+                pass
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+
+    if status != 0:
+        if os.WIFSIGNALED(status):
+            raise SnapshotMislukt('Child %s gestopt door signaal %s' % (pid, os.WTERMSIG(status)))
+        raise SnapshotMislukt('Child %s gestopt met exitcode %s' % (pid, os.WEXITSTATUS(status)))
+
+
+def lees_index(bestand):
+    """
+    Lees de index van een geopend snapshot
+    """
+
+    bestand.seek(0)
+    if bestand.read(len(MAGIC)) != MAGIC:
+        raise OngeldigSnapshot('Geen snapshot')
+
+    staart = _offset.size + len(MAGIC)
+    bestand.seek(-staart, os.SEEK_END)
+    einde = bestand.tell()
+    data = bestand.read(staart)
+    if data[_offset.size:] != MAGIC:
+        raise OngeldigSnapshot('Snapshot onvolledig')
+
+    index_offset = _offset.unpack(data[:_offset.size])[0]
+    bestand.seek(index_offset)
+
+    return pickle.loads(bestand.read(einde - index_offset))
+
+
+def bewaarde_snapshots(pad):
+    """
+    Geef de paden van het snapshot op pad en de bewaarde vorige snapshots
+    (pad.1, pad.2, etc.) welke aanwezig zijn, van nieuw naar oud
+    """
+
+    paden = [pad] if os.path.exists(pad) else []
+
+    nummer = 1
+    while os.path.exists('%s.%s' % (pad, nummer)):
+        paden.append('%s.%s' % (pad, nummer))
+        nummer += 1
+
+    return paden
+
+
+def lees_extra(pad):
+    """
+    Geef de extra data van een snapshot (zie schrijf), zonder de ritten in
+    te lezen
+    """
+
+    with open(pad, 'rb') as bestand:
+        return lees_index(bestand)['extra']
+
+
+def maak_stations(index):
+    """
+    Maak de gedeelde Station objecten uit de stationstabel van een index
+    """
+
+    stations = []
+
+    for sleutel in index['stations']:
+        station = infoplus_dvs.Station(sleutel[0], sleutel[3])
+        for veld, waarde in zip(_station_velden, sleutel):
+            setattr(station, veld, waarde)
+        stations.append(station)
+
+    return stations
+
+
+def laad_chunk(bestand, index, stations, nummer):
+    """
+    Lees chunk nummer uit een geopend snapshot; geeft de lijst ritten
+    """
+
+    offset, lengte = index['chunks'][nummer]
+    bestand.seek(offset)
+
+    unpickler = pickle.Unpickler(StringIO(bestand.read(lengte)))
+    unpickler.persistent_load = stations.__getitem__
+
+    return unpickler.load()
+
+
+def laad(pad):
+    """
+    Lees een snapshot in. Geeft (station_store, trein_store, extra).
+    Tijdens het inlezen staat de garbage collector van Python uit: bij het
+    unpicklen van veel objecten kost deze anders het grootste deel van de tijd.
+    """
+
+    station_store = {}
+    trein_store = {}
+
+    gc_actief = gc.isenabled()
+    gc.disable()
+
+    try:
+        with open(pad, 'rb') as bestand:
+            index = lees_index(bestand)
+            stations = maak_stations(index)
+
+            for nummer in range(len(index['chunks'])):
+                for station_code, treinnr, trein, in_station, in_trein \
+                        in laad_chunk(bestand, index, stations, nummer):
+                    if in_station:
+                        station_store.setdefault(station_code, {})[treinnr] = trein
+                    if in_trein:
+                        trein_store.setdefault(treinnr, {})[station_code] = trein
+    finally:
+        if gc_actief:
+            gc.enable()
+
+    return station_store, trein_store, index['extra']
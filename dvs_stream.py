@@ -0,0 +1,146 @@
+"""
+Module om de change feed van de DVS daemon te verdelen over streams
+(server-sent events) in de HTTP interface. Per proces is er een enkele
+SUB verbinding met de feed; events worden doorgegeven aan de abonnementen
+op het betreffende station.
+"""
+
+import cPickle as pickle
+import logging
+import threading
+from Queue import Queue, Full
+
+import dvs_client
+
+
+class StationFeed(object):
+    """
+    Abonnementen per station op de change feed van de DVS daemon. De
+    verbinding met de feed wordt gemaakt bij het eerste abonnement.
+    Wordt een event gemist (een gat in de volgnummers, of een volle queue
+    van een abonnement), dan krijgt het abonnement een 'opnieuw' melding,
+    zodat de stream het volledige station opnieuw kan versturen.
+    """
+
+    adres = None
+    queue_grootte = 1000
+
+    def __init__(self, adres, queue_grootte=1000):
+        self.adres = adres
+        self.queue_grootte = queue_grootte
+
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._abonnementen = {}
+        self._thread = None
+
+        self.events = 0
+        self.gemist = 0
+
+    def abonneer(self, station_code):
+        """
+        Abonneer op events voor een station. Geeft een Queue met events
+        (dicts zoals verstuurd door de daemon, of {'soort': 'opnieuw'}).
+        """
+
+        abonnement = Queue(self.queue_grootte)
+
+        with self._lock:
+            self._abonnementen.setdefault(station_code, set()).add(abonnement)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ontvang, name='StationFeed')
+                self._thread.daemon = True
+                self._thread.start()
+
+        return abonnement
+
+    def zeg_op(self, station_code, abonnement):
+        """
+        Beeindig een abonnement
+        """
+
+        with self._lock:
+            abonnementen = self._abonnementen.get(station_code)
+            if abonnementen is not None:
+                abonnementen.discard(abonnement)
+                if len(abonnementen) == 0:
+                    del self._abonnementen[station_code]
+
+    def stats(self):
+        """
+        Geef het aantal streams, ontvangen events en gemiste events
+        """
+
+        with self._lock:
+            streams = sum(len(abonnementen) for abonnementen in self._abonnementen.values())
+
+        return {'streams': streams, 'stations': len(self._abonnementen),
+                'events': self.events, 'gemist': self.gemist}
+
+    def _ontvang(self):
+        """
+        Ontvang events van de feed en verdeel deze over de abonnementen
+        """
+
+        zmq = dvs_client.zmq_module()
+        context = zmq.Context()
+        subscriber = context.socket(zmq.SUB)
+        subscriber.setsockopt(zmq.RCVHWM, 0)
+        subscriber.connect(self.adres)
+        subscriber.setsockopt(zmq.SUBSCRIBE, '')
+
+        self.logger.info("Verbonden met DVS feed %s", self.adres)
+
+        vorige_volgnummer = None
+
+        while True:
+            try:
+                _, data = subscriber.recv_multipart()
+                event = pickle.loads(data)
+                volgnummer = event['volgnummer']
+                self.events += 1
+
+                with self._lock:
+                    abonnementen = list(self._abonnementen.get(event['station'], ()))
+
+                # Gat in de volgnummers (of herstart van de daemon):
+                # alle abonnementen moeten opnieuw beginnen.
+                if vorige_volgnummer is not None and volgnummer != vorige_volgnummer + 1:
+                    self.gemist += 1
+                    self._meld_opnieuw()
+                vorige_volgnummer = volgnummer
+
+                for abonnement in abonnementen:
+                    try:
+                        abonnement.put_nowait(event)
+                    except Full:
+                        self.gemist += 1
+                        self._meld_opnieuw(abonnement)
+            except Exception:
+                self.logger.exception("Fout bij verwerken feed event")
+
+    def _meld_opnieuw(self, abonnement=None):
+        """
+        Meld een abonnement (of alle abonnementen) dat events gemist zijn
+        """
+
+        if abonnement is None:
+            with self._lock:
+                abonnementen = [item for station in self._abonnementen.values()
+                    for item in station]
+        else:
+            abonnementen = [abonnement]
+
+        for abonnement in abonnementen:
+            # Maak ruimte voor de melding; alle wachtende events zijn
+            # overbodig omdat het volledige station opnieuw verstuurd wordt:
+            while True:
+                try:
+                    abonnement.put_nowait({'soort': 'opnieuw'})
+                    break
+                except Full:
+                    try:
+                        abonnement.get_nowait()
+                    except Exception:
+                        pass
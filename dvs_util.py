@@ -4,6 +4,7 @@ Generieke utility functies.
 
 import os
 import sys
+import resource
 import yaml
 import logging
 import logging.config
@@ -48,3 +49,16 @@ def setup_logging(config):
             return
 
     logging.basicConfig(level=logging.INFO)
+
+
+def geheugen_rss():
+    """
+    Geef het huidige geheugengebruik (resident set size) van dit proces in
+    bytes. Zonder /proc (niet Linux) het piekgebruik volgens getrusage.
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,334 @@
+"""
+Module voor crashbestendige opslag van de trein- en station store van de
+DVS daemon: een append-only write-ahead log (WAL) met alle toegepaste
+mutaties, en periodieke snapshots waarna oude logsegmenten gewist worden.
+"""
+
+import os
+import gc
+import glob
+import logging
+import struct
+import threading
+import time
+import zlib
+import cPickle as pickle
+
+import dvs_snapshot
+
+
+# Ieder record in het log: lengte en crc32 van de pickle, gevolgd door de pickle:
+_record_header = struct.Struct('<II')
+
+SNAPSHOT_BESTAND = 'stores.snapshot'
+SEGMENT_PATROON = 'wal.%08d.log'
+
+
+def pas_toe(record, station_store, trein_store):
+    """
+    Pas een record uit het log toe op de stores. Alle records zijn
+    idempotent, zodat een record dat ook al in het snapshot verwerkt is
+    zonder gevolgen nogmaals afgespeeld kan worden:
+    - ('zet', station_code, treinnr, trein, in_station, in_trein)
+    - ('vertrokken', store_naam, sleutel, sub_sleutel, tijd)
+    - ('wis', store_naam, sleutel, sub_sleutel)
+    """
+
+    soort = record[0]
+
+    if soort == 'zet':
+        _, station_code, treinnr, trein, in_station, in_trein = record
+        if in_station:
+            station_store.setdefault(station_code, {})[treinnr] = trein
+        if in_trein:
+            trein_store.setdefault(treinnr, {})[station_code] = trein
+
+    elif soort in ('vertrokken', 'wis'):
+        store = station_store if record[1] == 'station' else trein_store
+        treinen = store.get(record[2])
+
+        if treinen is None or record[3] not in treinen:
+            return
+
+        if soort == 'vertrokken':
+            treinen[record[3]].status = '5'
+            treinen[record[3]].vertrokken_timestamp = record[4]
+        else:
+            del treinen[record[3]]
+            if store is trein_store and len(treinen) == 0:
+                del store[record[2]]
+
+
+class WriteAheadLog(object):
+    """
+    Write-ahead log voor de stores van de DVS daemon. Mutaties worden
+    na het toepassen op de stores toegevoegd aan het huidige segment
+    (wal.<nummer>.log); sync() schrijft het log naar disk (fsync) en wordt
+    periodiek aangeroepen, zodat niet iedere mutatie een fsync kost.
+
+    Bij een snapshot wordt eerst een nieuw segment gestart (roteer) en pas
+    daarna een kopie van de stores gemaakt (of de daemon geforkt). Iedere
+    mutatie in een ouder segment zit daardoor in het snapshot, en na het
+    schrijven van het snapshot kunnen de oudere segmenten gewist worden.
+    Worden vorige snapshots bewaard, dan blijven de segmenten vanaf het
+    oudste bewaarde snapshot staan, zodat herstel bij een onleesbaar
+    snapshot kan terugvallen op een vorig snapshot.
+    """
+
+    directory = None
+    segment = None
+    records = 0
+    bytes = 0
+    fsyncs = 0
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.logger = logging.getLogger(__name__)
+
+        # _lock beschermt het open segment bij schrijven, _sync_lock zorgt
+        # dat een segment niet gesloten wordt tijdens een fsync:
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._bestand = None
+        self._gewijzigd = False
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def segmenten(self):
+        """
+        Geef de nummers van alle aanwezige segmenten (oplopend)
+        """
+
+        nummers = []
+        for pad in glob.glob(os.path.join(self.directory, 'wal.*.log')):
+            try:
+                nummers.append(int(os.path.basename(pad).split('.')[1]))
+            except ValueError:
+                pass
+
+        return sorted(nummers)
+
+    def herstel(self):
+        """
+        Herstel de stores uit het laatste snapshot en de segmenten daarna.
+        Is het laatste snapshot onleesbaar, dan wordt een bewaard vorig
+        snapshot gebruikt (waarvan alle segmenten nog aanwezig zijn).
+        Geeft (station_store, trein_store), of None indien er geen snapshot
+        en geen log aanwezig is. Opent daarna een nieuw segment.
+        """
+
+        start = time.time()
+        snapshot_paden = dvs_snapshot.bewaarde_snapshots(os.path.join(self.directory, SNAPSHOT_BESTAND))
+        segmenten = self.segmenten()
+
+        if len(snapshot_paden) == 0 and len(segmenten) == 0:
+            self.open(1)
+            return None
+
+        station_store = {}
+        trein_store = {}
+        eerste_segment = 0
+
+        if len(snapshot_paden) > 0:
+            station_store, trein_store, snapshot = self._laad_snapshot(snapshot_paden, segmenten)
+            eerste_segment = snapshot['segment']
+
+            self.logger.info('WAL: snapshot van %s ingelezen in %.2fs (%s stations, %s treinen)',
+                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['tijd'])),
+                time.time() - start, len(station_store), len(trein_store))
+
+        # Ook bij het afspelen de garbage collector uit (zie dvs_snapshot.laad):
+        gc_actief = gc.isenabled()
+        gc.disable()
+
+        records = 0
+        try:
+            for nummer in segmenten:
+                if nummer >= eerste_segment:
+                    records += self._speel_af(nummer, station_store, trein_store)
+        finally:
+            if gc_actief:
+                gc.enable()
+
+        self.logger.info('WAL: %s records afgespeeld, stores hersteld in %.2fs',
+            records, time.time() - start)
+
+        # Nooit verder schrijven in een bestaand (mogelijk afgebroken) segment:
+        self.open(max(segmenten + [eerste_segment]) + 1)
+
+        return station_store, trein_store
+
+    def _laad_snapshot(self, snapshot_paden, segmenten):
+        """
+        Lees het nieuwste leesbare snapshot uit snapshot_paden (van nieuw
+        naar oud) waarvan alle segmenten sindsdien aanwezig zijn. Geeft
+        (station_store, trein_store, extra); is geen enkel snapshot
+        bruikbaar, dan volgt de fout van het laatste snapshot.
+        """
+
+        fout = None
+
+        for pad in snapshot_paden:
+            try:
+                station_store, trein_store, snapshot = dvs_snapshot.laad(pad)
+            except Exception as e:
+                self.logger.error('WAL: snapshot %s onleesbaar: %s', pad, e)
+                if fout is None:
+                    fout = e
+                continue
+
+            ontbrekend = [nummer for nummer in range(snapshot['segment'], max(segmenten + [0]))
+                if nummer not in segmenten]
+            if len(ontbrekend) > 0:
+                self.logger.error('WAL: snapshot %s niet bruikbaar, segmenten ontbreken (vanaf %s)',
+                    pad, ontbrekend[0])
+                continue
+
+            if pad != snapshot_paden[0]:
+                self.logger.warn('WAL: teruggevallen op vorig snapshot %s', pad)
+
+            return station_store, trein_store, snapshot
+
+        raise fout if fout is not None else dvs_snapshot.OngeldigSnapshot('Geen bruikbaar snapshot')
+
+    def _speel_af(self, nummer, station_store, trein_store):
+        """
+        Speel alle records van een segment af op de stores. Een onvolledig
+        of beschadigd record (een crash tijdens het schrijven) beeindigt
+        het afspelen van het segment. Geeft het aantal afgespeelde records.
+        """
+
+        records = 0
+
+        with open(os.path.join(self.directory, SEGMENT_PATROON % nummer), 'rb') as bestand:
+            while True:
+                header = bestand.read(_record_header.size)
+                if len(header) < _record_header.size:
+                    if len(header) > 0:
+                        self.logger.warn('WAL: segment %s eindigt met een onvolledig record', nummer)
+                    break
+
+                lengte, crc = _record_header.unpack(header)
+                data = bestand.read(lengte)
+
+                if len(data) < lengte or zlib.crc32(data) & 0xffffffff != crc:
+                    self.logger.warn('WAL: segment %s bevat een onvolledig of beschadigd record na %s records',
+                        nummer, records)
+                    break
+
+                pas_toe(pickle.loads(data), station_store, trein_store)
+                records += 1
+
+        return records
+
+    def open(self, nummer):
+        """
+        Open (of maak) segment nummer om records aan toe te voegen
+        """
+
+        self.segment = nummer
+        self._bestand = open(os.path.join(self.directory, SEGMENT_PATROON % nummer), 'ab')
+
+    def schrijf(self, record):
+        """
+        Voeg een record (zie pas_toe) toe aan het log. Het record staat pas
+        na de eerstvolgende sync() gegarandeerd op disk.
+        """
+
+        data = pickle.dumps(record, -1)
+        header = _record_header.pack(len(data), zlib.crc32(data) & 0xffffffff)
+
+        with self._lock:
+            self._bestand.write(header + data)
+            self._gewijzigd = True
+            self.records += 1
+            self.bytes += len(header) + len(data)
+
+    def sync(self):
+        """
+        Schrijf het huidige segment naar disk (flush en fsync), indien er
+        sinds de vorige sync records toegevoegd zijn
+        """
+
+        with self._sync_lock:
+            with self._lock:
+                if not self._gewijzigd:
+                    return
+                self._bestand.flush()
+                self._gewijzigd = False
+                fileno = self._bestand.fileno()
+
+            # De fsync zelf zonder _lock, zodat schrijven niet wacht op disk:
+            os.fsync(fileno)
+            self.fsyncs += 1
+
+    def roteer(self):
+        """
+        Sluit het huidige segment (na een fsync) en start een nieuw segment.
+        Geeft het nummer van het nieuwe segment: het eerste segment dat na
+        een hierna gemaakt snapshot afgespeeld moet worden.
+        """
+
+        with self._sync_lock:
+            with self._lock:
+                oud = self._bestand
+                self.open(self.segment + 1)
+                self._gewijzigd = False
+
+            oud.flush()
+            os.fsync(oud.fileno())
+            oud.close()
+
+        return self.segment
+
+    def schrijf_snapshot(self, station_store, trein_store, segment, fork=False, bewaar=1):
+        """
+        Schrijf een snapshot van de stores, welke geldig is vanaf segment
+        (zie roteer), en wis daarna de segmenten welke voor geen van de
+        bewaarde snapshots (zie bewaar) meer nodig zijn. Zonder fork moet
+        een kopie van de stores meegegeven worden; met fork schrijft een
+        child proces het snapshot van de stores zelf (zie
+        dvs_snapshot.schrijf_fork). Een crash tijdens het schrijven laat
+        het vorige snapshot intact. Geeft duur (seconden) en grootte
+        (bytes) van het snapshot.
+        """
+
+        start = time.time()
+        pad = os.path.join(self.directory, SNAPSHOT_BESTAND)
+        extra = {'segment': segment, 'tijd': start}
+
+        if fork:
+            dvs_snapshot.schrijf_fork(pad, station_store, trein_store, extra, bewaar=bewaar)
+        else:
+            dvs_snapshot.schrijf(pad, station_store, trein_store, extra, bewaar=bewaar)
+
+        duur = time.time() - start
+        grootte = os.path.getsize(pad)
+
+        # Compactie: segmenten van voor het oudste bewaarde snapshot zijn
+        # in alle snapshots verwerkt:
+        oudste = segment
+        for bewaard in dvs_snapshot.bewaarde_snapshots(pad)[1:bewaar]:
+            try:
+                oudste = min(oudste, dvs_snapshot.lees_extra(bewaard)['segment'])
+            except Exception as e:
+                self.logger.warn('WAL: bewaard snapshot %s onleesbaar: %s', bewaard, e)
+
+        for nummer in self.segmenten():
+            if nummer < oudste:
+                os.remove(os.path.join(self.directory, SEGMENT_PATROON % nummer))
+
+        self.logger.info('WAL: snapshot geschreven in %.2fs (%s, %.1f MB, vanaf segment %s)',
+            duur, 'fork' if fork else 'thread', grootte / 1048576.0, segment)
+
+        return duur, grootte
+
+    def sluit(self):
+        """
+        Sync en sluit het huidige segment
+        """
+
+        self.sync()
+        with self._lock:
+            self._bestand.close()
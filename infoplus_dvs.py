@@ -653,9 +653,11 @@ class Trein(object):
             else:
                 return 'Reservering verplicht'
 
-    def markeer_vertrokken(self):
+    def markeer_vertrokken(self, tijd=None):
         self.status = "5"
-        self.vertrokken_timestamp = datetime.datetime.now(pytz.utc)
+        if tijd is None:
+            tijd = datetime.datetime.now(pytz.utc)
+        self.vertrokken_timestamp = tijd
 
     def is_vertrokken(self):
         return self.status == "5"
@@ -1174,3 +1176,23 @@ def iso_duur_naar_seconden(string):
             return isodate.parse_duration(string[1:]).seconds * -1
 
     return isodate.parse_duration(string).seconds
+
+def sorteer_treinen(treinen, sorteer=None):
+    """
+    Sorteer de treinen (dict of list) van een station. Met sorteer='actueel'
+    op actuele vertrektijd, met sorteer='vertraging' op vertraging (hoog naar
+    laag), en anders op geplande vertrektijd.
+    """
+
+    if isinstance(treinen, dict):
+        treinen = treinen.values()
+
+    if sorteer == 'actueel':
+        return sorted(treinen,
+            key=lambda trein: trein.vertrek_actueel)
+    elif sorteer == 'vertraging':
+        return sorted(treinen,
+            key=lambda trein: trein.vertraging)[::-1]
+    else:
+        return sorted(treinen,
+            key=lambda trein: trein.vertrek)
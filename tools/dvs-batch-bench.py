@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+
+"""
+Test tool om de winst van batch-opdrachten (stations/...) te meten.
+
+Vraagt een aantal stations op zoals de HTTP interface dat per station
+doet (nieuwe verbinding en een REQ/REP round trip per station), en
+vergelijkt dit met een enkele stations/<codes> batch-opdracht.
+"""
+
+import os
+import sys
+import zmq
+import argparse
+import time
+
+# Voor het unpicklen van Trein objecten:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# 50 grote stations, gebruikt indien geen stations opgegeven zijn:
+STANDAARD_STATIONS = [
+    'ASD', 'UT', 'RTD', 'GVC', 'SHL', 'EHV', 'AMF', 'ZL', 'ASS', 'LEDN',
+    'HLM', 'BD', 'NM', 'AH', 'HT', 'DT', 'GD', 'ALM', 'HVS', 'AMR',
+    'ZD', 'ASB', 'DDR', 'RSD', 'VL', 'MT', 'GN', 'LW', 'DV', 'HGL',
+    'ES', 'TB', 'RTB', 'SDM', 'HRL', 'GVM', 'LAA', 'ASDZ', 'ASA', 'UTO',
+    'WD', 'APD', 'ED', 'VS', 'MAS', 'HN', 'LLS', 'WP', 'HDR', 'BKL']
+
+
+def opdracht(dvs_client_server, opdracht, server_timeout):
+    """
+    Stuur een opdracht over een nieuwe verbinding, zoals
+    _send_dvs_command in dvs_http_interface dat doet
+    """
+
+    context = zmq.Context()
+    client = context.socket(zmq.REQ)
+    client.connect(dvs_client_server)
+    client.setsockopt(zmq.LINGER, 0)
+    client.send(opdracht)
+
+    poller = zmq.Poller()
+    poller.register(client, zmq.POLLIN)
+
+    try:
+        if poller.poll(server_timeout * 1000):
+            return client.recv_pyobj()
+        else:
+            print "ERROR: Timeout, server reageerde niet binnen %ss" % server_timeout
+            sys.exit(1)
+    finally:
+        client.close()
+        context.term()
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='DVS batch benchmark. Vergelijk losse station-opdrachten met een batch-opdracht')
+
+    parser.add_argument('-s', '--server', action='store', default='127.0.0.1', help='DVS server (standaard 127.0.0.1)')
+    parser.add_argument('-p', '--port', action='store', default='8120', help='DVS poort (standaard 8120)')
+    parser.add_argument('-t', '--timeout', action='store', default='4', help='timeout in seconden (standaard 4s)')
+    parser.add_argument('-n', '--herhalingen', action='store', default='20', help='aantal herhalingen (standaard 20)')
+    parser.add_argument('STATIONS', nargs='?', action='store',
+        help='kommagescheiden lijst met stations (standaard 50 grote stations)')
+
+    args = parser.parse_args()
+
+    dvs_client_server = "tcp://%s:%s" % (args.server, args.port)
+    server_timeout = int(args.timeout)
+    herhalingen = int(args.herhalingen)
+
+    if args.STATIONS is not None:
+        stations = args.STATIONS.upper().split(',')
+    else:
+        stations = STANDAARD_STATIONS
+
+    print "DVS server: %s" % dvs_client_server
+    print "Stations:   %s, herhalingen: %s" % (len(stations), herhalingen)
+    print "--------------------------------"
+
+    # Losse opdrachten (een round trip per station):
+    start = time.time()
+    for _ in range(herhalingen):
+        for station in stations:
+            opdracht(dvs_client_server, 'station/%s' % station, server_timeout)
+    duur_los = (time.time() - start) / herhalingen
+
+    # Batch opdracht (een round trip voor alle stations):
+    start = time.time()
+    for _ in range(herhalingen):
+        opdracht(dvs_client_server, 'stations/%s' % ','.join(stations), server_timeout)
+    duur_batch = (time.time() - start) / herhalingen
+
+    print "Losse opdrachten: %.2f ms per cyclus (%.2f ms per station)" % \
+        (duur_los * 1000, duur_los * 1000 / len(stations))
+    print "Batch opdracht:   %.2f ms per cyclus" % (duur_batch * 1000)
+
+    if duur_batch > 0:
+        print "Besparing:        %.2f ms per cyclus (factor %.1f)" % \
+            ((duur_los - duur_batch) * 1000, duur_los / duur_batch)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het vertalen van de vertrektijden van een station.
+
+Bouwt een station met een opgegeven aantal treinen (op basis van de
+testdata), waarvan een deel vertrokken en een deel opgeheven (en langer
+dan 2 minuten geleden vertrokken) is. Vergelijkt de oorspronkelijke loop
+(trein_to_dict voor iedere trein, daarna vertrokken treinen weggooien)
+met dvs_http_parsers.vertrektijden_to_list, en controleert dat beide
+dezelfde vertrektijden opleveren.
+"""
+
+import os
+import sys
+import argparse
+import copy
+import datetime
+import glob
+import time
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import infoplus_dvs
+import dvs_http_parsers
+
+
+def laad_treinen():
+    """
+    Laad alle treinen uit de testdata
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata')
+    treinen = []
+
+    for bestand in sorted(glob.glob(os.path.join(root, 'formatted', '*.xml'))):
+        with open(bestand) as xml:
+            treinen.append(infoplus_dvs.parse_trein(xml.read()))
+
+    return treinen
+
+
+def maak_station(voorbeelden, aantal, vertrokken, opgeheven, tijd_nu):
+    """
+    Maak een station (dict rit_id -> trein) met aantal treinen, waarvan
+    het opgegeven percentage vertrokken of verlopen opgeheven is
+    """
+
+    station = {}
+    for nummer in range(aantal):
+        trein = copy.deepcopy(voorbeelden[nummer % len(voorbeelden)])
+        trein.treinnr = str(100000 + nummer)
+        trein.rit_id = trein.treinnr
+        trein.vertrek = tijd_nu + datetime.timedelta(minutes=nummer - aantal * (vertrokken + opgeheven) / 100)
+        trein.vertrek_actueel = trein.vertrek + datetime.timedelta(seconds=trein.vertraging)
+        trein.wijzigingen = [wijziging for wijziging in trein.wijzigingen if wijziging.wijziging_type != '32']
+
+        if nummer < aantal * vertrokken / 100:
+            trein.markeer_vertrokken()
+        elif nummer < aantal * (vertrokken + opgeheven) / 100:
+            trein.vertrek = tijd_nu - datetime.timedelta(minutes=10)
+            trein.wijzigingen = trein.wijzigingen + [infoplus_dvs.Wijziging('32')]
+
+        station[trein.rit_id] = trein
+
+    return station
+
+
+def huidige_loop(treinen, taal, tijd_nu, sorteer, materieel):
+    """
+    De oorspronkelijke loop: vertaal alle treinen, en gooi daarna
+    vertrokken en verlopen opgeheven treinen weg
+    """
+
+    vertrektijden = []
+
+    for trein in infoplus_dvs.sorteer_treinen(treinen, sorteer):
+        trein_dict = dvs_http_parsers.trein_to_dict(trein, taal, tijd_nu, materieel=materieel)
+
+        if trein_dict != None and not trein.is_vertrokken():
+            vertrektijden.append(trein_dict)
+
+    return vertrektijden
+
+
+def meet(functie, herhalingen):
+    """
+    Geef de gemiddelde duur van functie() in ms
+    """
+
+    start = time.time()
+    for _ in range(herhalingen):
+        functie()
+
+    return (time.time() - start) * 1000 / herhalingen
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor het vertalen van de vertrektijden van een station')
+
+    parser.add_argument('-a', '--aantallen', action='store', default='100,250,500', help='kommagescheiden aantallen treinen per station (standaard 100,250,500)')
+    parser.add_argument('-n', '--herhalingen', action='store', default='50', help='aantal herhalingen per meting (standaard 50)')
+    parser.add_argument('-d', '--vertrokken', action='store', default='40', help='percentage vertrokken treinen (standaard 40)')
+    parser.add_argument('-o', '--opgeheven', action='store', default='5', help='percentage verlopen opgeheven treinen (standaard 5)')
+    parser.add_argument('-t', '--taal', action='store', default='nl', help='taal (standaard nl)')
+    parser.add_argument('-s', '--sorteer', action='store', default=None, help='sortering (actueel of vertraging)')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose vertrektijden (met materieel)')
+
+    args = parser.parse_args()
+
+    herhalingen = int(args.herhalingen)
+    vertrokken = int(args.vertrokken)
+    opgeheven = int(args.opgeheven)
+    tijd_nu = datetime.datetime.now(pytz.utc)
+    voorbeelden = laad_treinen()
+
+    print "Vertrokken: %s%%, opgeheven (verlopen): %s%%, taal: %s, sorteer: %s, verbose: %s" % (
+        vertrokken, opgeheven, args.taal, args.sorteer, args.verbose)
+    print "Treinen  getoond  huidige loop  vertrektijden_to_list  versnelling"
+
+    for aantal in [int(aantal) for aantal in args.aantallen.split(',')]:
+        treinen = maak_station(voorbeelden, aantal, vertrokken, opgeheven, tijd_nu)
+
+        resultaat = dvs_http_parsers.vertrektijden_to_list(treinen, args.taal, tijd_nu, args.sorteer, args.verbose)
+        if resultaat != huidige_loop(treinen, args.taal, tijd_nu, args.sorteer, args.verbose):
+            print "Fout: vertrektijden verschillen bij %s treinen" % aantal
+            sys.exit(1)
+
+        duur_huidig = meet(lambda: huidige_loop(treinen, args.taal, tijd_nu, args.sorteer, args.verbose), herhalingen)
+        duur_bord = meet(lambda: dvs_http_parsers.vertrektijden_to_list(treinen, args.taal, tijd_nu, args.sorteer, args.verbose), herhalingen)
+
+        print "%7s  %7s  %9.2f ms  %18.2f ms  %10.1fx" % (aantal, len(resultaat), duur_huidig, duur_bord, duur_huidig / duur_bord)
+
+if __name__ == "__main__":
+    main()
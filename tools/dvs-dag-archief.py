@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+
+"""
+Maak een archief met een volledige dag aan DVS berichten, voor een
+versnelde replay met dvs-daemon.py --replay <archief> --virtuele-klok.
+
+Op basis van een bericht uit de testdata krijgt iedere trein per station
+berichten zoals in testdata/treinlog: een eerste bericht 70 minuten voor
+vertrek, updates 30 en 5 minuten voor vertrek (waarvan een deel met
+vertraging) en een vertrekbericht. Een deel van de treinen krijgt geen
+vertrekbericht, zodat de GC thread deze als vertrokken moet markeren.
+Met --storing valt de feed halverwege de dag een aantal minuten uit, zodat
+ook de overgangen naar DOWN, RECOVERING en UP doorlopen worden.
+
+Het archief is een gzip bestand met een bericht per regel, in volgorde
+van TimeStamp.
+"""
+
+import os
+import argparse
+import datetime
+import gzip
+import random
+import time
+import xml.etree.cElementTree as ET
+
+NAMESPACE = 'urn:ndov:cdm:trein:reisinformatie:data:2'
+SJABLOON = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata', 'formatted', 'ddr 1929.xml')
+
+
+def maak_sjabloon():
+    """
+    Maak een sjabloon (voor de % operator) van het voorbeeldbericht
+    """
+
+    root = ET.parse(SJABLOON).getroot()
+    product = root.find('{%s}ReisInformatieProductDVS' % NAMESPACE)
+    vertrekstaat = product.find('{%s}DynamischeVertrekStaat' % NAMESPACE)
+    trein = vertrekstaat.find('{%s}Trein' % NAMESPACE)
+
+    product.set('TimeStamp', '__TIJD__')
+    vertrekstaat.find('{%s}RitId' % NAMESPACE).text = '__NR__'
+    vertrekstaat.find('{%s}RitDatum' % NAMESPACE).text = '__DATUM__'
+    for veld in ('StationCode', 'KorteNaam', 'MiddelNaam', 'LangeNaam'):
+        vertrekstaat.find('{%s}RitStation/{%s}%s' % (NAMESPACE, NAMESPACE, veld)).text = '__STATION__'
+
+    trein.find('{%s}TreinNummer' % NAMESPACE).text = '__NR__'
+    trein.find('{%s}TreinStatus' % NAMESPACE).text = '__STATUS__'
+    trein.find('{%s}VertrekTijd[@InfoStatus="Gepland"]' % NAMESPACE).text = '__VERTREK__'
+    trein.find('{%s}VertrekTijd[@InfoStatus="Actueel"]' % NAMESPACE).text = '__ACTUEEL__'
+    trein.find('{%s}ExacteVertrekVertraging' % NAMESPACE).text = '__VERTRAGING__'
+    trein.find('{%s}GedempteVertrekVertraging' % NAMESPACE).text = '__VERTRAGING__'
+
+    sjabloon = ET.tostring(root).replace('\n', '').replace('%', '%%')
+    for naam in ('tijd', 'nr', 'datum', 'station', 'status', 'vertrek', 'actueel', 'vertraging'):
+        sjabloon = sjabloon.replace('__%s__' % naam.upper(), '%%(%s)s' % naam)
+
+    return sjabloon
+
+
+def iso(tijd):
+    return tijd.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Maak een archief met een volledige dag aan DVS berichten')
+
+    parser.add_argument('-a', '--aantal', action='store', default='60000', help='aantal vertrekken (standaard 60000, een volledige dag)')
+    parser.add_argument('-s', '--stations', action='store', default='400', help='aantal stations (standaard 400)')
+    parser.add_argument('-p', '--stops', action='store', default='10', help='aantal stations per trein (standaard 10)')
+    parser.add_argument('-d', '--datum', action='store', default='2013-11-08', help='datum (standaard 2013-11-08)')
+    parser.add_argument('--storing', action='store', default='60', help='minuten zonder berichten vanaf 12:00 UTC (standaard 60)')
+    parser.add_argument('--zonder-vertrek', dest='zonder_vertrek', action='store', default='0.02',
+        help='fractie vertrekken zonder vertrekbericht (standaard 0.02)')
+    parser.add_argument('ARCHIEF', action='store', help='uitvoerbestand (gzip)')
+
+    args = parser.parse_args()
+
+    aantal = int(args.aantal)
+    stations = int(args.stations)
+    stops = int(args.stops)
+    dag = datetime.datetime.strptime(args.datum, '%Y-%m-%d')
+    storing_start = dag + datetime.timedelta(hours=12)
+    storing_einde = storing_start + datetime.timedelta(minutes=int(args.storing))
+
+    sjabloon = maak_sjabloon()
+    willekeurig = random.Random(42)
+    start = time.time()
+
+    # Bepaal alle berichten als (tijd, velden):
+    berichten = []
+    for vertrek_nr in range(aantal):
+        nummer = vertrek_nr // stops
+        station = 'S%03d' % ((nummer * 7 + vertrek_nr) % stations)
+
+        # Treinen verspreid over de dag, met de stops van een trein op
+        # 5 minuten van elkaar:
+        vertrek = dag + datetime.timedelta(seconds=nummer * 86400 * stops // aantal,
+            minutes=5 * (vertrek_nr % stops))
+        vertraging = willekeurig.choice([0, 0, 0, 60, 180, 600])
+
+        velden = {'nr': str(100000 + nummer), 'datum': args.datum, 'station': station,
+            'vertrek': iso(vertrek), 'actueel': iso(vertrek), 'vertraging': 'PT0S', 'status': '0'}
+
+        momenten = [(vertrek - datetime.timedelta(minutes=70), velden)]
+
+        vertraagd = dict(velden, actueel=iso(vertrek + datetime.timedelta(seconds=vertraging)),
+            vertraging='PT%sS' % vertraging)
+        momenten.append((vertrek - datetime.timedelta(minutes=30), vertraagd))
+        momenten.append((vertrek - datetime.timedelta(minutes=5), dict(vertraagd, status='2')))
+
+        if willekeurig.random() >= float(args.zonder_vertrek):
+            momenten.append((vertrek + datetime.timedelta(seconds=vertraging + 30), dict(vertraagd, status='5')))
+
+        for tijd, bericht in momenten:
+            if tijd < dag or tijd >= dag + datetime.timedelta(days=1):
+                continue
+            if storing_start <= tijd < storing_einde:
+                continue
+            berichten.append((tijd + datetime.timedelta(milliseconds=willekeurig.randint(0, 999)), bericht))
+
+    berichten.sort(key=lambda bericht: bericht[0])
+
+    with gzip.open(args.ARCHIEF, 'wb') as archief:
+        for tijd, velden in berichten:
+            velden['tijd'] = tijd.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (tijd.microsecond // 1000)
+            archief.write(sjabloon % velden)
+            archief.write('\n')
+
+    print "%s berichten voor %s vertrekken geschreven naar %s (%.1fs, %.1f MB)" % (
+        len(berichten), aantal, args.ARCHIEF, time.time() - start, os.path.getsize(args.ARCHIEF) / 1048576.0)
+
+if __name__ == "__main__":
+    main()
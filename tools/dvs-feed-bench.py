@@ -0,0 +1,106 @@
+#!/usr/bin/env python2
+
+"""
+Test tool om de change feed van dvs-daemon.py te meten.
+
+Abonneert zich op de feed (optioneel gefilterd op station) en rapporteert
+iedere seconde het aantal ontvangen events, en na afloop het totaal en het
+aantal gemiste events (op basis van het volgnummer).
+Gebruik dit samen met tools/dvs-pub-test.py om de feed op replaysnelheid
+te meten.
+"""
+
+import os
+import sys
+import zmq
+import argparse
+import cPickle as pickle
+import time
+
+# Voor het unpicklen van Trein objecten:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='DVS feed benchmark. Meet het aantal events op de change feed')
+
+    parser.add_argument('-s', '--server', action='store', default='127.0.0.1', help='DVS server (standaard 127.0.0.1)')
+    parser.add_argument('-p', '--port', action='store', default='8160', help='DVS feed poort (standaard 8160)')
+    parser.add_argument('-d', '--duur', action='store', default='60', help='meetduur in seconden (standaard 60s)')
+    parser.add_argument('-q', '--quiet', dest='quiet', action='store_true', help='geen tussentijdse rapportage')
+    parser.add_argument('STATION', nargs='?', action='store', default='',
+        help='stationscode om op te filteren (standaard alle stations)')
+
+    args = parser.parse_args()
+
+    dvs_feed_server = "tcp://%s:%s" % (args.server, args.port)
+    duur = int(args.duur)
+
+    topic = ''
+    if args.STATION != '':
+        topic = '%s/' % args.STATION.upper()
+
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.RCVHWM, 0)
+    subscriber.connect(dvs_feed_server)
+    subscriber.setsockopt(zmq.SUBSCRIBE, topic)
+
+    poller = zmq.Poller()
+    poller.register(subscriber, zmq.POLLIN)
+
+    print "DVS feed: %s, topic: '%s', meetduur: %ss" % (dvs_feed_server, topic, duur)
+    print "--------------------------------"
+
+    soorten = {}
+    totaal = 0
+    gemist = 0
+    vorige_volgnummer = None
+    eerste_event = None
+    laatste_event = None
+
+    start = time.time()
+    interval_start = start
+    interval_aantal = 0
+
+    while time.time() - start < duur:
+        if poller.poll(100):
+            _, data = subscriber.recv_multipart()
+            event = pickle.loads(data)
+
+            nu = time.time()
+            if eerste_event is None:
+                eerste_event = nu
+            laatste_event = nu
+
+            totaal += 1
+            interval_aantal += 1
+            soorten[event['soort']] = soorten.get(event['soort'], 0) + 1
+
+            # Gaten in volgnummers (bij zonder filter) zijn gemiste events:
+            if topic == '' and vorige_volgnummer is not None and event['volgnummer'] > vorige_volgnummer + 1:
+                gemist += event['volgnummer'] - vorige_volgnummer - 1
+            vorige_volgnummer = event['volgnummer']
+
+        if time.time() - interval_start >= 1:
+            if args.quiet == False and interval_aantal > 0:
+                print "%6s events/s" % interval_aantal
+            interval_start = time.time()
+            interval_aantal = 0
+
+    print "--------------------------------"
+    print "Ontvangen events: %s %s" % (totaal, soorten)
+
+    if topic == '':
+        print "Gemiste events:   %s" % gemist
+
+    if totaal > 1 and laatste_event > eerste_event:
+        print "Doorvoer:         %.0f events/s" % (totaal / (laatste_event - eerste_event))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het maken van snapshots terwijl de daemon berichten verwerkt.
+
+Bouwt een trein- en station store ter grootte van een volledige dag (zoals
+tools/dvs-wal-bench.py), en laat een thread continu nieuwe treinen in de
+stores zetten (zoals de worker thread doet). Per methode wordt in een los
+proces een snapshot gemaakt en gemeten hoeveel treinen er tijdens het
+snapshot verwerkt worden en wat de langste onderbreking is:
+- thread: kopie van de stores en schrijven in een thread (zonder fork)
+- fork: schrijven vanuit een child proces (dvs_snapshot.schrijf_fork)
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import imp
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import cPickle as pickle
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dvs_snapshot
+
+# Stores bouwen zoals in de WAL benchmark:
+wal_bench = imp.load_source('wal_bench',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dvs-wal-bench.py'))
+
+
+class Verwerker(threading.Thread):
+    """
+    Thread die continu nieuwe versies van bestaande vertrekken in de stores
+    zet, en het tijdstip van iedere verwerkte trein bijhoudt
+    """
+
+    def __init__(self, voorbeelden, station_store, trein_store, tijd_nu):
+        threading.Thread.__init__(self, name='Verwerker')
+        self.daemon = True
+        self.voorbeelden = voorbeelden
+        self.station_store = station_store
+        self.trein_store = trein_store
+        self.tijd_nu = tijd_nu
+        self.stoppen = threading.Event()
+        self.tijden = []
+
+        self.vertrekken = [(station_code, treinnr) for station_code, treinen in station_store.items()
+            for treinnr in treinen]
+
+    def run(self):
+        nummer = 0
+
+        while not self.stoppen.is_set():
+            station_code, treinnr = self.vertrekken[nummer % len(self.vertrekken)]
+            trein = wal_bench.maak_trein(self.voorbeelden, int(treinnr) - 100000, station_code, self.tijd_nu)
+            self.station_store[station_code][treinnr] = trein
+            self.trein_store[treinnr][station_code] = trein
+            self.tijden.append(time.time())
+            nummer += 1
+
+    def meet(self, start, einde):
+        """
+        Geef het aantal verwerkte treinen per seconde en de langste
+        onderbreking (ms) tussen start en einde
+        """
+
+        tijden = [tijd for tijd in self.tijden if start <= tijd <= einde]
+        gaten = [b - a for a, b in zip([start] + tijden, tijden + [einde])]
+
+        return len(tijden) / (einde - start), max(gaten) * 1000
+
+
+def meet_methode(methode, aantal, stations, stops, rust):
+    """
+    Meet een snapshot met methode (thread of fork) in dit proces; print de
+    resultaten als pickle naar stdout
+    """
+
+    tijd_nu = datetime.datetime.now(pytz.utc)
+    voorbeelden = wal_bench.laad_treinen()
+    station_store, trein_store = wal_bench.maak_stores(voorbeelden, aantal, stations, stops, tijd_nu)
+
+    directory = tempfile.mkdtemp(prefix='dvs-fork-bench-')
+    pad = os.path.join(directory, 'stores.snapshot')
+
+    verwerker = Verwerker(voorbeelden, station_store, trein_store, tijd_nu)
+    verwerker.start()
+
+    try:
+        # Doorvoer zonder snapshot:
+        start_rust = time.time()
+        time.sleep(rust)
+
+        start = time.time()
+        if methode == 'fork':
+            dvs_snapshot.schrijf_fork(pad, station_store, trein_store)
+        else:
+            kopie_stations = dict((station_code, dict(treinen)) for station_code, treinen in station_store.items())
+            kopie_treinen = dict((treinnr, dict(stations_trein)) for treinnr, stations_trein in trein_store.items())
+            schrijver = threading.Thread(target=dvs_snapshot.schrijf, args=(pad, kopie_stations, kopie_treinen))
+            schrijver.start()
+            schrijver.join()
+        einde = time.time()
+
+        verwerker.stoppen.set()
+        verwerker.join()
+
+        resultaat = {
+            'duur': einde - start,
+            'grootte': os.path.getsize(pad),
+            'rust': verwerker.meet(start_rust, start),
+            'snapshot': verwerker.meet(start, einde),
+            'child_rss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        }
+    finally:
+        shutil.rmtree(directory)
+
+    sys.stdout.write(pickle.dumps(resultaat, -1))
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor snapshots tijdens het verwerken van berichten')
+
+    parser.add_argument('-a', '--aantal', action='store', default='60000', help='aantal vertrekken in de stores (standaard 60000, een volledige dag)')
+    parser.add_argument('-s', '--stations', action='store', default='400', help='aantal stations (standaard 400)')
+    parser.add_argument('-p', '--stops', action='store', default='10', help='aantal stations per trein (standaard 10)')
+    parser.add_argument('-r', '--rust', action='store', default='2', help='seconden meten zonder snapshot (standaard 2)')
+    parser.add_argument('--methode', action='store', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.methode is not None:
+        # Meting in een los proces:
+        meet_methode(args.methode, int(args.aantal), int(args.stations), int(args.stops), float(args.rust))
+        return
+
+    print "Stores: %s vertrekken, %s stations" % (args.aantal, args.stations)
+    print
+
+    for methode in ('thread', 'fork'):
+        uitvoer = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+            '-a', args.aantal, '-s', args.stations, '-p', args.stops, '-r', args.rust,
+            '--methode', methode])
+        resultaat = pickle.loads(uitvoer)
+
+        print "%-7s snapshot %6.2fs (%5.1f MB); treinen/s zonder snapshot %7.0f, tijdens snapshot %7.0f; " \
+            "langste onderbreking %7.1f ms" % (methode + ':', resultaat['duur'],
+            resultaat['grootte'] / 1048576.0, resultaat['rust'][0], resultaat['snapshot'][0],
+            resultaat['snapshot'][1])
+
+        if methode == 'fork':
+            print "%-7s max RSS child proces %.1f MB (inclusief gedeelde pagina's)" % (
+                '', resultaat['child_rss'] / 1048576.0)
+
+if __name__ == "__main__":
+    main()
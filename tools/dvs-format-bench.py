@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor de responseformaten van de HTTP interface: JSON en
+MessagePack. Vergelijkt voor stations met een opgegeven aantal treinen
+(op basis van de testdata) de encodeertijd, de grootte (ook met gzip) en
+de decodeertijd. Met --url worden daarnaast echte stationsresponses van
+een draaiende HTTP interface opgehaald in beide formaten.
+"""
+
+import os
+import sys
+import argparse
+import copy
+import datetime
+import glob
+import json
+import time
+import urllib2
+import zlib
+import pytz
+import bottle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import infoplus_dvs
+import dvs_http_interface
+import dvs_json
+import dvs_msgpack
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def laad_treinen():
+    """
+    Laad alle treinen uit de testdata
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata')
+    treinen = []
+
+    for bestand in sorted(glob.glob(os.path.join(root, 'formatted', '*.xml'))):
+        with open(bestand) as xml:
+            treinen.append(infoplus_dvs.parse_trein(xml.read()))
+
+    return treinen
+
+
+def maak_station(voorbeelden, aantal):
+    """
+    Maak een station (dict treinnr -> trein) met aantal treinen
+    """
+
+    station = {}
+    for nummer in range(aantal):
+        trein = copy.deepcopy(voorbeelden[nummer % len(voorbeelden)])
+        trein.treinnr = str(100000 + nummer)
+        trein.rit_id = trein.treinnr
+        station[trein.treinnr] = trein
+
+    return station
+
+
+def meet(functie, herhalingen):
+    """
+    Geef de gemiddelde duur van functie() in ms
+    """
+
+    start = time.time()
+    for _ in range(herhalingen):
+        functie()
+
+    return (time.time() - start) * 1000 / herhalingen
+
+
+def decoders():
+    """
+    Geef de beschikbare decoders per formaat
+    """
+
+    json_decoders = [('json', json.loads)]
+    if ujson is not None:
+        json_decoders.append(('ujson', ujson.loads))
+
+    return {'json': json_decoders,
+            'msgpack': [('msgpack', lambda data: dvs_msgpack.msgpack.unpackb(data, raw=False))]}
+
+
+def vergelijk(naam, bodies, encoders, herhalingen):
+    """
+    Print grootte, encodeer- en decodeertijd per formaat
+    """
+
+    for formaat in ('json', 'msgpack'):
+        body = bodies[formaat]
+        regel = "%-22s %-8s %8s B %8s B gzip" % (naam, formaat, len(body), len(zlib.compress(body, 6)))
+
+        if encoders is not None:
+            regel += "  encode %6.2f ms" % meet(encoders[formaat], herhalingen)
+
+        for decoder_naam, decoder in decoders()[formaat]:
+            regel += "  %s %6.2f ms" % (decoder_naam, meet(lambda: decoder(body), herhalingen))
+
+        print regel
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor JSON en MessagePack responses van de HTTP interface')
+
+    parser.add_argument('-a', '--aantallen', action='store', default='100,250,500', help='kommagescheiden aantallen treinen per station (standaard 100,250,500)')
+    parser.add_argument('-n', '--herhalingen', action='store', default='50', help='aantal herhalingen per meting (standaard 50)')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose vertrektijden (met materieel)')
+    parser.add_argument('-u', '--url', action='store', default=None, help='basis-URL van een draaiende HTTP interface, voor echte stationsresponses')
+    parser.add_argument('-s', '--stations', action='store', default='UT,ASD,RTD', help='kommagescheiden stations bij --url (standaard UT,ASD,RTD)')
+
+    args = parser.parse_args()
+
+    if not dvs_msgpack.BESCHIKBAAR:
+        print "msgpack module niet beschikbaar"
+        sys.exit(1)
+
+    herhalingen = int(args.herhalingen)
+
+    bottle.request.bind({'QUERY_STRING': 'verbose=true' if args.verbose else ''})
+    tijd_nu = datetime.datetime.now(pytz.utc)
+    voorbeelden = laad_treinen()
+
+    print "JSON encoder: %s, verbose: %s, msgpack: %s" % (
+        dvs_json.ENCODER, args.verbose, dvs_msgpack.msgpack.Packer.__module__)
+
+    for aantal in [int(aantal) for aantal in args.aantallen.split(',')]:
+        treinen = maak_station(voorbeelden, aantal)
+        vertrektijden = dvs_http_interface._vertrektijden(treinen, 'nl', tijd_nu)
+        data = {'result': 'OK', 'system_status': 'UP', 'vertrektijden': vertrektijden}
+
+        # Volledig encoderen (zonder fragment cache):
+        encoders = {'json': lambda: dvs_json.dumps(data),
+                    'msgpack': lambda: dvs_msgpack.dumps(data)}
+
+        bodies = dict((formaat, encoder()) for formaat, encoder in encoders.items())
+        vergelijk('%s treinen' % aantal, bodies, encoders, herhalingen)
+
+    if args.url is not None:
+        for station in args.stations.split(','):
+            bodies = {}
+            for formaat, accept in (('json', 'application/json'), ('msgpack', dvs_msgpack.CONTENT_TYPE)):
+                request = urllib2.Request('%s/v2/station/%s%s' % (args.url.rstrip('/'), station,
+                    '?verbose=true' if args.verbose else ''), headers={'Accept': accept})
+                bodies[formaat] = urllib2.urlopen(request).read()
+
+            vergelijk('%s (%s treinen)' % (station, len(json.loads(bodies['json'])['vertrektijden'])),
+                bodies, None, herhalingen)
+
+if __name__ == "__main__":
+    main()
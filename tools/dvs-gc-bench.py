@@ -0,0 +1,114 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor de pauzes van de Python garbage collector in de daemon.
+
+Bouwt een trein- en station store ter grootte van een volledige dag (zoals
+tools/dvs-wal-bench.py) en doet daarna een aantal GC rondes, met tussen de
+rondes nieuwe treinen in de stores (zoals de worker thread doet). Per beleid
+wordt in een los proces de pauze van de collectie na iedere ronde gemeten:
+- oud: debugvlaggen en een volledige gc.collect() na iedere ronde
+- nieuw: dvs_gc.GcBeleid met de standaardinstellingen (productie profiel,
+  bevriezen na het laden, volledige collectie iedere 60 rondes)
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import gc
+import imp
+import subprocess
+import time
+import cPickle as pickle
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dvs_gc
+import dvs_metrics
+
+# Stores bouwen zoals in de WAL benchmark:
+wal_bench = imp.load_source('wal_bench',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dvs-wal-bench.py'))
+
+
+def meet_beleid(beleid, aantal, stations, stops, rondes, per_ronde):
+    """
+    Meet de pauzes na iedere ronde voor beleid (oud of nieuw) in dit
+    proces; print de samenvatting als pickle naar stdout
+    """
+
+    tijd_nu = datetime.datetime.now(pytz.utc)
+    voorbeelden = wal_bench.laad_treinen()
+    station_store, trein_store = wal_bench.maak_stores(voorbeelden, aantal, stations, stops, tijd_nu)
+
+    if beleid == 'oud':
+        gc.set_debug(gc.DEBUG_UNCOLLECTABLE | gc.DEBUG_INSTANCES | gc.DEBUG_OBJECTS)
+    else:
+        gc_beleid = dvs_gc.GcBeleid({})
+        gc_beleid.pas_toe()
+        gc_beleid.na_laden()
+
+    pauzes = dvs_metrics.Histogram(dvs_gc.PAUZE_BUCKETS_MS)
+    vertrekken = [(station_code, treinnr) for station_code, treinen in station_store.items()
+        for treinnr in treinen]
+
+    for ronde in range(rondes):
+        # Nieuwe versies van bestaande vertrekken, zoals updates uit de feed:
+        for nummer in range(per_ronde):
+            station_code, treinnr = vertrekken[(ronde * per_ronde + nummer) % len(vertrekken)]
+            trein = wal_bench.maak_trein(voorbeelden, int(treinnr) - 100000, station_code, tijd_nu)
+            station_store[station_code][treinnr] = trein
+            trein_store[treinnr][station_code] = trein
+
+        start = time.time()
+        if beleid == 'oud':
+            gc.collect()
+        else:
+            gc_beleid.na_ronde()
+        pauzes.meet((time.time() - start) * 1000)
+
+    sys.stdout.write(pickle.dumps(pauzes.samenvatting(), -1))
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor de pauzes van de Python garbage collector')
+
+    parser.add_argument('-a', '--aantal', action='store', default='60000', help='aantal vertrekken in de stores (standaard 60000, een volledige dag)')
+    parser.add_argument('-s', '--stations', action='store', default='400', help='aantal stations (standaard 400)')
+    parser.add_argument('-p', '--stops', action='store', default='10', help='aantal stations per trein (standaard 10)')
+    parser.add_argument('-r', '--rondes', action='store', default='30', help='aantal GC rondes (standaard 30)')
+    parser.add_argument('-u', '--updates', action='store', default='2000', help='aantal nieuwe treinen per ronde (standaard 2000)')
+    parser.add_argument('--beleid', action='store', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    meting = [int(args.aantal), int(args.stations), int(args.stops), int(args.rondes), int(args.updates)]
+
+    if args.beleid is not None:
+        # Meting in een los proces:
+        meet_beleid(args.beleid, *meting)
+        return
+
+    print "Stores: %s vertrekken, %s stations; %s rondes met %s nieuwe treinen" % (
+        args.aantal, args.stations, args.rondes, args.updates)
+    print
+
+    for beleid in ('oud', 'nieuw'):
+        uitvoer = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+            '-a', args.aantal, '-s', args.stations, '-p', args.stops,
+            '-r', args.rondes, '-u', args.updates, '--beleid', beleid])
+        samenvatting = pickle.loads(uitvoer)
+
+        print "%-6s pauze (ms): p50 %8.2f  p95 %8.2f  p99 %8.2f  max %8.2f  totaal %9.1f" % (
+            beleid + ':', samenvatting['p50'], samenvatting['p95'], samenvatting['p99'],
+            samenvatting['max'], samenvatting['totaal'])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+
+"""
+Test tool om de HTTP interface onder load te testen.
+
+Stuurt met een aantal gelijktijdige threads requests naar een URL van de
+HTTP interface en rapporteert het aantal requests per seconde en de
+latency (p50/p95/p99).
+"""
+
+import argparse
+import threading
+import time
+import urllib2
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='DVS HTTP benchmark. Meet latency van de HTTP interface onder load')
+
+    parser.add_argument('-c', '--concurrency', action='store', default='8', help='aantal gelijktijdige clients (standaard 8)')
+    parser.add_argument('-n', '--requests', action='store', default='200', help='aantal requests per client (standaard 200)')
+    parser.add_argument('-H', '--header', action='append', default=[], help='extra HTTP header, bijvoorbeeld "Accept: application/json"')
+    parser.add_argument('URL', action='store', help='URL, bijvoorbeeld http://localhost:8080/v2/station/ut')
+
+    args = parser.parse_args()
+
+    concurrency = int(args.concurrency)
+    aantal = int(args.requests)
+
+    headers = {}
+    for header in args.header:
+        naam, waarde = header.split(':', 1)
+        headers[naam.strip()] = waarde.strip()
+
+    latencies = []
+    fouten = [0]
+    lock = threading.Lock()
+
+    def client():
+        eigen_latencies = []
+        for _ in range(aantal):
+            start = time.time()
+            try:
+                urllib2.urlopen(urllib2.Request(args.URL, headers=headers), timeout=30).read()
+            except urllib2.HTTPError as error:
+                if error.code != 304:
+                    with lock:
+                        fouten[0] += 1
+            except Exception:
+                with lock:
+                    fouten[0] += 1
+            eigen_latencies.append((time.time() - start) * 1000)
+
+        with lock:
+            latencies.extend(eigen_latencies)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duur = time.time() - start
+
+    latencies.sort()
+
+    print "URL:          %s" % args.URL
+    print "Clients:      %s, requests: %s, fouten: %s" % (concurrency, len(latencies), fouten[0])
+    print "Doorvoer:     %.1f requests/s" % (len(latencies) / duur)
+    print "Latency (ms): p50 %.1f, p95 %.1f, p99 %.1f, max %.1f" % (
+        latencies[len(latencies) / 2],
+        latencies[int(len(latencies) * 0.95)],
+        latencies[int(len(latencies) * 0.99)],
+        latencies[-1])
+
+if __name__ == "__main__":
+    main()
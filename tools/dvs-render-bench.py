@@ -0,0 +1,132 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het renderen van vertrektijden (JSON) in de HTTP interface.
+
+Bouwt een station met een opgegeven aantal treinen (op basis van de
+testdata) en vergelijkt het renderen met json.dumps over verse dicts met
+het samenvoegen van JSON fragmenten per trein: met een lege fragment
+cache, en met een gevulde cache waarin een deel van de treinen gewijzigd is.
+"""
+
+import os
+import sys
+import argparse
+import copy
+import datetime
+import glob
+import json
+import time
+import pytz
+import bottle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import infoplus_dvs
+import dvs_http_interface
+import dvs_json
+
+
+def laad_treinen():
+    """
+    Laad alle treinen uit de testdata
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata')
+    treinen = []
+
+    for bestand in sorted(glob.glob(os.path.join(root, 'formatted', '*.xml'))):
+        with open(bestand) as xml:
+            treinen.append(infoplus_dvs.parse_trein(xml.read()))
+
+    return treinen
+
+
+def maak_station(voorbeelden, aantal):
+    """
+    Maak een station (dict treinnr -> trein) met aantal treinen
+    """
+
+    station = {}
+    for nummer in range(aantal):
+        trein = copy.deepcopy(voorbeelden[nummer % len(voorbeelden)])
+        trein.treinnr = str(100000 + nummer)
+        trein.rit_id = trein.treinnr
+        station[trein.treinnr] = trein
+
+    return station
+
+
+def meet(functie, herhalingen):
+    """
+    Geef de gemiddelde duur van functie() in ms
+    """
+
+    start = time.time()
+    for _ in range(herhalingen):
+        functie()
+
+    return (time.time() - start) * 1000 / herhalingen
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor het renderen van vertrektijden')
+
+    parser.add_argument('-a', '--aantallen', action='store', default='100,250,500', help='kommagescheiden aantallen treinen per station (standaard 100,250,500)')
+    parser.add_argument('-n', '--herhalingen', action='store', default='50', help='aantal herhalingen per meting (standaard 50)')
+    parser.add_argument('-g', '--gewijzigd', action='store', default='10', help='percentage gewijzigde treinen bij gevulde cache (standaard 10)')
+    parser.add_argument('-v', '--verbose', dest='verbose', action='store_true', help='verbose vertrektijden (met materieel)')
+    parser.add_argument('-f', '--velden', action='store', default=None, help='kommagescheiden velden voor de fragmenten (standaard alle velden)')
+
+    args = parser.parse_args()
+
+    herhalingen = int(args.herhalingen)
+    gewijzigd = int(args.gewijzigd)
+
+    bottle.request.bind({'QUERY_STRING': 'verbose=true' if args.verbose else ''})
+    verbose = args.verbose
+    velden = tuple(sorted(args.velden.split(','))) if args.velden is not None else None
+    tijd_nu = datetime.datetime.now(pytz.utc)
+    voorbeelden = laad_treinen()
+
+    print "JSON encoder: %s, verbose: %s, gewijzigd bij gevulde cache: %s%%, velden: %s" % (
+        dvs_json.ENCODER, args.verbose, gewijzigd, ','.join(velden) if velden is not None else 'alle')
+    print "Treinen  json.dumps (dicts)  fragmenten (leeg)  fragmenten (gevuld)"
+
+    for aantal in [int(aantal) for aantal in args.aantallen.split(',')]:
+        treinen = maak_station(voorbeelden, aantal)
+
+        def dicts():
+            json.dumps({'result': 'OK', 'system_status': 'UP',
+                'vertrektijden': dvs_http_interface._vertrektijden(treinen, 'nl', tijd_nu)})
+
+        def fragmenten():
+            '{"result": "OK", "system_status": %s, "vertrektijden": [%s]}' % (
+                dvs_json.dumps('UP'), ', '.join(dvs_http_interface._vertrektijden_fragmenten(treinen, 'nl', tijd_nu, None, verbose, velden)))
+
+        def fragmenten_leeg():
+            dvs_http_interface._fragment_cache = None
+            fragmenten()
+
+        # Wijzig een deel van de treinen voor iedere meting met gevulde cache:
+        te_wijzigen = sorted(treinen.values(), key=lambda trein: trein.treinnr)[:aantal * gewijzigd / 100]
+
+        def fragmenten_gevuld():
+            for trein in te_wijzigen:
+                trein.rit_timestamp = trein.rit_timestamp + datetime.timedelta(seconds=1)
+            fragmenten()
+
+        duur_dicts = meet(dicts, herhalingen)
+        duur_leeg = meet(fragmenten_leeg, herhalingen)
+        fragmenten()
+        duur_gevuld = meet(fragmenten_gevuld, herhalingen)
+
+        print "%7s  %15.2f ms  %14.2f ms  %16.2f ms" % (aantal, duur_dicts, duur_leeg, duur_gevuld)
+
+if __name__ == "__main__":
+    main()
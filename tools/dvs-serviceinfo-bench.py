@@ -0,0 +1,150 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het koppelen van DVS stopstations aan serviceinfo stops
+(stopstations_to_list en serviceinfo_to_dict in dvs_http_parsers).
+
+Start een lokale vervanger van de rdt-serviceinfo API die lange ritten
+met twee vleugels teruggeeft (zoals internationale treinen), haalt deze
+eenmaal op (daarna uit de cache) en meet de tijd per request voor beide
+functies bij verschillende routelengtes.
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import infoplus_dvs
+import dvs_http_parsers
+
+
+def stop(code):
+    """
+    Maak een serviceinfo stop voor een station
+    """
+
+    return {
+        'station': code, 'station_name': 'Station %s' % code,
+        'arrival_time': '2015-01-01T10:00:00+01:00', 'departure_time': '2015-01-01T10:01:00+01:00',
+        'arrival_delay': 0, 'departure_delay': 0,
+        'scheduled_arrival_platform': '1', 'actual_arrival_platform': None,
+        'scheduled_departure_platform': '1', 'actual_departure_platform': '2',
+        'cancelled_arrival': False, 'cancelled_departure': False}
+
+
+def services(lengte):
+    """
+    Geef twee vleugels van lengte stops, die de eerste helft van de route
+    gemeenschappelijk hebben
+    """
+
+    gemeenschappelijk = ['s%d' % nr for nr in range(lengte / 2)]
+    vleugel_a = gemeenschappelijk + ['a%d' % nr for nr in range(lengte - lengte / 2)]
+    vleugel_b = gemeenschappelijk + ['b%d' % nr for nr in range(lengte - lengte / 2)]
+
+    return [{
+        'service_number': str(lengte), 'cancelled': False, 'company_name': 'NS',
+        'transport_mode': 'ICE', 'transport_mode_description': 'ICE International',
+        'stops': [stop(code) for code in vleugel]} for vleugel in (vleugel_a, vleugel_b)]
+
+
+class ServiceinfoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Beantwoordt /service/<ritdatum>/<lengte> met een rit van lengte stops
+    """
+
+    def do_GET(self):
+        lengte = int(self.path.strip('/').split('/')[-1])
+        body = json.dumps({'services': services(lengte)})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def meet(functie, herhalingen):
+    """
+    Geef de gemiddelde duur van functie() in ms
+    """
+
+    start = time.time()
+    for _ in range(herhalingen):
+        functie()
+
+    return (time.time() - start) * 1000 / herhalingen
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor het koppelen van stopstations aan serviceinfo')
+
+    parser.add_argument('-p', '--port', action='store', default='8191', help='poort voor de lokale serviceinfo server (standaard 8191)')
+    parser.add_argument('-l', '--lengtes', action='store', default='10,40,100,200', help='kommagescheiden routelengtes (standaard 10,40,100,200)')
+    parser.add_argument('-n', '--herhalingen', action='store', default='200', help='aantal herhalingen per meting (standaard 200)')
+
+    args = parser.parse_args()
+
+    server = ThreadedServer(('127.0.0.1', int(args.port)), ServiceinfoHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    serviceinfo_config = {
+        'enabled': True,
+        'url': 'http://127.0.0.1:%s/' % args.port,
+        'cache_ttl': 3600
+    }
+
+    herhalingen = int(args.herhalingen)
+
+    print "Routelengte  stopstations_to_list (2 vleugels)  serviceinfo_to_dict"
+
+    for lengte in [int(lengte) for lengte in args.lengtes.split(',')]:
+        treinnr = str(lengte)
+        ritdatum = '2015-01-01'
+
+        # Vul de cache:
+        serviceinfo = dvs_http_parsers.retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config)
+
+        # DVS stopstations per vleugel (in DVS hoofdletters, zonder vertrekstation):
+        vleugels = []
+        for service in serviceinfo:
+            vleugels.append([infoplus_dvs.Station(stop_data['station'].upper(), stop_data['station_name'])
+                for stop_data in service['stops'][1:]])
+
+        def stopstations():
+            for stations in vleugels:
+                dvs_http_parsers.stopstations_to_list(stations, treinnr, ritdatum, serviceinfo_config)
+
+        def serviceinfo_dict():
+            dvs_http_parsers.serviceinfo_to_dict(
+                dvs_http_parsers.retrieve_serviceinfo(treinnr, ritdatum, serviceinfo_config),
+                'S%d' % (lengte / 4), negeer_stops_tm=True)
+
+        print "%11s  %30.3f ms  %16.3f ms" % (lengte, meet(stopstations, herhalingen),
+            meet(serviceinfo_dict, herhalingen))
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
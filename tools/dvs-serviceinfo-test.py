@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+
+"""
+Test tool voor de serviceinfo cache in dvs_http_parsers.
+
+Start een lokale vervanger van de rdt-serviceinfo API (met instelbare
+vertraging) en controleert dat herhaalde en gelijktijdige aanvragen voor
+dezelfde rit een enkele HTTP request opleveren, dat niet gevonden ritten
+(404) gecached worden, en dat de TTL en de maximale grootte van de cache
+gerespecteerd worden.
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dvs_http_parsers
+
+
+class ServiceinfoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Beantwoordt /service/<ritdatum>/<treinnr>: treinnummers onder de
+    10000 bestaan, overige treinnummers geven een 404
+    """
+
+    vertraging = 0.2
+    requests = []
+
+    def do_GET(self):
+        ServiceinfoHandler.requests.append(self.path)
+        time.sleep(self.vertraging)
+
+        delen = self.path.strip('/').split('/')
+        if len(delen) != 3 or delen[0] != 'service' or int(delen[2]) >= 10000:
+            self.send_error(404)
+            return
+
+        body = json.dumps({'services': [{
+            'service_number': delen[2],
+            'stops': [{'station': 'ut', 'station_name': 'Utrecht Centraal'}]}]})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Test de serviceinfo cache tegen een lokale serviceinfo server')
+
+    parser.add_argument('-p', '--port', action='store', default='8190', help='poort voor de lokale serviceinfo server (standaard 8190)')
+    parser.add_argument('-v', '--vertraging', action='store', default='0.2', help='vertraging per request in seconden (standaard 0.2)')
+    parser.add_argument('-c', '--concurrency', action='store', default='20', help='aantal gelijktijdige aanvragen (standaard 20)')
+
+    args = parser.parse_args()
+
+    ServiceinfoHandler.vertraging = float(args.vertraging)
+    server = ThreadedServer(('127.0.0.1', int(args.port)), ServiceinfoHandler)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    serviceinfo_config = {
+        'enabled': True,
+        'url': 'http://127.0.0.1:%s/' % args.port,
+        'cache_ttl': 2,
+        'cache_ttl_niet_gevonden': 2,
+        'cache_max_items': 10
+    }
+
+    fouten = [0]
+
+    def controleer(omschrijving, conditie):
+        if conditie:
+            print "OK    %s" % omschrijving
+        else:
+            print "FOUT  %s" % omschrijving
+            fouten[0] += 1
+
+    def aantal_requests():
+        return len(ServiceinfoHandler.requests)
+
+    # Gelijktijdige aanvragen voor dezelfde rit:
+    resultaten = []
+    threads = [threading.Thread(target=lambda: resultaten.append(
+            dvs_http_parsers.retrieve_serviceinfo('1234', '2015-01-01', serviceinfo_config)))
+        for _ in range(int(args.concurrency))]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duur_koud = time.time() - start
+
+    controleer("%s gelijktijdige aanvragen, %s request(s) naar serviceinfo (%.0f ms)" % (
+        len(threads), aantal_requests(), duur_koud * 1000), aantal_requests() == 1)
+    controleer("alle aanvragen krijgen de rit", all(
+        resultaat is not None and resultaat[0]['service_number'] == '1234' for resultaat in resultaten))
+
+    # Herhaalde aanvraag uit de cache:
+    start = time.time()
+    dvs_http_parsers.retrieve_serviceinfo('1234', '2015-01-01', serviceinfo_config)
+    duur_warm = time.time() - start
+
+    controleer("herhaalde aanvraag uit de cache (%.2f ms)" % (duur_warm * 1000), aantal_requests() == 1)
+
+    # Andere ritdatum is een andere rit:
+    dvs_http_parsers.retrieve_serviceinfo('1234', '2015-01-02', serviceinfo_config)
+    controleer("andere ritdatum wordt apart opgehaald", aantal_requests() == 2)
+
+    # Niet gevonden ritten (404) worden ook gecached:
+    niet_gevonden = [dvs_http_parsers.retrieve_serviceinfo('99999', '2015-01-01', serviceinfo_config)
+        for _ in range(3)]
+    controleer("niet gevonden rit: 1 request voor 3 aanvragen",
+        aantal_requests() == 3 and niet_gevonden == [None, None, None])
+
+    # Na de TTL wordt de rit opnieuw opgehaald:
+    time.sleep(serviceinfo_config['cache_ttl'] + 0.1)
+    dvs_http_parsers.retrieve_serviceinfo('1234', '2015-01-01', serviceinfo_config)
+    controleer("na TTL opnieuw opgehaald", aantal_requests() == 4)
+
+    # Maximale grootte van de cache:
+    for treinnr in range(100, 100 + serviceinfo_config['cache_max_items'] + 5):
+        dvs_http_parsers.retrieve_serviceinfo(str(treinnr), '2015-01-01', serviceinfo_config)
+
+    stats = dvs_http_parsers.serviceinfo_stats()
+    controleer("cache begrensd op %s items (%s items)" % (
+        serviceinfo_config['cache_max_items'], stats['cache']['items']),
+        stats['cache']['items'] == serviceinfo_config['cache_max_items'])
+
+    print "--------------------------------"
+    print "Statistieken: %s" % stats
+
+    server.shutdown()
+
+    if fouten[0] > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
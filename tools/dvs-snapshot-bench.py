@@ -0,0 +1,178 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het inlezen van de stores bij het opstarten van de daemon.
+
+Bouwt een trein- en station store ter grootte van een volledige dag (op
+basis van de testdata) en slaat deze op als pickle dumps (zoals oudere
+versies van de daemon bij afsluiten deden) en als snapshot (dvs_snapshot).
+Het inlezen wordt per methode gemeten in een los proces, zodat ook het
+piekgeheugen per methode vergeleken kan worden:
+- pickle: pickle.load van station.store en trein.store
+- snapshot: dvs_snapshot.laad
+- threads: chunks van het snapshot parallel inlezen met een aantal threads
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import gc
+import imp
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import cPickle as pickle
+from multiprocessing.pool import ThreadPool
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dvs_snapshot
+
+# Stores bouwen zoals in de WAL benchmark:
+wal_bench = imp.load_source('wal_bench',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dvs-wal-bench.py'))
+
+
+def laad_pickle(directory):
+    """
+    Laad de stores uit pickle dumps
+    """
+
+    with open(os.path.join(directory, 'station.store'), 'rb') as bestand:
+        station_store = pickle.load(bestand)
+    with open(os.path.join(directory, 'trein.store'), 'rb') as bestand:
+        trein_store = pickle.load(bestand)
+
+    return station_store, trein_store
+
+
+def laad_threads(directory, threads):
+    """
+    Laad de chunks van het snapshot parallel, ieder in een eigen
+    bestandshandle, en bouw daarna de stores op (met de garbage collector
+    uit, zoals dvs_snapshot.laad)
+    """
+
+    gc.disable()
+
+    pad = os.path.join(directory, 'stores.snapshot')
+
+    with open(pad, 'rb') as bestand:
+        index = dvs_snapshot.lees_index(bestand)
+    stations = dvs_snapshot.maak_stations(index)
+
+    def laad_chunk(nummer):
+        with open(pad, 'rb') as bestand:
+            return dvs_snapshot.laad_chunk(bestand, index, stations, nummer)
+
+    station_store = {}
+    trein_store = {}
+
+    pool = ThreadPool(threads)
+    for chunk in pool.imap(laad_chunk, range(len(index['chunks']))):
+        for station_code, treinnr, trein, in_station, in_trein in chunk:
+            if in_station:
+                station_store.setdefault(station_code, {})[treinnr] = trein
+            if in_trein:
+                trein_store.setdefault(treinnr, {})[station_code] = trein
+    pool.close()
+
+    gc.enable()
+
+    return station_store, trein_store
+
+
+def meet_laden(methode, directory, threads):
+    """
+    Laad de stores met methode in dit proces, en print duur, piekgeheugen
+    en grootte van de stores
+    """
+
+    start = time.time()
+
+    if methode == 'pickle':
+        station_store, trein_store = laad_pickle(directory)
+    elif methode == 'snapshot':
+        station_store, trein_store, _ = dvs_snapshot.laad(os.path.join(directory, 'stores.snapshot'))
+    else:
+        station_store, trein_store = laad_threads(directory, threads)
+
+    duur = time.time() - start
+    geheugen = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    print duur, geheugen, sum(len(treinen) for treinen in station_store.values()), len(trein_store)
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor het inlezen van de stores bij het opstarten')
+
+    parser.add_argument('-a', '--aantal', action='store', default='60000', help='aantal vertrekken in de stores (standaard 60000, een volledige dag)')
+    parser.add_argument('-s', '--stations', action='store', default='400', help='aantal stations (standaard 400)')
+    parser.add_argument('-p', '--stops', action='store', default='10', help='aantal stations per trein (standaard 10)')
+    parser.add_argument('-t', '--threads', action='store', default='4', help='aantal threads voor parallel inlezen (standaard 4)')
+    parser.add_argument('-m', '--methoden', action='store', default='pickle,snapshot,threads', help='kommagescheiden methoden (standaard pickle,snapshot,threads)')
+    parser.add_argument('--laad', nargs=2, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.laad is not None:
+        # Meting in een los proces:
+        meet_laden(args.laad[0], args.laad[1], int(args.threads))
+        return
+
+    aantal = int(args.aantal)
+    directory = tempfile.mkdtemp(prefix='dvs-snapshot-bench-')
+
+    try:
+        voorbeelden = wal_bench.laad_treinen()
+        station_store, trein_store = wal_bench.maak_stores(voorbeelden, aantal,
+            int(args.stations), int(args.stops), datetime.datetime.now(pytz.utc))
+
+        print "Stores: %s stations, %s treinen, %s vertrekken" % (len(station_store), len(trein_store), aantal)
+        print
+
+        start = time.time()
+        with open(os.path.join(directory, 'station.store'), 'wb') as bestand:
+            pickle.dump(station_store, bestand, -1)
+        with open(os.path.join(directory, 'trein.store'), 'wb') as bestand:
+            pickle.dump(trein_store, bestand, -1)
+        duur_pickle = time.time() - start
+
+        start = time.time()
+        dvs_snapshot.schrijf(os.path.join(directory, 'stores.snapshot'), station_store, trein_store)
+        duur_snapshot = time.time() - start
+
+        del station_store, trein_store, voorbeelden
+
+        grootte_pickle = sum(os.path.getsize(os.path.join(directory, naam))
+            for naam in ('station.store', 'trein.store'))
+        grootte_snapshot = os.path.getsize(os.path.join(directory, 'stores.snapshot'))
+
+        print "Opslaan   pickle:   %6.2fs  %7.1f MB" % (duur_pickle, grootte_pickle / 1048576.0)
+        print "Opslaan   snapshot: %6.2fs  %7.1f MB" % (duur_snapshot, grootte_snapshot / 1048576.0)
+
+        for methode in args.methoden.split(','):
+            uitvoer = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                '--threads', args.threads, '--laad', methode, directory])
+            duur, geheugen, vertrekken, treinen = uitvoer.split()
+
+            if int(vertrekken) != aantal:
+                print "Fout: %s laadt %s vertrekken in plaats van %s" % (methode, vertrekken, aantal)
+                sys.exit(1)
+
+            print "Inlezen   %-9s %6.2fs  piekgeheugen %7.1f MB" % (methode + ':', float(duur), float(geheugen))
+
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
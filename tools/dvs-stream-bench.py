@@ -0,0 +1,123 @@
+#!/usr/bin/env python2
+
+"""
+Belastingstest voor de stationsstreams (server-sent events) van de
+HTTP interface. Opent een opgegeven aantal gelijktijdige streams, verdeeld
+over een of meer stations, en telt gedurende de testduur de ontvangen
+events per soort, de tijd tot het eerste volledige station en de fouten.
+"""
+
+import argparse
+import socket
+import threading
+import time
+import urlparse
+
+
+class Stream(threading.Thread):
+    """
+    Een enkele stream (ruwe socket, om niet per regel te bufferen)
+    """
+
+    def __init__(self, host, port, pad, einde):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.host = host
+        self.port = port
+        self.pad = pad
+        self.einde = einde
+
+        self.events = {}
+        self.eerste_bord = None
+        self.fout = None
+
+    def run(self):
+        start = time.time()
+
+        try:
+            verbinding = socket.create_connection((self.host, self.port), 10)
+            verbinding.sendall('GET %s HTTP/1.1\r\nHost: %s\r\nAccept: text/event-stream\r\n\r\n'
+                % (self.pad, self.host))
+
+            buffer = ''
+            while time.time() < self.einde:
+                verbinding.settimeout(max(0.1, self.einde - time.time()))
+                try:
+                    data = verbinding.recv(65536)
+                except socket.timeout:
+                    break
+
+                if data == '':
+                    self.fout = 'verbinding gesloten'
+                    break
+
+                buffer += data
+                while '\n\n' in buffer:
+                    blok, buffer = buffer.split('\n\n', 1)
+                    for regel in blok.split('\n'):
+                        if regel.startswith('event: '):
+                            soort = regel[7:].strip()
+                            self.events[soort] = self.events.get(soort, 0) + 1
+                            if soort == 'bord' and self.eerste_bord is None:
+                                self.eerste_bord = time.time() - start
+
+            verbinding.close()
+        except Exception as e:
+            self.fout = str(e)
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Belastingstest voor stationsstreams van de HTTP interface')
+
+    parser.add_argument('-u', '--url', action='store', default='http://127.0.0.1:8080', help='basis-URL van de HTTP interface (standaard http://127.0.0.1:8080)')
+    parser.add_argument('-s', '--stations', action='store', default='UT,ASD,RTD,GVC,EHV', help='kommagescheiden stations (standaard UT,ASD,RTD,GVC,EHV)')
+    parser.add_argument('-n', '--streams', action='store', default='500', help='aantal gelijktijdige streams (standaard 500)')
+    parser.add_argument('-d', '--duur', action='store', default='30', help='testduur in seconden (standaard 30)')
+
+    args = parser.parse_args()
+
+    url = urlparse.urlparse(args.url)
+    stations = args.stations.split(',')
+    aantal = int(args.streams)
+    duur = int(args.duur)
+
+    einde = time.time() + duur
+    streams = []
+
+    for nummer in range(aantal):
+        stream = Stream(url.hostname, url.port or 80,
+            '%s/v2/station/%s/stream' % (url.path.rstrip('/'), stations[nummer % len(stations)]), einde)
+        stream.start()
+        streams.append(stream)
+
+    for stream in streams:
+        stream.join()
+
+    totalen = {}
+    for stream in streams:
+        for soort, waarde in stream.events.items():
+            totalen[soort] = totalen.get(soort, 0) + waarde
+
+    eerste = sorted(stream.eerste_bord for stream in streams if stream.eerste_bord is not None)
+    fouten = [stream.fout for stream in streams if stream.fout is not None]
+
+    print "Streams: %s, stations: %s, duur: %ss" % (aantal, len(stations), duur)
+    for soort in sorted(totalen):
+        print "  %-12s %8s (%.1f/s)" % (soort, totalen[soort], float(totalen[soort]) / duur)
+
+    if len(eerste) > 0:
+        print "Eerste bord: p50 %.3fs, max %.3fs (%s streams)" % (
+            eerste[len(eerste) / 2], eerste[-1], len(eerste))
+
+    print "Fouten: %s" % len(fouten)
+    for fout in sorted(set(fouten))[:5]:
+        print "  %s" % fout
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python2
+
+"""
+Benchmark voor het herstellen van de stores uit het write-ahead log.
+
+Bouwt een trein- en station store ter grootte van een volledige dag (op
+basis van de testdata), schrijft daarvan een snapshot en een logstaart met
+updates, en meet hoe lang het herstellen (snapshot inlezen en log afspelen)
+duurt. Ter vergelijking wordt ook het inlezen van de losse pickle dumps
+gemeten, zoals de daemon met --laad-stations en --laad-treinen doet.
+"""
+
+import os
+import sys
+import argparse
+import datetime
+import glob
+import random
+import shutil
+import tempfile
+import time
+import cPickle as pickle
+import pytz
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import infoplus_dvs
+import dvs_wal
+
+
+def laad_treinen():
+    """
+    Laad alle treinen uit de testdata
+    """
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata')
+    treinen = []
+
+    for bestand in sorted(glob.glob(os.path.join(root, 'formatted', '*.xml'))):
+        with open(bestand) as xml:
+            treinen.append(pickle.dumps(infoplus_dvs.parse_trein(xml.read()), -1))
+
+    return treinen
+
+
+def maak_trein(voorbeelden, nummer, station_code, tijd_nu):
+    """
+    Maak een kopie van een voorbeeldtrein voor treinnummer en station
+    """
+
+    trein = pickle.loads(voorbeelden[nummer % len(voorbeelden)])
+    trein.treinnr = str(100000 + nummer)
+    trein.rit_id = trein.treinnr
+    trein.rit_station = infoplus_dvs.Station(station_code, station_code)
+    trein.vertrek = tijd_nu + datetime.timedelta(seconds=nummer % 86400)
+    trein.rit_timestamp = tijd_nu
+
+    return trein
+
+
+def maak_stores(voorbeelden, aantal, stations, stops, tijd_nu):
+    """
+    Maak station store en trein store met in totaal aantal vertrekken,
+    verdeeld over stations, met stops stations per trein
+    """
+
+    station_store = {}
+    trein_store = {}
+
+    for vertrek in range(aantal):
+        nummer = vertrek // stops
+        station_code = 'S%03d' % ((nummer * 7 + vertrek) % stations)
+        trein = maak_trein(voorbeelden, nummer, station_code, tijd_nu)
+
+        station_store.setdefault(station_code, {})[trein.treinnr] = trein
+        trein_store.setdefault(trein.treinnr, {})[station_code] = trein
+
+    return station_store, trein_store
+
+
+def main():
+    """
+    Main functie
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark voor herstel van de stores uit snapshot en write-ahead log')
+
+    parser.add_argument('-a', '--aantal', action='store', default='60000', help='aantal vertrekken in de stores (standaard 60000, een volledige dag)')
+    parser.add_argument('-s', '--stations', action='store', default='400', help='aantal stations (standaard 400)')
+    parser.add_argument('-p', '--stops', action='store', default='10', help='aantal stations per trein (standaard 10)')
+    parser.add_argument('-l', '--log', action='store', default='5000', help='aantal records in de logstaart (standaard 5000)')
+    parser.add_argument('-f', '--fsync', action='store', default='100', help='aantal records per fsync (standaard 100)')
+    parser.add_argument('-d', '--directory', action='store', default=None, help='directory voor snapshot en log (standaard tijdelijk)')
+
+    args = parser.parse_args()
+
+    aantal = int(args.aantal)
+    log_records = int(args.log)
+    per_fsync = int(args.fsync)
+    tijd_nu = datetime.datetime.now(pytz.utc)
+
+    directory = args.directory or tempfile.mkdtemp(prefix='dvs-wal-bench-')
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+
+    voorbeelden = laad_treinen()
+
+    start = time.time()
+    station_store, trein_store = maak_stores(voorbeelden, aantal, int(args.stations), int(args.stops), tijd_nu)
+    print "Stores gemaakt: %s stations, %s treinen, %s vertrekken (%.1fs)" % (
+        len(station_store), len(trein_store), aantal, time.time() - start)
+
+    try:
+        # Oude situatie: losse pickle dumps per store:
+        start = time.time()
+        with open(os.path.join(tempfile.gettempdir(), 'dvs-wal-bench-station.store'), 'wb') as bestand:
+            pickle.dump(station_store, bestand, -1)
+        with open(os.path.join(tempfile.gettempdir(), 'dvs-wal-bench-trein.store'), 'wb') as bestand:
+            pickle.dump(trein_store, bestand, -1)
+        duur_dump = time.time() - start
+
+        start = time.time()
+        for naam in ('station', 'trein'):
+            with open(os.path.join(tempfile.gettempdir(), 'dvs-wal-bench-%s.store' % naam), 'rb') as bestand:
+                pickle.load(bestand)
+        duur_laad = time.time() - start
+
+        # Snapshot:
+        wal = dvs_wal.WriteAheadLog(directory)
+        wal.open(1)
+
+        start = time.time()
+        segment = wal.roteer()
+        wal.schrijf_snapshot(station_store, trein_store, segment)
+        duur_snapshot = time.time() - start
+
+        # Logstaart met updates van bestaande vertrekken:
+        vertrekken = [(station_code, treinnr) for station_code, treinen in station_store.items()
+            for treinnr in treinen]
+        willekeurig = random.Random(42)
+
+        start = time.time()
+        for record in range(log_records):
+            station_code, treinnr = willekeurig.choice(vertrekken)
+            trein = maak_trein(voorbeelden, int(treinnr) - 100000, station_code, tijd_nu)
+            trein.rit_timestamp = tijd_nu + datetime.timedelta(seconds=record + 1)
+
+            dvs_wal.pas_toe(('zet', station_code, treinnr, trein, True, True), station_store, trein_store)
+            wal.schrijf(('zet', station_code, treinnr, trein, True, True))
+
+            if record % per_fsync == per_fsync - 1:
+                wal.sync()
+        wal.sluit()
+        duur_log = time.time() - start
+
+        # Herstel (zonder de originele stores in het geheugen):
+        aantal_treinen = len(trein_store)
+        del station_store, trein_store, vertrekken
+
+        start = time.time()
+        hersteld_station, hersteld_trein = dvs_wal.WriteAheadLog(directory).herstel()
+        duur_herstel = time.time() - start
+
+        if sum(len(treinen) for treinen in hersteld_station.values()) != aantal \
+            or len(hersteld_trein) != aantal_treinen:
+            print "Fout: herstelde stores wijken af"
+            sys.exit(1)
+
+        snapshot_grootte = os.path.getsize(os.path.join(directory, dvs_wal.SNAPSHOT_BESTAND))
+
+        print "Pickle dumps (oud):     opslaan %6.2fs   inlezen %6.2fs" % (duur_dump, duur_laad)
+        print "Snapshot:               schrijven %4.2fs   %.1f MB" % (duur_snapshot, snapshot_grootte / 1048576.0)
+        print "Logstaart:              %s records in %.2fs (%.0f/s), %.1f MB, fsync per %s" % (
+            log_records, duur_log, log_records / duur_log, wal.bytes / 1048576.0, per_fsync)
+        print "Herstel (snapshot+log): %6.2fs" % duur_herstel
+
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+        for naam in ('station', 'trein'):
+            pad = os.path.join(tempfile.gettempdir(), 'dvs-wal-bench-%s.store' % naam)
+            if os.path.exists(pad):
+                os.remove(pad)
+
+if __name__ == "__main__":
+    main()